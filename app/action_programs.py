@@ -0,0 +1,183 @@
+"""Ahead-of-time validation and caching of browser action programs."""
+
+import hashlib
+import json
+import os
+
+from lxml import etree
+
+from app import browser_waits, profiling
+from core_utilities import errors
+from core_utilities.config_validation import evaluate_value
+
+# Commands whose first argument is not an XPath expression.
+NON_XPATH_KEYS = {"get", "sleep", "for", "refresh", "await_stable"}
+# Commands whose first argument is a duration in seconds.
+DURATION_KEYS = {"sleep", "await_stable"}
+# Commands that accept an optional trailing timeout in seconds.
+OPTIONAL_TIMEOUT_KEYS = {"wait_absent", "await_present", "await_absent"}
+
+
+def get_cache_path(trade):
+    """Return the path of the compiled action program cache."""
+    return os.path.join(trade.config_directory, "action_programs.json")
+
+
+def _is_number(value):
+    """Return whether the value parses as a float."""
+    try:
+        float(value)
+    except (TypeError, ValueError):
+        return False
+    return True
+
+
+def _validate_instruction(instruction, instruction_items, is_nested):
+    """Return the problems of one instruction, excluding nested bodies."""
+    if not isinstance(instruction, (list, tuple)) or not instruction:
+        return ["instruction is not a non-empty tuple"]
+
+    key = instruction[0]
+    if key not in instruction_items["all_keys"]:
+        return [f"unknown command {key!r}"]
+    if is_nested and key in browser_waits.COMMANDS:
+        return [f"{key!r} is only supported outside 'exist' and 'for'"]
+
+    if key in instruction_items["control_flow_keys"]:
+        lengths = {3}
+    elif key in instruction_items["no_value_keys"]:
+        lengths = {1}
+    elif key in instruction_items["additional_value_keys"]:
+        lengths = {3}
+    elif key in OPTIONAL_TIMEOUT_KEYS:
+        lengths = {2, 3}
+    else:
+        lengths = {2}
+    if len(instruction) not in lengths:
+        expected = " or ".join(str(length - 1) for length in sorted(lengths))
+        return [
+            f"{key!r} takes {expected} argument(s),"
+            f" got {len(instruction) - 1}"
+        ]
+
+    problems = []
+    if len(instruction) > 1 and not isinstance(instruction[1], str):
+        problems.append(f"{key!r} argument is not a string")
+    elif key not in NON_XPATH_KEYS and len(instruction) > 1:
+        try:
+            etree.XPath(instruction[1])
+        except etree.XPathSyntaxError as e:
+            problems.append(f"invalid XPath {instruction[1]!r}: {e}")
+    if key in DURATION_KEYS and not _is_number(instruction[1]):
+        problems.append(f"{key!r} duration {instruction[1]!r} is not a number")
+    if (
+        key in OPTIONAL_TIMEOUT_KEYS
+        and len(instruction) == 3
+        and not _is_number(instruction[2])
+    ):
+        problems.append(f"{key!r} timeout {instruction[2]!r} is not a number")
+    if key in instruction_items["control_flow_keys"] and not isinstance(
+        instruction[2], (list, tuple)
+    ):
+        problems.append(f"{key!r} body is not a list of instructions")
+    return problems
+
+
+def _compile(program, instruction_items, path, problems, is_nested=False):
+    """Normalize a program and collect problems with instruction paths."""
+    if not isinstance(program, (list, tuple)):
+        problems.append(f"{path}: program is not a list of instructions")
+        return []
+
+    compiled = []
+    for index, instruction in enumerate(program, 1):
+        location = f"{path}[{index}]"
+        instruction_problems = _validate_instruction(
+            instruction, instruction_items, is_nested
+        )
+        problems.extend(
+            f"{location} {instruction!r}: {problem}"
+            for problem in instruction_problems
+        )
+        if instruction_problems:
+            continue
+
+        if instruction[0] in instruction_items["control_flow_keys"]:
+            instruction = (
+                instruction[0],
+                instruction[1],
+                _compile(
+                    instruction[2],
+                    instruction_items,
+                    location,
+                    problems,
+                    is_nested=True,
+                ),
+            )
+        compiled.append(tuple(instruction))
+    return compiled
+
+
+def compile_program(name, action, instruction_items):
+    """Validate an action program and return its instruction list."""
+    program = evaluate_value(action) if isinstance(action, str) else action
+    problems = []
+    compiled = _compile(program, instruction_items, name, problems)
+    if problems:
+        raise errors.ConfigBuildError(
+            "Invalid browser action program:\n" + "\n".join(problems)
+        )
+    return compiled
+
+
+def _from_json(program):
+    """Restore instruction tuples from their JSON lists."""
+    return [
+        tuple(
+            _from_json(value) if isinstance(value, list) else value
+            for value in instruction
+        )
+        for instruction in program
+    ]
+
+
+def _get_section_hash(section, instruction_items):
+    """Return a digest of the action section and the known commands."""
+    digest = hashlib.sha256()
+    for value in (
+        sorted(instruction_items["all_keys"]),
+        sorted((option, section[option]) for option in section),
+    ):
+        digest.update(repr(value).encode())
+    return digest.hexdigest()
+
+
+def load_programs(section, instruction_items, cache_path):
+    """Return all compiled programs of the section, compiling on change."""
+    section_hash = _get_section_hash(section, instruction_items)
+    try:
+        with open(cache_path, encoding="utf-8") as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        cache = {}
+    if cache.get("hash") == section_hash:
+        return {
+            name: _from_json(program)
+            for name, program in cache["programs"].items()
+        }
+
+    with profiling.span("compile action programs", "config"):
+        programs = {
+            option: compile_program(option, section[option], instruction_items)
+            for option in section
+        }
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    temporary_path = f"{cache_path}.tmp"
+    with open(temporary_path, "w", encoding="utf-8") as f:
+        json.dump(
+            {"hash": section_hash, "programs": programs},
+            f,
+            ensure_ascii=False,
+        )
+    os.replace(temporary_path, cache_path)
+    return programs
@@ -0,0 +1,200 @@
+"""Offline simulation of browser action programs on recorded snapshots."""
+
+import json
+import os
+import time
+from urllib.parse import urljoin, urldefrag
+
+from charset_normalizer import from_bytes
+from lxml import etree, html
+
+from core_utilities.errors import BrowserAutomationError, ConfigBuildError
+
+MANIFEST_NAME = "snapshots.json"
+
+
+class _Page:
+    """Hold a parsed snapshot and the URL it was recorded at."""
+
+    def __init__(self, url, name, tree):
+        """Initialize the page."""
+        self.url = url
+        self.name = name
+        self.tree = tree
+
+
+class ActionSimulator:
+    """Run action programs against HTML snapshots parsed with lxml.
+
+    The snapshot directory contains HTML files and a snapshots.json
+    manifest that maps URLs to files under "pages" and, optionally, the
+    XPaths of clicks that lead to another file under "transitions":
+
+        {"pages": {"https://example.com/": "home.html"},
+         "transitions": {"home.html": {"//button": "next.html"}}}
+
+    Clicks on links and submit controls follow their target URL when it has
+    a snapshot.
+    """
+
+    def __init__(self, snapshot_directory):
+        """Load the manifest of the snapshot directory."""
+        self.snapshot_directory = snapshot_directory
+        manifest_path = os.path.join(snapshot_directory, MANIFEST_NAME)
+        try:
+            with open(manifest_path, encoding="utf-8") as f:
+                manifest = json.load(f)
+        except (OSError, ValueError) as e:
+            raise ConfigBuildError(
+                f"Unable to read snapshot manifest {manifest_path}: {e}"
+            ) from e
+        self.pages = {
+            urldefrag(url).url: name
+            for url, name in manifest.get("pages", {}).items()
+        }
+        self.transitions = manifest.get("transitions", {})
+        self.trees = {}
+        self.page = None
+        self.problems = []
+        self.steps = 0
+
+    def _load(self, url, name):
+        """Make the snapshot file the current page."""
+        if name not in self.trees:
+            path = os.path.join(self.snapshot_directory, name)
+            with open(path, "rb") as f:
+                content = f.read()
+            matched = from_bytes(content).best()
+            self.trees[name] = html.document_fromstring(
+                content.decode(matched.encoding if matched else "utf-8")
+            )
+        self.page = _Page(url, name, self.trees[name])
+
+    def _report(self, location, instruction, message):
+        """Record a problem at an instruction."""
+        self.problems.append(f"{location} {instruction!r}: {message}")
+
+    def _find(self, location, instruction, xpath, is_required=True):
+        """Return the elements matched by the XPath on the current page."""
+        if self.page is None:
+            self._report(location, instruction, "no page has been loaded")
+            return []
+        try:
+            elements = self.page.tree.xpath(xpath)
+        except etree.XPathError as e:
+            self._report(location, instruction, f"invalid XPath: {e}")
+            return []
+        if not elements and is_required:
+            self._report(
+                location,
+                instruction,
+                f"XPath matches no element on {self.page.name}",
+            )
+        elif len(elements) > 1 and is_required:
+            self._report(
+                location,
+                instruction,
+                f"XPath is ambiguous with {len(elements)} matches on"
+                f" {self.page.name}; the first one is used",
+            )
+        return elements
+
+    def _get_target_url(self, element):
+        """Return the URL a click on the element would load, if any."""
+        link = (
+            element
+            if element.tag == "a"
+            else next(element.iterancestors("a"), None)
+        )
+        if link is not None and link.get("href"):
+            return urljoin(self.page.url, link.get("href"))
+        if element.tag in {"button", "input"} and element.get(
+            "type", "submit" if element.tag == "button" else "text"
+        ) in {"submit", "image"}:
+            form = next(element.iterancestors("form"), None)
+            if form is not None:
+                return urljoin(self.page.url, form.get("action", ""))
+        return None
+
+    def _click(self, location, instruction):
+        """Follow the transition or link of the clicked element."""
+        elements = self._find(location, instruction, instruction[1])
+        if not elements:
+            return
+
+        name = self.transitions.get(self.page.name, {}).get(instruction[1])
+        if name is not None:
+            self._load(self.page.url, name)
+            return
+        url = self._get_target_url(elements[0])
+        if url is not None and urldefrag(url).url in self.pages:
+            self._load(url, self.pages[urldefrag(url).url])
+
+    def _run_instruction(self, location, instruction):
+        """Simulate one instruction."""
+        key = instruction[0]
+        if key == "get":
+            url = urldefrag(instruction[1]).url
+            if url in self.pages:
+                self._load(url, self.pages[url])
+            else:
+                self.page = None
+                self._report(location, instruction, "no snapshot of the URL")
+        elif key in {"click", "submit"}:
+            self._click(location, instruction)
+        elif key == "send_keys":
+            elements = self._find(location, instruction, instruction[1])
+            if elements:
+                value = elements[0].get("value", "") + instruction[2]
+                elements[0].set("value", value)
+        elif key in {"wait_absent", "await_absent"}:
+            if self._find(
+                location, instruction, instruction[1], is_required=False
+            ):
+                self._report(
+                    location,
+                    instruction,
+                    f"XPath still matches on {self.page.name} and would"
+                    " time out",
+                )
+        elif key == "await_present":
+            self._find(location, instruction, instruction[1])
+        elif key == "exist":
+            if self._find(
+                location, instruction, instruction[1], is_required=False
+            ):
+                self.run(instruction[2], location)
+        elif key == "for":
+            # Iterations depend on the live page, so the body runs once to
+            # check its XPaths.
+            self.run(instruction[2], location)
+        elif key in {"sleep", "await_stable", "refresh"}:
+            pass
+        elif len(instruction) > 1:
+            self._find(location, instruction, instruction[1])
+
+    def run(self, program, name):
+        """Simulate the program and return the problems found so far."""
+        for index, instruction in enumerate(program, 1):
+            self.steps += 1
+            self._run_instruction(f"{name}[{index}]", instruction)
+        return self.problems
+
+
+def simulate(program, name, snapshot_directory):
+    """Simulate a program on the snapshots and return a report.
+
+    Raise BrowserAutomationError with the report when problems are found.
+    """
+    simulator = ActionSimulator(snapshot_directory)
+    start = time.perf_counter()
+    problems = simulator.run(program, name)
+    elapsed = (time.perf_counter() - start) * 1000
+    summary = (
+        f"Simulated {simulator.steps} instruction(s) of {name} in"
+        f" {elapsed:.1f} ms with {len(problems)} problem(s)."
+    )
+    report = "\n".join(problems + [summary])
+    if problems:
+        raise BrowserAutomationError(report)
+    return report
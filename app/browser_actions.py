@@ -0,0 +1,372 @@
+"""Browser action programs with checkpointed, backed-off retries."""
+
+import concurrent.futures
+import contextlib
+import random
+import socket
+import threading
+import time
+from urllib.parse import urlsplit
+
+from app import (
+    browser_batches,
+    browser_session,
+    browser_waits,
+    profiling,
+    session_cache,
+)
+from core_utilities.config_validation import evaluate_value
+from core_utilities.errors import BrowserAutomationError
+from web_utilities import browser_driver
+
+BROWSER_ACTION_MAX_ATTEMPTS = 3
+BROWSER_ACTION_RETRY_BASE_INTERVAL = 1
+BROWSER_ACTION_RETRY_MAX_INTERVAL = 16
+# After hibernation resume the network may come up later than the browser, so
+# retries wait for the first target host to accept connections.
+READINESS_PROBE_TIMEOUT = 30
+READINESS_PROBE_INTERVAL = 0.5
+# Sessions after the first wait this long for it to capture a login.
+LOGIN_CAPTURE_TIMEOUT = 300
+# Clicks that send a form, such as an order, which a retry must not replay.
+SUBMIT_COMMAND = "submit"
+
+
+def parse_program(action):
+    """Return the instruction list of an action program."""
+    if isinstance(action, str):
+        action = evaluate_value(action)
+    return list(action)
+
+
+def _get_retry_delay(attempt):
+    """Return an exponential backoff delay with equal jitter."""
+    delay = min(
+        BROWSER_ACTION_RETRY_MAX_INTERVAL,
+        BROWSER_ACTION_RETRY_BASE_INTERVAL * 2 ** (attempt - 1),
+    )
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def _is_replaying_submit(program, index, is_restarting):
+    """Return whether retrying from the index could send a form twice.
+
+    The submit at the failed index may have been sent, and a restart runs
+    the submits before it again.
+    """
+    if index < len(program) and program[index][0] == SUBMIT_COMMAND:
+        return True
+    return is_restarting and any(
+        instruction[0] == SUBMIT_COMMAND for instruction in program[:index]
+    )
+
+
+def _get_probe_address(program):
+    """Return the host and port of the first URL the program loads."""
+    for instruction in program:
+        if instruction[0] == "get":
+            url = urlsplit(instruction[1])
+            if url.hostname:
+                return url.hostname, url.port or (
+                    443 if url.scheme == "https" else 80
+                )
+    return None
+
+
+def _wait_until_reachable(program):
+    """Wait until the program's first host accepts a TCP connection."""
+    address = _get_probe_address(program)
+    if address is None:
+        return
+
+    deadline = time.monotonic() + READINESS_PROBE_TIMEOUT
+    with profiling.span("readiness probe", "network", host=address[0]):
+        while True:
+            try:
+                with socket.create_connection(
+                    address, timeout=READINESS_PROBE_INTERVAL
+                ):
+                    return
+            except OSError:
+                if time.monotonic() >= deadline:
+                    return
+                time.sleep(READINESS_PROBE_INTERVAL)
+
+
+def _run_instruction(driver, instruction, wait_timeout):
+    """Run one top-level instruction in the browser."""
+    if instruction[0] in browser_waits.COMMANDS:
+        browser_waits.COMMANDS[instruction[0]](
+            driver, instruction, wait_timeout
+        )
+    elif instruction[0] == SUBMIT_COMMAND:
+        browser_driver.execute_action(
+            driver, [("click", instruction[1])], wait_timeout=wait_timeout
+        )
+    else:
+        browser_driver.execute_action(
+            driver, [instruction], wait_timeout=wait_timeout
+        )
+
+
+def _run_program(
+    driver,
+    name,
+    program,
+    checkpoint,
+    wait_timeout,
+    on_login=None,
+    history=None,
+    is_batching=False,
+):
+    """Run the program from its checkpoint, advancing it per instruction.
+
+    When batching, runs of consecutive clicks and key entries execute in
+    one injected script, and the step the script stops at runs through the
+    per-command path. A batch is recorded in the latency history as one
+    step, and the steps it completed stay checkpointed when it fails.
+    """
+    login_length = session_cache.get_login_length(program)
+    index = checkpoint.get(name, 0)
+    stopped_index = None
+    while index < len(program):
+        # Keep the login boundary out of batches so that on_login sees it.
+        stop = (
+            login_length
+            if index < login_length and on_login is not None
+            else len(program)
+        )
+        length = (
+            browser_batches.get_batch_length(program, index, stop)
+            if is_batching and index != stopped_index
+            else 0
+        )
+        start = time.perf_counter()
+        if length:
+            end = index + length
+            with profiling.span(
+                f"batch of {length}", "browser_instruction", action=name
+            ):
+                completed, error = browser_batches.run_batch(
+                    driver, program[index:end]
+                )
+            # One row for the whole batch, whose steps are not timed apart.
+            if history is not None:
+                history.record(
+                    name,
+                    index + 1,
+                    ("batch", f"steps {index + 1}-{end}"),
+                    time.perf_counter() - start,
+                    "error" if error is not None else "ok",
+                )
+            if completed < length:
+                stopped_index = index + completed
+            index += completed
+            if error is not None:
+                checkpoint[name] = index
+                raise BrowserAutomationError(
+                    f"Step {index + 1} of {name} failed in a batch: {error}"
+                )
+        else:
+            instruction = program[index]
+            outcome = "error"
+            try:
+                with profiling.span(
+                    str(instruction[0]), "browser_instruction", action=name
+                ):
+                    _run_instruction(driver, instruction, wait_timeout)
+                outcome = "ok"
+            finally:
+                if history is not None:
+                    history.record(
+                        name,
+                        index + 1,
+                        instruction,
+                        time.perf_counter() - start,
+                        outcome,
+                    )
+            index += 1
+        checkpoint[name] = index
+        if on_login is not None and index == login_length:
+            on_login(driver)
+
+
+def _skip_login(driver, name, program, checkpoint, cache, login):
+    """Skip the login instructions when the session is authenticated."""
+    login_length = session_cache.get_login_length(program)
+    if not login_length or checkpoint.get(name):
+        return
+
+    if driver is login["driver"]:
+        driver.get(login["landing_url"])
+    elif cache.restore(driver, program[:login_length]):
+        login.update(driver=driver, landing_url=driver.current_url)
+    else:
+        return
+    checkpoint[name] = login_length
+
+
+def run_actions(
+    initialize,
+    actions,
+    wait_timeout,
+    cache=None,
+    history=None,
+    on_login=None,
+    is_batching=False,
+):
+    """Run named action programs and resume from the failed step on retry.
+
+    Each action is a tuple of a name, a program, and an optional callable
+    that receives the driver after the program completes. Completed actions
+    are never replayed. When the session survives a failure, the failed
+    instruction is retried in place; otherwise a new session restarts the
+    failed action from its first instruction. A failure at or after a
+    submit that the retry would run again is raised instead of retried, so
+    that an order is never sent twice. With a session cache, the
+    login instructions are skipped while a saved session is still valid.
+    With a latency history, the timing of every instruction is recorded.
+    The optional on_login callable receives the driver after a full login
+    has been saved to the session cache. With batching, consecutive
+    same-page instructions run in one injected script.
+    """
+    pending = [
+        (name, parse_program(program), finish)
+        for name, program, finish in actions
+    ]
+    checkpoint = {}
+    login = {"driver": None, "landing_url": None}
+
+    def save_login(driver):
+        cache.save(driver)
+        login.update(driver=driver, landing_url=driver.current_url)
+        if on_login is not None:
+            on_login(driver)
+
+    driver = None
+    attempt = 1
+    try:
+        while pending:
+            name, program, finish = pending[0]
+            try:
+                if driver is None:
+                    with profiling.span("initialize", "selenium"):
+                        driver = initialize()
+                with profiling.span(name, "browser_action"):
+                    if cache is not None:
+                        _skip_login(
+                            driver, name, program, checkpoint, cache, login
+                        )
+                    _run_program(
+                        driver,
+                        name,
+                        program,
+                        checkpoint,
+                        wait_timeout,
+                        on_login=save_login if cache is not None else None,
+                        history=history,
+                        is_batching=is_batching,
+                    )
+                    if finish is not None:
+                        finish(driver)
+                pending.pop(0)
+            except Exception as e:
+                # The browser driver may crash on an unsettled system after
+                # hibernation resume, so both initialize() and the
+                # instructions are retried.
+                if (
+                    attempt == BROWSER_ACTION_MAX_ATTEMPTS
+                    or _is_replaying_submit(
+                        program, checkpoint.get(name, 0), False
+                    )
+                ):
+                    raise
+                delay = _get_retry_delay(attempt)
+                print(
+                    f"Attempt {attempt} failed: {e}\n"
+                    f"Retrying in {delay:.1f}s..."
+                )
+                time.sleep(delay)
+                attempt += 1
+                if driver is not None and not browser_session.is_responsive(
+                    driver
+                ):
+                    with contextlib.suppress(Exception):
+                        driver.quit()
+                    driver = None
+                if driver is None:
+                    if _is_replaying_submit(
+                        program, checkpoint.get(name, 0), True
+                    ):
+                        raise
+                    checkpoint.pop(name, None)
+                    _wait_until_reachable(program)
+    finally:
+        if history is not None:
+            history.flush()
+        if driver is not None:
+            driver.quit()
+
+
+def run_actions_concurrently(
+    initialize,
+    groups,
+    wait_timeout,
+    cache=None,
+    history=None,
+    max_sessions=2,
+    is_batching=False,
+):
+    """Run independent groups of actions in sessions sharing one login.
+
+    Each group is a list of actions that run in order in one session, and
+    the initialize callable receives the index of the group. Each session
+    retries on its own as in run_actions. When the session cache has no
+    valid login, the first group logs in while the others wait for it to
+    save the session, which they restore instead of logging in again.
+    """
+    if len(groups) < 2 or max_sessions < 2:
+        run_actions(
+            lambda: initialize(0),
+            [action for group in groups for action in group],
+            wait_timeout,
+            cache=cache,
+            history=history,
+            is_batching=is_batching,
+        )
+        return
+
+    is_logged_in = threading.Event()
+    if (
+        cache is None
+        or not session_cache.get_login_length(parse_program(groups[0][0][1]))
+        or cache.load() is not None
+    ):
+        is_logged_in.set()
+
+    def run(index):
+        try:
+            if index:
+                is_logged_in.wait(LOGIN_CAPTURE_TIMEOUT)
+            run_actions(
+                lambda: initialize(index),
+                groups[index],
+                wait_timeout,
+                cache=cache,
+                history=history,
+                is_batching=is_batching,
+                on_login=(
+                    (lambda driver: is_logged_in.set()) if index == 0 else None
+                ),
+            )
+        finally:
+            if index == 0:
+                is_logged_in.set()
+
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=min(max_sessions, len(groups)),
+        thread_name_prefix="browser-session",
+    ) as executor:
+        futures = [executor.submit(run, index) for index in range(len(groups))]
+    for future in futures:
+        future.result()
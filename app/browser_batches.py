@@ -0,0 +1,124 @@
+"""In-page execution of consecutive same-page browser instructions."""
+
+MINIMUM_BATCH_LENGTH = 2
+# Arguments of send_keys that the driver does not type literally: 'enter'
+# sends the Enter key, and 'element' and 'text' stand for loop values.
+SPECIAL_KEY_ARGUMENTS = {"element", "enter", "text"}
+
+# Run the steps in order and return how many completed with the error of a
+# step that threw, if any. Stop before a step whose element is missing,
+# hidden, disabled, covered by another element, or not a text field, and
+# before a click that may navigate away, so that the per-command path waits
+# for it. Stop after a step that started unloading the page.
+_RUN_BATCH_SCRIPT = """
+const [steps] = arguments;
+let isUnloading = false;
+const onUnload = () => { isUnloading = true; };
+window.addEventListener("beforeunload", onUnload);
+window.addEventListener("pagehide", onUnload);
+const mayNavigate = (element) => {
+  const link = element.closest("a[href]");
+  if (link) {
+    const href = link.getAttribute("href").trim().toLowerCase();
+    return !(href.startsWith("#") || href.startsWith("javascript:"));
+  }
+  const control = element.closest("button, input");
+  return Boolean(
+    control && control.form && ["submit", "image"].includes(control.type)
+  );
+};
+try {
+  for (let index = 0; index < steps.length; index++) {
+    const [key, xpath, text] = steps[index];
+    try {
+      const element = document.evaluate(
+        xpath, document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null
+      ).singleNodeValue;
+      if (
+        !element
+        || !element.getClientRects().length
+        || getComputedStyle(element).visibility === "hidden"
+        || element.disabled
+        || (
+          key === "send_keys"
+          && !(element instanceof HTMLInputElement
+               || element instanceof HTMLTextAreaElement)
+        )
+        || (key === "click" && mayNavigate(element))
+      ) {
+        return [index, null];
+      }
+      element.scrollIntoView({block: "center"});
+      if (key === "click") {
+        const rectangle = element.getBoundingClientRect();
+        const target = document.elementFromPoint(
+          rectangle.left + rectangle.width / 2,
+          rectangle.top + rectangle.height / 2
+        );
+        if (!target || !element.contains(target)) {
+          return [index, null];
+        }
+        element.click();
+      } else {
+        element.focus();
+        const setter = Object.getOwnPropertyDescriptor(
+          Object.getPrototypeOf(element), "value"
+        ).set;
+        setter.call(element, element.value + text);
+        element.dispatchEvent(new Event("input", {bubbles: true}));
+        element.dispatchEvent(new Event("change", {bubbles: true}));
+      }
+    } catch (error) {
+      return [index, String(error)];
+    }
+    if (isUnloading) {
+      return [index + 1, null];
+    }
+  }
+  return [steps.length, null];
+} finally {
+  window.removeEventListener("beforeunload", onUnload);
+  window.removeEventListener("pagehide", onUnload);
+}
+"""
+
+
+def is_batchable(instruction):
+    """Return whether the instruction can run in an injected script.
+
+    Only clicks and key entries of plain text qualify, so special keys and
+    loop values keep the semantics of the per-command driver.
+    """
+    if instruction[0] == "click":
+        return len(instruction) == 2
+    return (
+        instruction[0] == "send_keys"
+        and len(instruction) == 3
+        and isinstance(instruction[2], str)
+        and instruction[2].lower() not in SPECIAL_KEY_ARGUMENTS
+    )
+
+
+def get_batch_length(program, start, stop):
+    """Return the length of the batchable run between start and stop."""
+    end = start
+    while end < stop and is_batchable(program[end]):
+        end += 1
+    length = end - start
+    return length if length >= MINIMUM_BATCH_LENGTH else 0
+
+
+def run_batch(driver, instructions):
+    """Run the instructions in one script.
+
+    Return how many completed and the error of the step that failed, or
+    None, so that the completed steps are never run again.
+    """
+    completed, error = driver.execute_script(
+        _RUN_BATCH_SCRIPT,
+        [
+            [instruction[0], instruction[1], "".join(instruction[2:])]
+            for instruction in instructions
+        ],
+    )
+    return completed, error
@@ -0,0 +1,191 @@
+"""Browser session startup and a long-lived warm session service."""
+
+import contextlib
+import json
+import os
+import time
+from urllib.parse import quote
+
+from selenium import webdriver
+from selenium.webdriver.firefox.options import Options
+
+from app import firefox_profile, profiling
+from web_utilities import browser_driver
+
+HEALTH_CHECK_INTERVAL = 30
+# Firefox preferences that skip images, web fonts, and prefetching in lean
+# mode.
+LEAN_PREFERENCES = {
+    "permissions.default.image": 2,
+    "gfx.downloadable_fonts.enabled": False,
+    "browser.display.use_document_fonts": 0,
+    "network.prefetch-next": False,
+    "network.dns.disablePrefetch": True,
+    "network.predictor.enabled": False,
+    "media.autoplay.default": 5,
+}
+# Send requests to hosts outside the allowed domains to a discard port so
+# that third-party scripts fail fast instead of loading.
+_PAC_SCRIPT = """function FindProxyForURL(url, host) {
+  const domains = %s;
+  return domains.some(
+    (domain) => host === domain || host.endsWith("." + domain)
+  ) ? "DIRECT" : "PROXY 127.0.0.1:9";
+}"""
+
+
+class _AttachedDriver(webdriver.Remote):
+    """Drive an existing session without owning its lifetime."""
+
+    def __init__(self, command_executor, session_id):
+        """Attach to the session served at the command executor URL."""
+        self._attached_session_id = session_id
+        super().__init__(command_executor=command_executor, options=Options())
+
+    def start_session(self, capabilities):
+        """Reuse the attached session instead of creating a new one."""
+        self.session_id = self._attached_session_id
+        self.caps = {}
+
+    def quit(self):
+        """Detach from the session and leave the browser running."""
+        self.stop_client()
+        self.command_executor.close()
+
+
+def get_state_path(trade):
+    """Return the path of the warm session state file."""
+    return os.path.join(trade.config_directory, "browser_session.json")
+
+
+def is_responsive(driver):
+    """Return whether the browser session still answers commands."""
+    try:
+        driver.execute_script("return document.readyState")
+    except Exception:
+        return False
+    return True
+
+
+def get_lean_options(general, profile_directory):
+    """Return Firefox options for the lean and headless modes."""
+    options = Options()
+    if profile_directory:
+        options.add_argument("-profile")
+        options.add_argument(profile_directory)
+    if general.getboolean("headless_browser"):
+        options.add_argument("-headless")
+    if not general.getboolean("lean_browser"):
+        return options
+
+    options.page_load_strategy = "eager"
+    for name, value in LEAN_PREFERENCES.items():
+        options.set_preference(name, value)
+    domains = general["lean_browser_allowed_domains"].split()
+    if domains:
+        options.set_preference("network.proxy.type", 2)
+        options.set_preference(
+            "network.proxy.autoconfig_url",
+            "data:application/x-ns-proxy-autoconfig,"
+            + quote(_PAC_SCRIPT % json.dumps(domains)),
+        )
+    return options
+
+
+def initialize(config, slim_profile_directory=None):
+    """Start a new browser session from the configured profile.
+
+    With a slim profile directory, the session uses a minimal copy of the
+    configured profile that is refreshed only when its source changes.
+    """
+    general = config["General"]
+    profile_directory = general["firefox_profile_directory"]
+    if (
+        profile_directory
+        and slim_profile_directory
+        and general.getboolean("slim_firefox_profile")
+    ):
+        with profiling.span("update slim profile", "file"):
+            profile_directory = firefox_profile.update(
+                profile_directory, slim_profile_directory
+            )
+    if not (
+        general.getboolean("lean_browser")
+        or general.getboolean("headless_browser")
+    ):
+        return browser_driver.initialize(
+            firefox_profile_directory=profile_directory
+        )
+
+    with profiling.span("initialize lean browser", "selenium"):
+        return webdriver.Firefox(
+            options=get_lean_options(general, profile_directory)
+        )
+
+
+def attach(state_path):
+    """Return a driver attached to the warm session, or None if it is dead."""
+    try:
+        with open(state_path, encoding="utf-8") as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    with profiling.span("attach", "selenium"):
+        try:
+            driver = _AttachedDriver(
+                state["command_executor"], state["session_id"]
+            )
+        except Exception:
+            return None
+        if not is_responsive(driver):
+            driver.quit()
+            return None
+    return driver
+
+
+def start(config, state_path, slim_profile_directory=None):
+    """Attach to the warm session or fall back to a cold start."""
+    return attach(state_path) or initialize(config, slim_profile_directory)
+
+
+def _write_state(driver, state_path):
+    """Record how other processes can attach to the session."""
+    os.makedirs(os.path.dirname(state_path), exist_ok=True)
+    temporary_path = f"{state_path}.tmp"
+    with open(temporary_path, "w", encoding="utf-8") as f:
+        json.dump(
+            {
+                "command_executor": driver.service.service_url,
+                "session_id": driver.session_id,
+                "pid": os.getpid(),
+            },
+            f,
+        )
+    os.replace(temporary_path, state_path)
+
+
+def serve(config, state_path, slim_profile_directory=None):
+    """Keep one browser session alive and replace it when it dies."""
+    driver = initialize(config, slim_profile_directory)
+    _write_state(driver, state_path)
+    print("Serving a warm browser session. Press Ctrl+C to stop.")
+    try:
+        while True:
+            time.sleep(HEALTH_CHECK_INTERVAL)
+            if is_responsive(driver):
+                continue
+
+            print("Browser session is unresponsive. Restarting...")
+            with contextlib.suppress(Exception):
+                driver.quit()
+            driver = None
+            driver = initialize(config, slim_profile_directory)
+            _write_state(driver, state_path)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(state_path)
+        if driver is not None:
+            driver.quit()
@@ -0,0 +1,125 @@
+"""Event-driven browser waits built on in-page MutationObservers."""
+
+import time
+
+from selenium.common.exceptions import TimeoutException, WebDriverException
+
+from core_utilities.errors import BrowserAutomationError
+
+# Resolve as soon as the XPath match count satisfies the condition, checking
+# again on every DOM mutation instead of polling.
+_AWAIT_XPATH_SCRIPT = """
+const [xpath, isPresent, done] = arguments;
+const isSatisfied = () => {
+  const count = document.evaluate(
+    `count(${xpath})`, document, null, XPathResult.NUMBER_TYPE, null
+  ).numberValue;
+  return isPresent ? count > 0 : count === 0;
+};
+if (isSatisfied()) {
+  done(true);
+} else {
+  const observer = new MutationObserver(() => {
+    if (isSatisfied()) {
+      observer.disconnect();
+      done(true);
+    }
+  });
+  observer.observe(document, {
+    attributes: true, childList: true, subtree: true
+  });
+}
+"""
+# Resolve once the document has loaded and its DOM has not changed for the
+# quiet period.
+_AWAIT_STABLE_SCRIPT = """
+const [quietPeriod, done] = arguments;
+const start = () => {
+  let timer = null;
+  const observer = new MutationObserver(() => {
+    clearTimeout(timer);
+    timer = setTimeout(finish, quietPeriod);
+  });
+  const finish = () => {
+    observer.disconnect();
+    done(true);
+  };
+  observer.observe(document, {
+    attributes: true, characterData: true, childList: true, subtree: true
+  });
+  timer = setTimeout(finish, quietPeriod);
+};
+if (document.readyState === "complete") {
+  start();
+} else {
+  window.addEventListener("load", start, {once: true});
+}
+"""
+
+
+def _run_until_deadline(driver, script, arguments, timeout, description):
+    """Run an async wait script, restarting it when the page navigates."""
+    deadline = time.monotonic() + timeout
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+
+        driver.set_script_timeout(remaining)
+        try:
+            driver.execute_async_script(script, *arguments)
+            return
+        except TimeoutException:
+            break
+        except WebDriverException as e:
+            # A navigation unloads the document and aborts the script, so
+            # observe the new document until the deadline.
+            if "unload" not in str(e).lower():
+                raise
+    raise BrowserAutomationError(
+        f"Timed out after {timeout}s waiting for {description} at"
+        f" url={driver.current_url!r}"
+    )
+
+
+def await_present(driver, instruction, wait_timeout):
+    """Wait until the XPath matches at least one node."""
+    timeout = float(instruction[2]) if len(instruction) > 2 else wait_timeout
+    _run_until_deadline(
+        driver,
+        _AWAIT_XPATH_SCRIPT,
+        (instruction[1], True),
+        timeout,
+        f"XPath {instruction[1]!r} to be present",
+    )
+
+
+def await_absent(driver, instruction, wait_timeout):
+    """Wait until the XPath matches no node, following navigations."""
+    timeout = float(instruction[2]) if len(instruction) > 2 else wait_timeout
+    _run_until_deadline(
+        driver,
+        _AWAIT_XPATH_SCRIPT,
+        (instruction[1], False),
+        timeout,
+        f"XPath {instruction[1]!r} to be absent",
+    )
+
+
+def await_stable(driver, instruction, wait_timeout):
+    """Wait until the page has loaded and its DOM has settled."""
+    quiet_period = float(instruction[1])
+    _run_until_deadline(
+        driver,
+        _AWAIT_STABLE_SCRIPT,
+        (quiet_period * 1000,),
+        max(wait_timeout, quiet_period),
+        f"the DOM to be stable for {quiet_period}s",
+    )
+
+
+COMMANDS = {
+    "await_present": await_present,
+    "await_absent": await_absent,
+    "await_stable": await_stable,
+}
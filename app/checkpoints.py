@@ -0,0 +1,264 @@
+"""Local checkpoints of a directory as reflinked or copied trees."""
+
+import contextlib
+import json
+import os
+import shutil
+import stat
+import sys
+import tempfile
+
+from app import snapshot_catalog, snapshot_manifest
+from core_utilities.errors import UtilityOperationError
+
+METADATA_NAME = "checkpoint.json"
+# The ioctl request that clones a file on Btrfs, XFS, and other Linux file
+# systems that share extents.
+FICLONE = 0x40049409
+
+
+def _reflink(source, destination):
+    """Clone a file sharing its blocks, or raise OSError."""
+    if not sys.platform.startswith("linux"):
+        raise OSError("Reflinks are unsupported on this platform.")
+
+    import fcntl
+
+    with open(source, "rb") as source_file, open(
+        destination, "wb"
+    ) as destination_file:
+        fcntl.ioctl(destination_file.fileno(), FICLONE, source_file.fileno())
+    shutil.copystat(source, destination)
+
+
+def _copy_file(source, destination):
+    """Copy a file as a reflink where the file system supports it."""
+    try:
+        _reflink(source, destination)
+    except OSError:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(destination)
+        shutil.copy2(source, destination)
+
+
+class CheckpointStore:
+    """Keep checkpoints of a directory on the same file system.
+
+    Files are cloned where the file system supports reflinks, which takes
+    about as long as listing the directory, and copied otherwise, which
+    takes as long as reading the directory. The size and modification time
+    of each file are recorded to detect a checkpoint file written in place,
+    such as a file hardlinked by an earlier version.
+    """
+
+    def __init__(self, source, path, number_of_checkpoints=5):
+        """Initialize the store with its directory and retention."""
+        self.source = source
+        self.path = path
+        self.number_of_checkpoints = number_of_checkpoints
+        self.root = os.path.basename(source)
+
+    def get_names(self):
+        """Return the checkpoint names from the oldest to the latest."""
+        if not os.path.isdir(self.path):
+            return []
+        return sorted(
+            name
+            for name in os.listdir(self.path)
+            if os.path.isfile(os.path.join(self.path, name, METADATA_NAME))
+        )
+
+    def create(self):
+        """Create a checkpoint of the source and return its name."""
+        os.makedirs(self.path, exist_ok=True)
+        name = snapshot_catalog.get_generation_name()
+        suffix = 1
+        while os.path.lexists(os.path.join(self.path, name)):
+            name = f"{snapshot_catalog.get_generation_name()}-{suffix}"
+            suffix += 1
+        temporary_path = os.path.join(self.path, f".{name}.tmp")
+        files = {}
+        methods = {"reflink": 0, "copy": 0}
+        try:
+            for root, directories, names in os.walk(self.source):
+                relative_root = os.path.relpath(root, self.source)
+                target_root = os.path.normpath(
+                    os.path.join(temporary_path, self.root, relative_root)
+                )
+                os.makedirs(target_root, exist_ok=True)
+                for entry in directories + names:
+                    path = os.path.join(root, entry)
+                    if os.path.islink(path):
+                        os.symlink(
+                            os.readlink(path), os.path.join(target_root, entry)
+                        )
+                        if entry in directories:
+                            directories.remove(entry)
+                for entry in names:
+                    path = os.path.join(root, entry)
+                    status = os.lstat(path)
+                    if not stat.S_ISREG(status.st_mode):
+                        continue
+                    method = self._link(path, os.path.join(target_root, entry))
+                    methods[method] += 1
+                    relative_path = os.path.relpath(path, self.source)
+                    relative_path = relative_path.replace(os.sep, "/")
+                    files[f"{self.root}/{relative_path}"] = {
+                        "size": status.st_size,
+                        "mtime_ns": status.st_mtime_ns,
+                    }
+            with open(
+                os.path.join(temporary_path, METADATA_NAME),
+                "w",
+                encoding="utf-8",
+            ) as f:
+                json.dump(
+                    {"root": self.root, "methods": methods, "files": files}, f
+                )
+            os.replace(temporary_path, os.path.join(self.path, name))
+        except BaseException:
+            shutil.rmtree(temporary_path, ignore_errors=True)
+            raise
+        self._prune()
+        return name
+
+    @staticmethod
+    def _link(source, destination):
+        """Reflink or copy a file and return the method used."""
+        # A hardlink would share the content with the live file, which
+        # Hyper SBI 2 writes in place.
+        try:
+            _reflink(source, destination)
+            return "reflink"
+        except OSError:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(destination)
+        shutil.copy2(source, destination)
+        return "copy"
+
+    def _prune(self):
+        """Delete the oldest checkpoints beyond the retention."""
+        names = self.get_names()
+        for name in names[: max(0, len(names) - self.number_of_checkpoints)]:
+            shutil.rmtree(os.path.join(self.path, name))
+
+    def _load(self, name):
+        """Return the metadata of a checkpoint."""
+        path = os.path.join(self.path, name, METADATA_NAME)
+        if not os.path.isfile(path):
+            raise UtilityOperationError(f"No checkpoint {name} in {self.path}")
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+
+    def format_listing(self):
+        """Return a table of the checkpoints from the latest."""
+        lines = [f"{'checkpoint':<18} {'files':>7}  method"]
+        for name in reversed(self.get_names()):
+            metadata = self._load(name)
+            methods = ", ".join(
+                f"{method} {count}"
+                for method, count in metadata["methods"].items()
+                if count
+            )
+            lines.append(
+                f"{name:<18} {len(metadata['files']):>7}  {methods or '-'}"
+            )
+        return "\n".join(lines)
+
+    def roll_back(self, name=None):
+        """Restore the source from the latest or named checkpoint.
+
+        Only the files that differ from the checkpoint are copied back, and
+        the source is left as it was if any step fails. Raise
+        UtilityOperationError before changing anything if a file of the
+        checkpoint has been written in place.
+        """
+        names = self.get_names()
+        if not names and not name:
+            raise UtilityOperationError(f"No checkpoint exists in {self.path}")
+        name = name or names[-1]
+        metadata = self._load(name)
+        checkpoint = os.path.join(self.path, name)
+
+        modified = []
+        for member_name, entry in metadata["files"].items():
+            status = os.lstat(
+                os.path.join(checkpoint, *member_name.split("/"))
+            )
+            if [status.st_size, status.st_mtime_ns] != [
+                entry["size"],
+                entry["mtime_ns"],
+            ]:
+                modified.append(member_name)
+        if modified:
+            raise UtilityOperationError(
+                "The checkpoint has files that have been written in place: "
+                + ", ".join(modified)
+            )
+
+        output_directory = os.path.dirname(self.source)
+        backup = f"{self.source}.bak"
+        if os.path.lexists(backup):
+            raise FileExistsError(f"The {backup} path exists.")
+        staging = tempfile.mkdtemp(
+            prefix=".rollback.", suffix=".tmp", dir=output_directory
+        )
+        member_names = set()
+        try:
+            for root, directories, files in os.walk(
+                os.path.join(checkpoint, self.root)
+            ):
+                relative_root = os.path.relpath(root, checkpoint)
+                relative_root = relative_root.replace(os.sep, "/")
+                member_names.add(relative_root)
+                os.makedirs(
+                    os.path.join(staging, *relative_root.split("/")),
+                    exist_ok=True,
+                )
+                for entry in directories + files:
+                    path = os.path.join(root, entry)
+                    member_name = f"{relative_root}/{entry}"
+                    member_names.add(member_name)
+                    live_path = os.path.join(
+                        output_directory, *member_name.split("/")
+                    )
+                    if os.path.islink(path):
+                        if entry in directories:
+                            directories.remove(entry)
+                        if not os.path.islink(live_path) or os.readlink(
+                            live_path
+                        ) != os.readlink(path):
+                            os.symlink(
+                                os.readlink(path),
+                                os.path.join(staging, *member_name.split("/")),
+                            )
+                    elif entry in files and not self._is_current(
+                        path, live_path
+                    ):
+                        _copy_file(
+                            path,
+                            os.path.join(staging, *member_name.split("/")),
+                        )
+            if os.path.isdir(self.source):
+                snapshot_manifest.apply(
+                    metadata, staging, output_directory, member_names, backup
+                )
+            else:
+                os.replace(os.path.join(staging, self.root), self.source)
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+        return name
+
+    @staticmethod
+    def _is_current(path, live_path):
+        """Return whether the live file already matches the checkpoint."""
+        try:
+            live_status = os.lstat(live_path)
+        except FileNotFoundError:
+            return False
+        status = os.lstat(path)
+        return os.path.samestat(status, live_status) or (
+            stat.S_ISREG(live_status.st_mode)
+            and live_status.st_size == status.st_size
+            and live_status.st_mtime_ns == status.st_mtime_ns
+        )
@@ -52,6 +52,23 @@ def get_arguments():
     parser.add_argument(
         "-w", action="store_true", help="backup the 'PROCESS' watchlists"
     )
+    parser.add_argument(
+        "--list-watchlist-versions",
+        action="store_true",
+        help="list the backed-up versions of the 'PROCESS' watchlists",
+    )
+    parser.add_argument(
+        "--restore-watchlists",
+        type=int,
+        help="restore the 'PROCESS' watchlists to the 'VERSION' version",
+        metavar="VERSION",
+    )
+    parser.add_argument(
+        "--browser-service",
+        action="store_true",
+        help="keep a warm browser session alive for the '-s', '-S', and '-o'"
+        " options until interrupted",
+    )
     snapshot_group.add_argument(
         "-d",
         action="store_true",
@@ -62,6 +79,82 @@ def get_arguments():
         action="store_true",
         help="restore the 'PROCESS' application data from a snapshot",
     )
+    parser.add_argument(
+        "--checkpoint",
+        action="store_true",
+        help="create a local checkpoint of the 'PROCESS' application data",
+    )
+    parser.add_argument(
+        "--list-checkpoints",
+        action="store_true",
+        help="list the local checkpoints of the 'PROCESS' application data",
+    )
+    parser.add_argument(
+        "--rollback",
+        nargs="?",
+        const="",
+        help="roll the 'PROCESS' application data back to the latest or"
+        " 'CHECKPOINT' local checkpoint",
+        metavar="CHECKPOINT",
+    )
+    parser.add_argument(
+        "--verify-snapshot",
+        action="store_true",
+        help="verify the latest 'PROCESS' snapshot without restoring it",
+    )
+    parser.add_argument(
+        "--replicate",
+        action="store_true",
+        help="mirror the 'PROCESS' snapshots to the replication directories",
+    )
+    parser.add_argument(
+        "--list-snapshots",
+        action="store_true",
+        help="list the 'PROCESS' snapshots without decrypting them",
+    )
+    parser.add_argument(
+        "--snapshot-report",
+        action="store_true",
+        help="show the subtrees of the 'PROCESS' application data that take"
+        " the most bytes",
+    )
+    parser.add_argument(
+        "--snapshot",
+        help="restore or verify the 'GENERATION' snapshot instead of the"
+        " latest one",
+        metavar="GENERATION",
+    )
+
+    parser.add_argument(
+        "--simulate",
+        nargs=2,
+        help="run the 'ACTION' program against the HTML snapshots"
+        " in 'SNAPSHOT_DIRECTORY' without a browser and exit",
+        metavar=("ACTION", "SNAPSHOT_DIRECTORY"),
+    )
+    parser.add_argument(
+        "--benchmark-codecs",
+        action="store_true",
+        help="compare the snapshot codecs on synthetic application data"
+        " and exit",
+    )
+    parser.add_argument(
+        "--latency-report",
+        action="store_true",
+        help="show p50 and p95 latency per browser action step"
+        " across recent runs and exit",
+    )
+    parser.add_argument(
+        "--profile",
+        help="write nested timing spans to 'TRACE_PATH'"
+        " in the Chrome trace event format",
+        metavar="TRACE_PATH",
+    )
+    parser.add_argument(
+        "--cprofile",
+        action="store_true",
+        help="also write a cProfile dump per task next to 'TRACE_PATH'",
+    )
 
     file_utilities.add_launcher_options(config_group)
     config_group.add_argument(
@@ -79,4 +172,7 @@ def get_arguments():
         "-C", action="store_true", help="check configuration changes and exit"
     )
 
-    return parser.parse_args(None if sys.argv[1:] else ["-h"])
+    args = parser.parse_args(None if sys.argv[1:] else ["-h"])
+    if args.cprofile and not args.profile:
+        parser.error("--cprofile requires --profile")
+    return args
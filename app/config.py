@@ -8,7 +8,6 @@ import sys
 from core_utilities import errors
 from core_utilities.config_diff import check_config_changes
 from core_utilities.config_io import read_config
-from core_utilities.config_prompt import modify_section
 from core_utilities.config_validation import ensure_section_exists
 
 
@@ -23,7 +22,15 @@ def configure(trade, can_interpolate=True, can_override=True):
 
     config["General"] = {
         "firefox_profile_directory": "",
+        "slim_firefox_profile": "True",
         "wait_timeout": "4",
+        "max_browser_sessions": "2",
+        "batch_browser_instructions": "True",
+        "lean_browser": "False",
+        "lean_browser_allowed_domains": "",
+        "headless_browser": "False",
+        "session_cache_lifetime": "30",
+        "fetch_order_status_over_http": "True",
         "email_message_from": "",
         "email_message_to": "",
         "fingerprint": "",
@@ -43,6 +50,7 @@ def configure(trade, can_interpolate=True, can_override=True):
 
 def _configure_sbi_sections(config, trade):
     """Populate sections specific to SBI Securities."""
+    config["General"]["lean_browser_allowed_domains"] = "sbisec.co.jp"
     config[trade.maintenance_schedules_section] = {
         "url": (
             "https://search.sbisec.co.jp/v2/popwin/info/home"
@@ -132,9 +140,25 @@ def _configure_hypersbi2_sections(config, trade):
         ),
         "watchlists": "",
         "backup_directory": "",
+        "number_of_watchlist_versions": "500",
         "snapshot_directory": os.path.join(
             os.path.expanduser("~"), "Downloads"
         ),
+        "deduplicate_snapshots": "True",
+        "daily_snapshots": "7",
+        "weekly_snapshots": "4",
+        "snapshot_include_patterns": "",
+        "snapshot_exclude_patterns": "",
+        "snapshot_codec": "xz",
+        "snapshot_threads": str(min(4, os.cpu_count() or 1)),
+        "replication_directories": "",
+        "checkpoint_directory": os.path.join(
+            os.path.expandvars("%APPDATA%"),
+            trade.vendor,
+            f"{trade.process}.checkpoints",
+        ),
+        "number_of_checkpoints": "5",
+        "checkpoint_before_restore": "False",
     }
     config[trade.actions_section] = {
         f"replace_{trade.vendor}_watchlists": _build_watchlist_actions(
@@ -145,9 +169,9 @@ def _configure_hypersbi2_sections(config, trade):
         ),
         "get_order_status": [
             ("get", "https://login.sbisec.co.jp/login/entry"),
-            ("sleep", "0.8"),
+            ("await_stable", "0.2"),
             ("click", '//button[@id="pk-btn"]'),
-            ("wait_absent", '//button[@id="pk-btn"]', "60"),
+            ("await_absent", '//button[@id="pk-btn"]', "60"),
             ("click", '//a[.//text()="口座管理"]'),
             ("click", '//p/a[text()="注文照会"]'),
         ],
@@ -158,9 +182,9 @@ def _build_watchlist_actions(trade, tool_from, tool_to, name, action_id):
     """Build the repeated Selenium action list for watchlist sync."""
     return [
         ("get", "https://login.sbisec.co.jp/login/entry"),
-        ("sleep", "0.8"),
+        ("await_stable", "0.2"),
         ("click", '//button[@id="pk-btn"]'),
-        ("wait_absent", '//button[@id="pk-btn"]', "60"),
+        ("await_absent", '//button[@id="pk-btn"]', "60"),
         ("click", '//a[.//text()="ポートフォリオ"]'),
         (
             "click",
@@ -186,7 +210,7 @@ def _build_watchlist_actions(trade, tool_from, tool_to, name, action_id):
             ),
         ),
         ("click", '//input[@value="確認画面へ"]'),
-        ("click", '//input[@value="指示実行"]'),
+        ("submit", '//input[@value="指示実行"]'),
     ]
 
 
@@ -240,6 +264,9 @@ def configure_exit(args, trade):
     """Configure parameters based on command-line arguments and exit."""
     backup_parameters = {"number_of_backups": 8}
     if any((args.G, args.O, args.A)):
+        # prompt_toolkit is slow to import, so only the editors load it.
+        from core_utilities.config_prompt import modify_section
+
         config = configure(trade, can_interpolate=False)
         for argument, (section, option, prompts, items, all_values) in {
             "G": ("General", None, None, None, None),
@@ -271,7 +298,8 @@ def configure_exit(args, trade):
                     "additional_value": "additional argument",
                     "end_of_list": "end of commands",
                 },
-                trade.instruction_items,
+                # The completions load Selenium, so only '-A' resolves them.
+                lambda: trade.instruction_items,
                 None,
             ),
         }.items():
@@ -283,7 +311,7 @@ def configure_exit(args, trade):
                     backup_parameters=backup_parameters,
                     option=option,
                     prompts=prompts,
-                    items=items,
+                    items=items() if callable(items) else items,
                     all_values=all_values,
                 )
                 break
@@ -0,0 +1,99 @@
+"""Minimal automation profile derived from the configured Firefox profile."""
+
+import contextlib
+import json
+import os
+import shutil
+import sqlite3
+
+# Files carrying the login state, certificates, and preferences.
+PROFILE_FILES = (
+    "cookies.sqlite",
+    "cert9.db",
+    "key4.db",
+    "cert_override.txt",
+    "prefs.js",
+    "user.js",
+)
+MANIFEST_NAME = "slim_profile.json"
+
+
+def get_profile_path(trade):
+    """Return the directory of the slim automation profile."""
+    return os.path.join(trade.config_directory, "firefox_profile")
+
+
+def _get_signature(path):
+    """Return the modification time and size of a file and its WAL."""
+    signature = []
+    for candidate in (path, f"{path}-wal"):
+        try:
+            status = os.stat(candidate)
+        except FileNotFoundError:
+            signature.extend((None, None))
+        else:
+            signature.extend((status.st_mtime_ns, status.st_size))
+    return signature
+
+
+def _copy(source, destination):
+    """Copy a file, taking a consistent snapshot of SQLite databases."""
+    temporary_path = f"{destination}.tmp"
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(temporary_path)
+    if source.endswith((".sqlite", ".db")):
+        try:
+            with contextlib.closing(
+                sqlite3.connect(f"file:{source}?mode=ro", uri=True)
+            ) as source_connection, contextlib.closing(
+                sqlite3.connect(temporary_path)
+            ) as destination_connection:
+                source_connection.backup(destination_connection)
+        except sqlite3.Error:
+            # A database locked by a running Firefox can still be copied
+            # as a file.
+            shutil.copy2(source, temporary_path)
+    else:
+        shutil.copy2(source, temporary_path)
+    for suffix in ("-wal", "-shm"):
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(f"{destination}{suffix}")
+    os.replace(temporary_path, destination)
+
+
+def update(source_directory, profile_directory):
+    """Copy changed profile files and return the slim profile directory."""
+    os.makedirs(profile_directory, exist_ok=True)
+    manifest_path = os.path.join(profile_directory, MANIFEST_NAME)
+    try:
+        with open(manifest_path, encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        manifest = {}
+    if manifest.get("source_directory") != source_directory:
+        manifest = {"source_directory": source_directory, "files": {}}
+
+    is_changed = False
+    for name in PROFILE_FILES:
+        source = os.path.join(source_directory, name)
+        destination = os.path.join(profile_directory, name)
+        signature = _get_signature(source)
+        if signature[0] is None:
+            if manifest["files"].pop(name, None) is not None:
+                is_changed = True
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(destination)
+            continue
+        if manifest["files"].get(name) == signature and os.path.isfile(
+            destination
+        ):
+            continue
+
+        _copy(source, destination)
+        manifest["files"][name] = signature
+        is_changed = True
+
+    if is_changed:
+        with open(manifest_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+    return profile_directory
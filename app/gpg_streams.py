@@ -0,0 +1,403 @@
+"""Streaming GnuPG pipes for archives and files of unbounded size."""
+
+import contextlib
+import hashlib
+import io
+import itertools
+import json
+import os
+import shutil
+import subprocess
+import tarfile
+import tempfile
+import time
+
+from app import (
+    profiling,
+    snapshot_codecs,
+    snapshot_manifest,
+    snapshot_sources,
+)
+from core_utilities.errors import UtilityOperationError
+
+GPG_ARGUMENTS = ("gpg", "--batch", "--yes", "--quiet")
+
+
+def _get_recipient_arguments(fingerprint):
+    """Return the gpg arguments selecting the recipient key."""
+    if fingerprint:
+        return ["--recipient", fingerprint]
+    return ["--default-recipient-self"]
+
+
+def _read_errors(stderr):
+    """Return the text gpg wrote to its error file."""
+    stderr.seek(0)
+    return stderr.read().decode(errors="replace").strip()
+
+
+@contextlib.contextmanager
+def encrypted_writer(path, fingerprint=""):
+    """Yield a pipe to gpg that encrypts into the path on success.
+
+    gpg writes to a temporary file next to the path, which replaces the
+    path only after gpg succeeds, so a failure keeps the previous file.
+    """
+    directory, name = os.path.split(path)
+    file_descriptor, temporary_path = tempfile.mkstemp(
+        prefix=f".{name}.", suffix=".tmp", dir=directory or "."
+    )
+    os.close(file_descriptor)
+    try:
+        # A file instead of a pipe for stderr keeps gpg from blocking on it
+        # while this process is still writing.
+        with tempfile.TemporaryFile() as stderr, profiling.span(
+            "gpg", "gpg", arguments="--encrypt"
+        ):
+            process = subprocess.Popen(
+                [
+                    *GPG_ARGUMENTS,
+                    *_get_recipient_arguments(fingerprint),
+                    "--output",
+                    temporary_path,
+                    "--encrypt",
+                ],
+                stdin=subprocess.PIPE,
+                stderr=stderr,
+            )
+            try:
+                yield process.stdin
+                process.stdin.close()
+            except BaseException:
+                process.kill()
+                raise
+            finally:
+                process.wait()
+            if process.returncode:
+                raise UtilityOperationError(
+                    f"GPG encryption failed: {_read_errors(stderr)}"
+                )
+        if not os.path.getsize(temporary_path):
+            raise UtilityOperationError(
+                "GPG encryption returned no file data."
+            )
+        os.replace(temporary_path, path)
+    finally:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(temporary_path)
+
+
+def write_encrypted(path, data, fingerprint=""):
+    """Encrypt the data into the path."""
+    with encrypted_writer(path, fingerprint) as stream:
+        stream.write(data)
+
+
+@contextlib.contextmanager
+def decrypted_reader(path):
+    """Yield a buffered pipe of the decrypted content of the file."""
+    with tempfile.TemporaryFile() as stderr, profiling.span(
+        "gpg", "gpg", arguments="--decrypt"
+    ):
+        process = subprocess.Popen(
+            [*GPG_ARGUMENTS, "--decrypt", path],
+            stdout=subprocess.PIPE,
+            stderr=stderr,
+        )
+        try:
+            if not process.stdout.peek(1) and process.wait():
+                raise UtilityOperationError(
+                    f"GPG decryption failed: {_read_errors(stderr)}"
+                )
+            if not process.stdout.peek(1):
+                raise UtilityOperationError(
+                    "GPG decryption returned no file data."
+                )
+            yield process.stdout
+            # Drain the rest so that gpg can verify the integrity check.
+            while process.stdout.read(1024 * 1024):
+                pass
+        except BaseException:
+            process.kill()
+            raise
+        finally:
+            process.stdout.close()
+            process.wait()
+        if process.returncode:
+            raise UtilityOperationError(
+                f"GPG decryption failed: {_read_errors(stderr)}"
+            )
+
+
+def read_encrypted(path):
+    """Return the decrypted content of a small file."""
+    with decrypted_reader(path) as stream:
+        return stream.read()
+
+
+def decrypt_to_file(path, output_path):
+    """Decrypt a file into another file without buffering it in memory."""
+    with decrypted_reader(path) as stream, open(output_path, "wb") as f:
+        shutil.copyfileobj(stream, f)
+
+
+class _HashingReader:
+    """Wrap a binary stream and hash the bytes read from it."""
+
+    def __init__(self, stream):
+        """Initialize the reader with the wrapped stream."""
+        self.stream = stream
+        self.hash = hashlib.blake2b()
+
+    def read(self, size=-1):
+        """Return the next bytes of the stream after hashing them."""
+        data = self.stream.read(size)
+        self.hash.update(data)
+        return data
+
+
+class _HashingTarFile(tarfile.TarFile):
+    """Tar writer that hashes the regular files as it streams them."""
+
+    def __init__(self, *args, **kwargs):
+        """Initialize the writer with no digests."""
+        super().__init__(*args, **kwargs)
+        self.digests = {}
+
+    def addfile(self, tarinfo, fileobj=None):
+        """Add a member and record the digest of its content."""
+        if fileobj is None:
+            super().addfile(tarinfo)
+            return
+        reader = _HashingReader(fileobj)
+        super().addfile(tarinfo, reader)
+        self.digests[tarinfo.name] = reader.hash.hexdigest()
+
+
+def _add_bytes(tar, name, data):
+    """Add the bytes as a regular file member."""
+    member = tarfile.TarInfo(name)
+    member.size = len(data)
+    member.mtime = int(time.time())
+    tarfile.TarFile.addfile(tar, member, io.BytesIO(data))
+
+
+def archive_encrypt_directory(
+    source,
+    output_directory,
+    fingerprint="",
+    codec="xz",
+    threads=1,
+    generation=None,
+    source_filter=None,
+):
+    """Stream a compressed tar archive of the directory into a file.
+
+    The generation and codec are recorded in the file name, such as
+    'HYPERSBI2.20261019T090000.tar.zst.gpg'. A manifest of the files
+    precedes them so that a restore can skip the files that have not
+    changed, and their digests, computed as the files stream into the
+    archive, follow them. Only the paths the source filter selects are
+    archived. Return the path of the archive.
+    """
+    source_filter = source_filter or snapshot_sources.SourceFilter()
+    root = os.path.basename(source)
+
+    def select(member):
+        """Return the member unless the source filter excludes it."""
+        if member.name == root:
+            return member
+        relative_path = member.name.removeprefix(f"{root}/")
+        return (
+            member
+            if source_filter.includes(relative_path, member.isdir())
+            else None
+        )
+
+    manifest = json.dumps(
+        snapshot_manifest.build(source, source_filter)
+    ).encode()
+    path = os.path.join(
+        output_directory,
+        snapshot_codecs.get_archive_name(source, codec, generation),
+    )
+    with encrypted_writer(
+        path, fingerprint
+    ) as stream, snapshot_codecs.compressor(
+        stream, codec, threads
+    ) as compressed, _HashingTarFile.open(
+        fileobj=compressed, mode="w|"
+    ) as tar:
+        _add_bytes(tar, snapshot_manifest.MANIFEST_NAME, manifest)
+        tar.add(source, arcname=root, filter=select)
+        _add_bytes(
+            tar,
+            snapshot_manifest.DIGESTS_NAME,
+            json.dumps(tar.digests).encode(),
+        )
+    return path
+
+
+@contextlib.contextmanager
+def _open_archive(source):
+    """Yield the tar stream, manifest, and other members of an archive.
+
+    The manifest is None for an archive written without one. The digests
+    of the last member are added to the manifest once the other members
+    have been read.
+    """
+    with decrypted_reader(source) as stream, snapshot_codecs.decompressor(
+        stream, snapshot_codecs.get_codec(source)
+    ) as decompressed, tarfile.open(fileobj=decompressed, mode="r|") as tar:
+        members = iter(tar)
+        first = next(members, None)
+        manifest = None
+        if first is not None and first.name == snapshot_manifest.MANIFEST_NAME:
+            manifest = json.load(tar.extractfile(first))
+            first = None
+
+        def get_members():
+            """Yield the members, merging the digests into the manifest."""
+            for member in itertools.chain(
+                [first] if first is not None else [], members
+            ):
+                if member.name != snapshot_manifest.DIGESTS_NAME:
+                    yield member
+                elif manifest is not None:
+                    digests = json.load(tar.extractfile(member))
+                    for name, entry in manifest["files"].items():
+                        if name in digests:
+                            entry["blake2b"] = digests[name]
+
+        yield tar, manifest, get_members()
+
+
+def decrypt_extract_file(source, output_directory):
+    """Stream an encrypted tar archive and replace its root directory.
+
+    The codec follows from the file name. Changed and missing files are
+    extracted into a temporary directory first, and the live root
+    directory is modified only after the whole archive has been read. Files
+    the manifest of the archive shows to be unchanged are neither extracted
+    nor rewritten.
+    """
+    temporary_directory = tempfile.mkdtemp(
+        prefix=".restore.", suffix=".tmp", dir=output_directory
+    )
+    try:
+        names = set()
+        with _open_archive(source) as (tar, manifest, members):
+            for member in members:
+                names.add(member.name)
+                if manifest is not None and member.isfile():
+                    entry = manifest["files"].get(member.name)
+                    if entry and snapshot_manifest.is_unchanged(
+                        os.path.join(
+                            output_directory, *member.name.split("/")
+                        ),
+                        entry,
+                    ):
+                        continue
+                tar.extract(member, temporary_directory, filter="data")
+
+        roots = {name.split("/")[0] for name in names}
+        if len(roots) != 1 or not os.path.isdir(
+            os.path.join(temporary_directory, *roots)
+        ):
+            raise UtilityOperationError(
+                "The archive does not contain exactly one root directory."
+            )
+        (root_name,) = roots
+        root = os.path.join(output_directory, root_name)
+        backup = f"{root}.bak"
+        if os.path.lexists(backup):
+            raise FileExistsError(f"The {backup} path exists.")
+        if (
+            manifest is not None
+            and manifest["root"] == root_name
+            and os.path.isdir(root)
+        ):
+            snapshot_manifest.apply(
+                manifest, temporary_directory, output_directory, names, backup
+            )
+            return
+
+        if os.path.lexists(root):
+            os.replace(root, backup)
+        try:
+            os.replace(os.path.join(temporary_directory, root_name), root)
+        except BaseException:
+            if os.path.lexists(backup):
+                os.replace(backup, root)
+            raise
+        shutil.rmtree(backup, ignore_errors=True)
+    finally:
+        shutil.rmtree(temporary_directory, ignore_errors=True)
+
+
+def verify_archive(source):
+    """Check every file of an encrypted archive against its manifest.
+
+    The archive is read in one pass without writing to disk. Raise
+    UtilityOperationError with the report when an entry is corrupt or
+    missing.
+    """
+    errors = snapshot_codecs.get_decompression_errors(
+        snapshot_codecs.get_codec(source)
+    )
+    problems = []
+    number_of_files = 0
+    start = time.perf_counter()
+    try:
+        with _open_archive(source) as (tar, manifest, members):
+            if manifest is None:
+                problems.append(f"{source}: no manifest to verify against")
+            names = set()
+            files = []
+            for member in members:
+                names.add(member.name)
+                if not member.isfile() or manifest is None:
+                    continue
+                number_of_files += 1
+                if member.name not in manifest["files"]:
+                    problems.append(f"{member.name}: not in the manifest")
+                    continue
+                files.append(
+                    (
+                        member.name,
+                        member.size,
+                        snapshot_manifest.hash_stream(tar.extractfile(member)),
+                    )
+                )
+        # The digests follow the files, so the files are compared after the
+        # whole archive has been read.
+        for name, size, digest in files:
+            entry = manifest["files"][name]
+            if size != entry["size"] or digest != entry.get("blake2b"):
+                problems.append(f"{name}: corrupt")
+        if manifest is not None:
+            problems.extend(
+                f"{name}: missing"
+                for name in sorted(manifest["files"])
+                if name not in names
+            )
+    except (
+        UtilityOperationError,
+        OSError,
+        tarfile.TarError,
+        ValueError,
+        *errors,
+    ) as e:
+        problems.append(f"{source}: unreadable: {e}")
+
+    report = "\n".join(
+        problems
+        + [
+            f"Verified {number_of_files} file(s) of {source} in"
+            f" {time.perf_counter() - start:.1f} s with {len(problems)}"
+            " problem(s)."
+        ]
+    )
+    if problems:
+        raise UtilityOperationError(report)
+    return report
@@ -0,0 +1,66 @@
+"""Browser-free page fetches that replay a cached browser session."""
+
+from urllib.parse import urlsplit
+
+from charset_normalizer import from_bytes
+from lxml import html
+import requests
+
+from app import profiling
+
+_session = None
+
+
+def _get_session():
+    """Return the pooled HTTP session shared by replayed requests."""
+    global _session
+
+    if _session is None:
+        _session = requests.Session()
+        _session.headers["User-Agent"] = (
+            "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:140.0)"
+            " Gecko/20100101 Firefox/140.0"
+        )
+    return _session
+
+
+def fetch_page(state, url_key, login_marker, required_text=""):
+    """Fetch a page with cached session cookies and return its HTML.
+
+    Return None when there is no recorded URL or when the website rejects
+    the session, so that callers can fall back to the browser.
+    """
+    if state is None or not state.get(url_key):
+        return None
+
+    url = state[url_key]
+    session = _get_session()
+    session.cookies.clear()
+    for cookie in state["cookies"]:
+        session.cookies.set(
+            cookie["name"],
+            cookie["value"],
+            domain=cookie.get("domain", ""),
+            path=cookie.get("path", "/"),
+            secure=cookie.get("secure", False),
+        )
+
+    with profiling.span("replay session", "http", url=url):
+        try:
+            response = session.get(url, timeout=10)
+        except requests.exceptions.RequestException:
+            return None
+    if (
+        response.status_code != 200
+        or urlsplit(response.url).hostname != urlsplit(url).hostname
+    ):
+        return None
+
+    matched = from_bytes(response.content).best()
+    response.encoding = matched.encoding if matched else "utf-8"
+    page_source = response.text
+    if required_text not in page_source or html.fromstring(page_source).xpath(
+        login_marker
+    ):
+        return None
+    return page_source
@@ -0,0 +1,150 @@
+"""Rolling per-instruction latency history for browser action programs."""
+
+import math
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+MAXIMUM_NUMBER_OF_RUNS = 200
+
+
+def get_history_path(trade):
+    """Return the path of the latency history database."""
+    return os.path.join(trade.config_directory, "action_latency.sqlite3")
+
+
+def _connect(path):
+    """Open the history database and create its table when missing."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    connection = sqlite3.connect(path)
+    connection.execute(
+        "CREATE TABLE IF NOT EXISTS steps ("
+        "run_id TEXT, started_at REAL, action TEXT, step INTEGER,"
+        " command TEXT, target TEXT, seconds REAL, outcome TEXT,"
+        " attempt INTEGER)"
+    )
+    # Histories recorded before attempts were numbered have one per step.
+    if "attempt" not in {
+        row[1] for row in connection.execute("PRAGMA table_info(steps)")
+    }:
+        connection.execute(
+            "ALTER TABLE steps ADD COLUMN attempt INTEGER DEFAULT 1"
+        )
+    return connection
+
+
+def _percentile(values, fraction):
+    """Return the nearest-rank percentile of sorted values."""
+    return values[max(0, math.ceil(fraction * len(values)) - 1)]
+
+
+class LatencyHistory:
+    """Collect instruction timings of one run and store them on flush."""
+
+    def __init__(self, path):
+        """Initialize the history for a new run."""
+        self.path = path
+        self.run_id = uuid.uuid4().hex
+        self.started_at = time.time()
+        self.rows = []
+        self.attempts = {}
+        self.lock = threading.Lock()
+
+    def record(self, action, step, instruction, seconds, outcome):
+        """Record the timing and outcome of one top-level instruction.
+
+        Each retry of a step in the same run is numbered as a new attempt.
+        A batch that starts at a step is numbered apart from the step.
+        """
+        key = action, step, str(instruction[0])
+        with self.lock:
+            attempt = self.attempts.get(key, 0) + 1
+            self.attempts[key] = attempt
+            self.rows.append(
+                (
+                    self.run_id,
+                    self.started_at,
+                    action,
+                    step,
+                    str(instruction[0]),
+                    str(instruction[1]) if len(instruction) > 1 else "",
+                    seconds,
+                    outcome,
+                    attempt,
+                )
+            )
+
+    def flush(self):
+        """Store the recorded rows and keep only the most recent runs."""
+        with self.lock:
+            rows, self.rows = self.rows, []
+        if not rows:
+            return
+
+        with _connect(self.path) as connection:
+            connection.executemany(
+                "INSERT INTO steps VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows
+            )
+            connection.execute(
+                "DELETE FROM steps WHERE run_id NOT IN ("
+                "SELECT run_id FROM steps GROUP BY run_id"
+                " ORDER BY MAX(started_at) DESC LIMIT ?)",
+                (MAXIMUM_NUMBER_OF_RUNS,),
+            )
+        connection.close()
+
+
+def format_report(path):
+    """Return p50 and p95 latency per step across the recorded runs.
+
+    Only the final attempt of a step in each run counts toward the
+    percentiles, and only if it succeeded. Failed attempts are counted
+    separately.
+    """
+    if not os.path.isfile(path):
+        return "No browser action latency has been recorded."
+
+    steps = {}
+    with _connect(path) as connection:
+        for (
+            action,
+            step,
+            command,
+            target,
+            seconds,
+            outcome,
+            is_final,
+        ) in connection.execute(
+            "SELECT action, step, command, target, seconds, outcome,"
+            " attempt = MAX(attempt)"
+            " OVER (PARTITION BY run_id, action, step, command)"
+            " FROM steps ORDER BY action, step, seconds"
+        ):
+            durations, failures = steps.setdefault(
+                (action, step, command, target), ([], [0])
+            )
+            if outcome != "ok":
+                failures[0] += 1
+            elif is_final:
+                durations.append(seconds)
+    connection.close()
+
+    lines = [
+        f"{'p50':>8} {'p95':>8} {'count':>5} {'fail':>5}  step",
+    ]
+    for (action, step, command, target), (durations, failures) in sorted(
+        steps.items()
+    ):
+        percentiles = (
+            f"{_percentile(durations, 0.5):8.3f}"
+            f" {_percentile(durations, 0.95):8.3f}"
+            if durations
+            else f"{'-':>8} {'-':>8}"
+        )
+        lines.append(
+            f"{percentiles} {len(durations):5d} {failures[0]:5d}"
+            f"  {action}[{step}] {command} {target}"
+        )
+    return "\n".join(lines)
@@ -15,13 +15,13 @@ SBI_SECURITIES_EXECUTION_ROW_OFFSET = 2
 SBI_SECURITIES_ROWS_PER_EXECUTION_BLOCK = 3
 
 
-def extract_sbi_securities_order_status(trade, config, driver):
-    """Extract order status from a webpage and copy it to the clipboard."""
+def extract_sbi_securities_order_status(trade, config, page_source):
+    """Extract order status from page HTML and copy it to the clipboard."""
     section = config[trade.order_status_section]
 
     try:
         dfs = pd.read_html(
-            StringIO(driver.page_source),
+            StringIO(page_source),
             match=section["table_identifier"],
             flavor="lxml",
         )
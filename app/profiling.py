@@ -0,0 +1,260 @@
+"""Hierarchical timing spans and profiler output for CLI tasks."""
+
+import contextlib
+import functools
+import importlib.abc
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+# Spans cost a global lookup and a shared null context when profiling is off;
+# library hooks are only installed by enable(), and a library that is not
+# imported yet is hooked when a task imports it rather than by enable().
+_NULL_SPAN = contextlib.nullcontext()
+_recorder = None
+
+
+class _Recorder:
+    """Collect complete events in the Chrome trace event format."""
+
+    def __init__(self, trace_path, is_profiling_tasks):
+        """Initialize the recorder with its output paths."""
+        self.trace_path = trace_path
+        self.is_profiling_tasks = is_profiling_tasks
+        self.events = []
+        self.origin = time.perf_counter_ns()
+        self.pid = os.getpid()
+        self.lock = threading.Lock()
+        self.restorers = []
+
+    @contextlib.contextmanager
+    def span(self, name, category, args):
+        """Record the wall time of the enclosed block as a complete event."""
+        start = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            end = time.perf_counter_ns()
+            event = {
+                "name": name,
+                "cat": category,
+                "ph": "X",
+                "ts": (start - self.origin) / 1000,
+                "dur": (end - start) / 1000,
+                "pid": self.pid,
+                "tid": threading.get_ident(),
+            }
+            if args:
+                event["args"] = {
+                    key: str(value) for key, value in args.items()
+                }
+            with self.lock:
+                self.events.append(event)
+
+
+def is_enabled():
+    """Return whether profiling is enabled for this process."""
+    return _recorder is not None
+
+
+def span(name, category="function", **args):
+    """Return a context manager that records a nested timing span."""
+    if _recorder is None:
+        return _NULL_SPAN
+    return _recorder.span(name, category, args)
+
+
+@contextlib.contextmanager
+def task(name):
+    """Record a top-level task span and optionally dump its cProfile data."""
+    if _recorder is None:
+        yield
+        return
+
+    profile = None
+    if _recorder.is_profiling_tasks:
+        import cProfile
+
+        profile = cProfile.Profile()
+    with _recorder.span(name, "task", {}):
+        if profile is None:
+            yield
+            return
+
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            stem, _ = os.path.splitext(_recorder.trace_path)
+            profile.dump_stats(f"{stem}.{name.replace(' ', '_')}.prof")
+
+
+def _wrap(owner, attribute, describe):
+    """Replace a callable attribute with a span-recording wrapper."""
+    original = getattr(owner, attribute)
+
+    @functools.wraps(original)
+    def wrapper(*args, **kwargs):
+        described = describe(*args, **kwargs)
+        if described is None:
+            return original(*args, **kwargs)
+
+        name, category, span_args = described
+        with span(name, category, **span_args):
+            return original(*args, **kwargs)
+
+    setattr(owner, attribute, wrapper)
+    _recorder.restorers.append(lambda: setattr(owner, attribute, original))
+
+
+def _describe_subprocess(*args, **kwargs):
+    """Describe gpg subprocesses and ignore the others."""
+    command = args[0] if args else kwargs.get("args")
+    if isinstance(command, (str, bytes, os.PathLike)):
+        arguments = [command]
+    else:
+        arguments = list(command or ())
+    if not arguments:
+        return None
+    executable = os.path.basename(os.fsdecode(arguments[0]))
+    if not executable.lower().startswith("gpg"):
+        return None
+    return "gpg", "gpg", {"arguments": " ".join(map(str, arguments[1:]))}
+
+
+def _describe_http_request(session, method, url, *_, **__):
+    """Describe an HTTP request made through requests."""
+    return f"{method} {url}", "http", {}
+
+
+def _describe_webdriver_command(driver, driver_command, params=None):
+    """Describe a WebDriver wire command."""
+    return driver_command, "selenium", {}
+
+
+def _describe_google_request(request, *_, **__):
+    """Describe a Google API client request."""
+    return (
+        f"{request.method} {request.uri.split('?')[0]}",
+        "google_api",
+        {},
+    )
+
+
+def _describe_parse(source, *_, **__):
+    """Describe an HTML parse call."""
+    return "parse", "parse", {}
+
+
+_LIBRARY_HOOKS = {
+    "requests": ("Session", "request", _describe_http_request),
+    "selenium.webdriver.remote.webdriver": (
+        "WebDriver",
+        "execute",
+        _describe_webdriver_command,
+    ),
+    "googleapiclient.http": (
+        "HttpRequest",
+        "execute",
+        _describe_google_request,
+    ),
+    "lxml.html": (None, "fromstring", _describe_parse),
+    "pandas": (None, "read_html", _describe_parse),
+}
+
+
+def _hook_module(module, owner_name, attribute, describe):
+    """Wrap the entry point of a library module."""
+    owner = getattr(module, owner_name) if owner_name else module
+    _wrap(owner, attribute, describe)
+
+
+class _ImportHook(importlib.abc.MetaPathFinder):
+    """Hook library modules once they are imported while profiling."""
+
+    def __init__(self, hooks):
+        """Initialize the finder with the hooks by module name."""
+        self.hooks = hooks
+
+    def find_spec(self, fullname, path, target=None):
+        """Find the module with the other finders and hook its loading."""
+        hook = self.hooks.pop(fullname, None)
+        if hook is None:
+            return None
+
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, "find_spec"):
+                continue
+            spec = finder.find_spec(fullname, path, target)
+            if spec is not None:
+                break
+        else:
+            return None
+        if not hasattr(spec.loader, "exec_module"):
+            return spec
+
+        execute = spec.loader.exec_module
+
+        def exec_module(module):
+            execute(module)
+            if _recorder is not None:
+                _hook_module(module, *hook)
+
+        spec.loader.exec_module = exec_module
+        return spec
+
+
+def _install_hooks():
+    """Wrap the library entry points that the tasks spend time in.
+
+    Libraries that are not imported yet are hooked by an import hook when
+    they are imported, so that enable() does not import them itself.
+    """
+    _wrap(subprocess, "run", _describe_subprocess)
+    pending = {}
+    for module_name, hook in _LIBRARY_HOOKS.items():
+        module = sys.modules.get(module_name)
+        if module is None:
+            pending[module_name] = hook
+        else:
+            _hook_module(module, *hook)
+    if pending:
+        finder = _ImportHook(pending)
+        sys.meta_path.insert(0, finder)
+        _recorder.restorers.append(lambda: sys.meta_path.remove(finder))
+
+
+def enable(trace_path, is_profiling_tasks=False):
+    """Start recording spans and install the library hooks."""
+    global _recorder
+
+    _recorder = _Recorder(trace_path, is_profiling_tasks)
+    with span("install profiling hooks", "profiling"):
+        _install_hooks()
+
+
+def disable():
+    """Write the recorded spans as a Chrome trace and remove the hooks."""
+    global _recorder
+
+    if _recorder is None:
+        return
+
+    recorder = _recorder
+    _recorder = None
+    for restore in reversed(recorder.restorers):
+        restore()
+
+    trace_directory = os.path.dirname(recorder.trace_path)
+    if trace_directory:
+        os.makedirs(trace_directory, exist_ok=True)
+    with open(recorder.trace_path, "w", encoding="utf-8") as f:
+        json.dump(
+            {"traceEvents": recorder.events, "displayTimeUnit": "ms"},
+            f,
+            ensure_ascii=False,
+        )
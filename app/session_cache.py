@@ -0,0 +1,157 @@
+"""Encrypted cache of authenticated browser session state."""
+
+import json
+import os
+import time
+from urllib.parse import urlsplit
+
+from selenium.webdriver.common.by import By
+
+from app import profiling
+from core_utilities import file_utilities
+from core_utilities.errors import CoreUtilitiesError
+
+_GET_STORAGE_SCRIPT = (
+    "return [Object.entries(localStorage), Object.entries(sessionStorage)];"
+)
+_SET_STORAGE_SCRIPT = (
+    "for (const [key, value] of arguments[0]) {"
+    " localStorage.setItem(key, value); }"
+    "for (const [key, value] of arguments[1]) {"
+    " sessionStorage.setItem(key, value); }"
+)
+
+
+def get_cache_path(trade):
+    """Return the path of the encrypted session cache."""
+    return os.path.join(trade.config_directory, "session.json.gpg")
+
+
+def get_login_length(program):
+    """Return the number of leading login instructions in a program.
+
+    A login sequence starts with a 'get' and ends with the first
+    'wait_absent' or 'await_absent', whose XPath marks the unauthenticated
+    page.
+    """
+    if not program or program[0][0] != "get":
+        return 0
+    for index, instruction in enumerate(program):
+        if instruction[0] in {"wait_absent", "await_absent"}:
+            return index + 1
+    return 0
+
+
+def _get_origin(url):
+    """Return the scheme and host part of a URL."""
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+class SessionCache:
+    """Save and restore cookies and storage after a successful login."""
+
+    def __init__(self, path, fingerprint="", lifetime=30):
+        """Initialize the cache with its path and lifetime in minutes."""
+        self.path = path
+        self.fingerprint = fingerprint
+        self.lifetime = lifetime
+
+    def load(self):
+        """Return the cached session state unless it is missing or stale."""
+        if self.lifetime <= 0 or not os.path.isfile(self.path):
+            return None
+
+        try:
+            state = json.loads(file_utilities.read_encrypted_file(self.path))
+        except (CoreUtilitiesError, ValueError):
+            return None
+
+        now = time.time()
+        if state.get("saved_at", 0) + self.lifetime * 60 <= now:
+            return None
+        if any(
+            cookie.get("expiry", now + 1) <= now
+            for cookie in state.get("cookies", [])
+        ):
+            return None
+        return state
+
+    def _write(self, state):
+        """Encrypt the state, reporting instead of raising on failure."""
+        try:
+            file_utilities.write_encrypted_file(
+                self.path,
+                json.dumps(state).encode(),
+                fingerprint=self.fingerprint,
+            )
+        except CoreUtilitiesError as e:
+            print(f"Unable to cache the browser session: {e}")
+
+    def save(self, driver):
+        """Encrypt the cookies and storage of the logged-in session."""
+        if self.lifetime <= 0:
+            return
+
+        local_storage, session_storage = driver.execute_script(
+            _GET_STORAGE_SCRIPT
+        )
+        self._write(
+            {
+                "saved_at": time.time(),
+                "landing_url": driver.current_url,
+                "cookies": driver.get_cookies(),
+                "local_storage": local_storage,
+                "session_storage": session_storage,
+            }
+        )
+
+    def remember(self, driver, **values):
+        """Merge current cookies and values into a valid cached session."""
+        state = self.load()
+        if state is None:
+            return
+
+        cookies = {
+            (cookie["name"], cookie.get("domain"), cookie.get("path")): cookie
+            for cookie in state["cookies"] + driver.get_cookies()
+        }
+        state.update(values, cookies=list(cookies.values()))
+        self._write(state)
+
+    def restore(self, driver, login_steps):
+        """Restore a cached session and return whether it is still valid."""
+        state = self.load()
+        if state is None:
+            return False
+
+        landing_url = state["landing_url"]
+        landing_host = urlsplit(landing_url).hostname or ""
+        with profiling.span("restore session", "selenium"):
+            # WebDriver only accepts cookies for the domain of the current
+            # page, so visit a cheap page on each cookie domain first.
+            cookies_by_host = {}
+            for cookie in state["cookies"]:
+                domain = cookie.get("domain", landing_host)
+                host = (
+                    landing_host
+                    if landing_host.endswith(domain.lstrip("."))
+                    else domain.lstrip(".")
+                )
+                cookies_by_host.setdefault(host, []).append(cookie)
+            scheme = urlsplit(landing_url).scheme
+            for host, cookies in cookies_by_host.items():
+                driver.get(f"{scheme}://{host}/robots.txt")
+                for cookie in cookies:
+                    driver.add_cookie(cookie)
+
+            driver.get(f"{_get_origin(landing_url)}/robots.txt")
+            driver.execute_script(
+                _SET_STORAGE_SCRIPT,
+                state["local_storage"],
+                state["session_storage"],
+            )
+            driver.get(landing_url)
+            if urlsplit(driver.current_url).hostname != landing_host:
+                return False
+            return not driver.find_elements(By.XPATH, login_steps[-1][1])
@@ -0,0 +1,143 @@
+"""Plaintext catalog of timestamped snapshot archive generations."""
+
+import datetime
+import json
+import os
+import tempfile
+import time
+
+from app import snapshot_codecs, snapshot_manifest
+from core_utilities.errors import UtilityOperationError
+
+GENERATION_FORMAT = "%Y%m%dT%H%M%S"
+
+
+def get_generation_name():
+    """Return the name of a generation taken now."""
+    return time.strftime(GENERATION_FORMAT)
+
+
+def select_generations(names, daily, weekly):
+    """Return the names to keep under a daily and weekly retention.
+
+    The latest generation of each of the last daily days and weekly ISO
+    weeks that have generations is kept, as is the latest generation.
+    """
+    names = sorted(names, reverse=True)
+    kept = set(names[:1])
+    for count, period_format in [(daily, "%Y%m%d"), (weekly, "%G%V")]:
+        periods = {}
+        for name in names:
+            period = datetime.datetime.strptime(
+                name, GENERATION_FORMAT
+            ).strftime(period_format)
+            if period not in periods and len(periods) < count:
+                periods[period] = name
+        kept.update(periods.values())
+    return kept
+
+
+class SnapshotCatalog:
+    """List the archive generations of a directory in a plaintext index.
+
+    The index records the file, codec, size, and BLAKE2b hash of each
+    encrypted archive so that generations can be listed and picked without
+    decrypting them.
+    """
+
+    def __init__(self, source, snapshot_directory, daily=7, weekly=4):
+        """Initialize the catalog and its retention."""
+        self.source = source
+        self.snapshot_directory = snapshot_directory
+        self.daily = daily
+        self.weekly = weekly
+        self.path = os.path.join(
+            snapshot_directory, f"{os.path.basename(source)}.snapshots.json"
+        )
+
+    def load(self):
+        """Return the generations from the oldest to the latest."""
+        if not os.path.isfile(self.path):
+            return []
+        with open(self.path, encoding="utf-8") as f:
+            return sorted(json.load(f), key=lambda entry: entry["name"])
+
+    def _save(self, generations):
+        """Replace the index with the generations."""
+        file_descriptor, temporary_path = tempfile.mkstemp(
+            prefix=f".{os.path.basename(self.path)}.",
+            suffix=".tmp",
+            dir=self.snapshot_directory,
+        )
+        try:
+            with os.fdopen(file_descriptor, "w", encoding="utf-8") as f:
+                json.dump(generations, f, indent=2)
+            os.replace(temporary_path, self.path)
+        except BaseException:
+            os.remove(temporary_path)
+            raise
+
+    def add(self, name, path, codec):
+        """Record the archive of a generation and apply the retention."""
+        with open(path, "rb") as f:
+            digest = snapshot_manifest.hash_stream(f)
+        generations = [
+            entry for entry in self.load() if entry["name"] != name
+        ] + [
+            {
+                "name": name,
+                "file": os.path.basename(path),
+                "codec": codec,
+                "size": os.path.getsize(path),
+                "blake2b": digest,
+            }
+        ]
+        kept = select_generations(
+            [entry["name"] for entry in generations], self.daily, self.weekly
+        )
+        # Save the index before pruning so that it never lists an archive
+        # that has been deleted.
+        self._save(
+            sorted(
+                (entry for entry in generations if entry["name"] in kept),
+                key=lambda entry: entry["name"],
+            )
+        )
+        for entry in generations:
+            if entry["name"] not in kept:
+                archive = os.path.join(self.snapshot_directory, entry["file"])
+                if os.path.isfile(archive):
+                    os.remove(archive)
+
+    def get_path(self, name=None):
+        """Return the archive of the latest or named generation.
+
+        Without generations, the archive written before the catalog is
+        returned.
+        """
+        generations = self.load()
+        if name:
+            for entry in generations:
+                if entry["name"] == name:
+                    return os.path.join(self.snapshot_directory, entry["file"])
+            raise UtilityOperationError(
+                f"No snapshot generation {name} in {self.path}"
+            )
+        if generations:
+            return os.path.join(
+                self.snapshot_directory, generations[-1]["file"]
+            )
+        return snapshot_codecs.find_latest_archive(
+            self.source, self.snapshot_directory
+        )
+
+    def format_listing(self):
+        """Return a table of the generations from the latest."""
+        lines = [f"{'generation':<16} {'codec':<5} {'MiB':>9}  blake2b"]
+        for entry in reversed(self.load()):
+            lines.append(
+                f"{entry['name']:<16} {entry['codec']:<5}"
+                f" {entry['size'] / 1024 / 1024:9.1f}"
+                f"  {entry['blake2b'][:16]}"
+            )
+        return "\n".join(lines)
@@ -0,0 +1,264 @@
+"""Selectable, multi-threaded compression codecs for snapshots."""
+
+import collections
+import concurrent.futures
+import contextlib
+import gzip
+import io
+import json
+import lzma
+import os
+import random
+import tarfile
+import tempfile
+import time
+import zlib
+
+from core_utilities.errors import UtilityOperationError
+
+# File name extensions of the codecs, which identify them on restore.
+EXTENSIONS = {"xz": "xz", "zstd": "zst", "gzip": "gz"}
+XZ_BLOCK_SIZE = 4 * 1024 * 1024
+ZSTD_LEVEL = 10
+
+
+def _import_zstandard():
+    """Return the optional zstandard module."""
+    try:
+        import zstandard
+    except ImportError as e:
+        raise UtilityOperationError(
+            "The zstd codec requires the zstandard package. Install it with"
+            " 'python -m pip install zstandard', or set the snapshot_codec"
+            " option to xz or gzip."
+        ) from e
+    return zstandard
+
+
+def check_codec(codec):
+    """Raise UtilityOperationError unless the codec can be used."""
+    if codec not in EXTENSIONS:
+        raise UtilityOperationError(f"Unknown snapshot codec: {codec}")
+    if codec == "zstd":
+        _import_zstandard()
+
+
+def get_codec(path):
+    """Return the codec of an archive from its file name."""
+    for codec, extension in EXTENSIONS.items():
+        if f".tar.{extension}." in os.path.basename(path):
+            return codec
+    raise UtilityOperationError(f"Unknown snapshot codec: {path}")
+
+
+def get_archive_name(source, codec, generation=None):
+    """Return the archive file name of a directory for the codec."""
+    if codec not in EXTENSIONS:
+        raise UtilityOperationError(f"Unknown snapshot codec: {codec}")
+    stem = os.path.basename(source)
+    if generation:
+        stem = f"{stem}.{generation}"
+    return f"{stem}.tar.{EXTENSIONS[codec]}.gpg"
+
+
+def find_latest_archive(source, snapshot_directory):
+    """Return the most recent archive of a directory in any codec."""
+    paths = [
+        os.path.join(snapshot_directory, get_archive_name(source, codec))
+        for codec in EXTENSIONS
+    ]
+    existing = [path for path in paths if os.path.isfile(path)]
+    return max(existing, key=os.path.getmtime) if existing else paths[0]
+
+
+class _ParallelXzWriter:
+    """Compress fixed blocks into concatenated xz streams in threads."""
+
+    def __init__(self, stream, executor, threads):
+        """Initialize the writer around the output stream."""
+        self.stream = stream
+        self.executor = executor
+        self.maximum_pending = threads * 2
+        self.buffer = bytearray()
+        self.pending = collections.deque()
+        self.is_empty = True
+
+    def _submit(self, block):
+        """Compress a block in the pool, writing finished blocks in order."""
+        self.is_empty = False
+        self.pending.append(self.executor.submit(lzma.compress, block))
+        while len(self.pending) > self.maximum_pending:
+            self.stream.write(self.pending.popleft().result())
+
+    def write(self, data):
+        """Buffer the data and submit every complete block."""
+        self.buffer += data
+        while len(self.buffer) >= XZ_BLOCK_SIZE:
+            self._submit(bytes(self.buffer[:XZ_BLOCK_SIZE]))
+            del self.buffer[:XZ_BLOCK_SIZE]
+        return len(data)
+
+    def finish(self):
+        """Compress the remaining data and write every pending block."""
+        if self.buffer or self.is_empty:
+            self._submit(bytes(self.buffer))
+            self.buffer.clear()
+        while self.pending:
+            self.stream.write(self.pending.popleft().result())
+
+
+@contextlib.contextmanager
+def compressor(stream, codec, threads=1):
+    """Yield a writable stream that compresses into the stream."""
+    threads = max(1, threads)
+    if codec == "xz":
+        # Concatenated xz streams are valid .xz files, so each block can be
+        # compressed on its own thread.
+        with concurrent.futures.ThreadPoolExecutor(threads) as executor:
+            writer = _ParallelXzWriter(stream, executor, threads)
+            yield writer
+            writer.finish()
+    elif codec == "zstd":
+        zstandard = _import_zstandard()
+        with zstandard.ZstdCompressor(
+            level=ZSTD_LEVEL, threads=threads if threads > 1 else 0
+        ).stream_writer(stream, closefd=False) as writer:
+            yield writer
+    elif codec == "gzip":
+        with gzip.GzipFile(fileobj=stream, mode="wb") as writer:
+            yield writer
+    else:
+        raise UtilityOperationError(f"Unknown snapshot codec: {codec}")
+
+
+def decompressor(stream, codec):
+    """Return a readable stream that decompresses the stream."""
+    if codec == "xz":
+        return lzma.LZMAFile(stream)
+    if codec == "zstd":
+        return (
+            _import_zstandard()
+            .ZstdDecompressor()
+            .stream_reader(stream, closefd=False)
+        )
+    if codec == "gzip":
+        return gzip.GzipFile(fileobj=stream, mode="rb")
+    raise UtilityOperationError(f"Unknown snapshot codec: {codec}")
+
+
+def get_decompression_errors(codec):
+    """Return the exceptions the codec raises on corrupt data."""
+    errors = (EOFError, lzma.LZMAError, zlib.error, gzip.BadGzipFile)
+    if codec == "zstd":
+        errors += (_import_zstandard().ZstdError,)
+    return errors
+
+
+def compress(data, codec):
+    """Compress one chunk with the codec."""
+    if codec == "xz":
+        return lzma.compress(data)
+    if codec == "zstd":
+        return (
+            _import_zstandard().ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+        )
+    if codec == "gzip":
+        return zlib.compress(data)
+    raise UtilityOperationError(f"Unknown snapshot codec: {codec}")
+
+
+def decompress(data, codec):
+    """Decompress one chunk compressed with the codec."""
+    if codec == "xz":
+        return lzma.decompress(data)
+    if codec == "zstd":
+        return _import_zstandard().ZstdDecompressor().decompress(data)
+    if codec == "gzip":
+        return zlib.decompress(data)
+    raise UtilityOperationError(f"Unknown snapshot codec: {codec}")
+
+
+class _CountingSink(io.RawIOBase):
+    """Count the bytes written and discard them."""
+
+    def __init__(self):
+        """Initialize the count."""
+        self.size = 0
+
+    def writable(self):
+        """Return that the sink accepts writes."""
+        return True
+
+    def write(self, data):
+        """Count and discard the data."""
+        self.size += len(data)
+        return len(data)
+
+
+def _build_synthetic_tree(root, scale):
+    """Write chart caches, settings, and opaque files like HYPERSBI2's."""
+    generator = random.Random(0)
+    for index in range(8 * scale):
+        price = 1000.0
+        rows = []
+        for minute in range(20000):
+            price = max(1.0, price + generator.gauss(0, 2))
+            rows.append(
+                f"2026-10-19T{minute // 60 % 24:02d}:{minute % 60:02d},"
+                f"{price:.1f},{generator.randrange(100, 100000)}"
+            )
+        directory = os.path.join(root, "chart", f"{1301 + index}")
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, "1m.csv"), "w") as f:
+            f.write("\n".join(rows))
+    os.makedirs(os.path.join(root, "settings"), exist_ok=True)
+    for index in range(50 * scale):
+        with open(
+            os.path.join(root, "settings", f"layout_{index}.json"), "w"
+        ) as f:
+            json.dump(
+                {
+                    "windows": [
+                        {"id": window, "x": window * 10, "visible": True}
+                        for window in range(40)
+                    ]
+                },
+                f,
+            )
+    with open(os.path.join(root, "cache.bin"), "wb") as f:
+        f.write(generator.randbytes(2 * 1024 * 1024 * scale))
+
+
+def benchmark(threads, scale=1):
+    """Return a table comparing the codecs on a synthetic tree."""
+    lines = [f"{'codec':<6} {'seconds':>8} {'MiB/s':>8} {'ratio':>7}"]
+    with tempfile.TemporaryDirectory() as directory:
+        root = os.path.join(directory, "HYPERSBI2")
+        _build_synthetic_tree(root, scale)
+        size = sum(
+            os.path.getsize(os.path.join(path, name))
+            for path, _, names in os.walk(root)
+            for name in names
+        )
+        for codec in EXTENSIONS:
+            sink = _CountingSink()
+            start = time.perf_counter()
+            try:
+                with compressor(sink, codec, threads) as stream, tarfile.open(
+                    fileobj=stream, mode="w|"
+                ) as tar:
+                    tar.add(root, arcname="HYPERSBI2")
+            except UtilityOperationError as e:
+                lines.append(f"{codec:<6} {e}")
+                continue
+            seconds = time.perf_counter() - start
+            lines.append(
+                f"{codec:<6} {seconds:8.2f}"
+                f" {size / 1024 / 1024 / seconds:8.1f}"
+                f" {size / sink.size:7.2f}"
+            )
+    lines.append(
+        f"{size / 1024 / 1024:.1f} MiB of synthetic application data with"
+        f" {threads} thread(s)"
+    )
+    return "\n".join(lines)
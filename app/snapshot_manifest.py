@@ -0,0 +1,226 @@
+"""Per-file manifests that let a restore rewrite only changed files."""
+
+import contextlib
+import hashlib
+import os
+import shutil
+import stat
+
+from app import snapshot_sources
+
+# The manifest is the first archive member so that a streaming restore can
+# skip unchanged files as their members arrive. The digests of the files are
+# computed while the archive streams them, so they follow as the last member.
+MANIFEST_NAME = ".manifest.json"
+DIGESTS_NAME = ".manifest.blake2b.json"
+
+
+def _get_path(directory, name):
+    """Return the path of an archive member name under the directory."""
+    return os.path.join(directory, *name.split("/"))
+
+
+def hash_stream(stream):
+    """Return the BLAKE2b hex digest of a binary stream."""
+    return hashlib.file_digest(stream, "blake2b").hexdigest()
+
+
+def _hash_file(path):
+    """Return the BLAKE2b hex digest of a file."""
+    with open(path, "rb") as f:
+        return hash_stream(f)
+
+
+def build(source, source_filter=None):
+    """Return the manifest of the regular files the filter selects.
+
+    Files are only stat'ed, so their entries have no digest.
+    """
+    source_filter = source_filter or snapshot_sources.SourceFilter()
+    root = os.path.basename(source)
+    files = {}
+    for directory, directories, names in os.walk(source):
+        relative_root = os.path.relpath(directory, source).replace(os.sep, "/")
+        prefix = "" if relative_root == "." else f"{relative_root}/"
+        directories[:] = sorted(
+            name
+            for name in directories
+            if source_filter.includes(f"{prefix}{name}", True)
+        )
+        for name in sorted(names):
+            path = os.path.join(directory, name)
+            status = os.lstat(path)
+            relative_path = f"{prefix}{name}"
+            if not stat.S_ISREG(status.st_mode) or not source_filter.includes(
+                relative_path
+            ):
+                continue
+            files[f"{root}/{relative_path}"] = {
+                "size": status.st_size,
+                "mtime_ns": status.st_mtime_ns,
+            }
+    return {
+        "root": root,
+        "include": source_filter.include_patterns,
+        "exclude": source_filter.exclude_patterns,
+        "files": files,
+    }
+
+
+def is_unchanged(path, entry):
+    """Return whether the live file already has the content of the entry.
+
+    Only a file whose size matches but whose modification time differs is
+    hashed, and only against an entry with a digest.
+    """
+    try:
+        status = os.lstat(path)
+    except FileNotFoundError:
+        return False
+    if not stat.S_ISREG(status.st_mode) or status.st_size != entry["size"]:
+        return False
+    if status.st_mtime_ns == entry["mtime_ns"]:
+        return True
+    return "blake2b" in entry and _hash_file(path) == entry["blake2b"]
+
+
+class _Journal:
+    """Record the moves of a restore so that they can be undone."""
+
+    def __init__(self, backup):
+        """Initialize the journal with its backup directory."""
+        self.backup = backup
+        self.moves = []
+        self.directories = []
+        self.times = []
+
+    def make_directories(self, path):
+        """Create the missing directories of the path."""
+        missing = []
+        while not os.path.isdir(path):
+            missing.append(path)
+            path = os.path.dirname(path)
+        for directory in reversed(missing):
+            os.mkdir(directory)
+            self.directories.append(directory)
+
+    def set_aside(self, path, name):
+        """Move a live path into the backup directory."""
+        backup_path = _get_path(self.backup, name)
+        os.makedirs(os.path.dirname(backup_path), exist_ok=True)
+        os.replace(path, backup_path)
+        self.moves.append((path, backup_path))
+
+    def put(self, staged_path, path):
+        """Move a staged path into place."""
+        self.make_directories(os.path.dirname(path))
+        os.replace(staged_path, path)
+        self.moves.append((path, None))
+
+    def set_mtime(self, path, mtime_ns):
+        """Set the modification time of a live path."""
+        status = os.lstat(path)
+        if status.st_mtime_ns == mtime_ns:
+            return
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+        self.times.append((path, (status.st_atime_ns, status.st_mtime_ns)))
+
+    def roll_back(self):
+        """Undo the recorded times and moves in reverse order."""
+        for path, times in reversed(self.times):
+            os.utime(path, ns=times)
+        for path, backup_path in reversed(self.moves):
+            if backup_path is None:
+                os.remove(path)
+            else:
+                os.replace(backup_path, path)
+        for directory in reversed(self.directories):
+            os.rmdir(directory)
+
+
+def _walk(directory):
+    """Yield each root, its member name prefix, directories, and files.
+
+    Symbolic links to directories are yielded as files. Removing names
+    from the directories skips them.
+    """
+    for root, directories, files in os.walk(directory):
+        links = [
+            name
+            for name in directories
+            if os.path.islink(os.path.join(root, name))
+        ]
+        directories[:] = [name for name in directories if name not in links]
+        relative_root = os.path.relpath(root, directory).replace(os.sep, "/")
+        yield (
+            root,
+            "" if relative_root == "." else f"{relative_root}/",
+            directories,
+            files + links,
+        )
+
+
+def apply(manifest, staging, output_directory, names, backup):
+    """Move the staged members into the live root, undoing it on failure.
+
+    The names are those of every archive member. Live paths not among them
+    are removed unless the filter of the manifest excludes them, and live
+    files the staging directory lacks are kept.
+    """
+    source_filter = snapshot_sources.SourceFilter(
+        manifest.get("include", []), manifest.get("exclude", [])
+    )
+    root_prefix = f"{manifest['root']}/"
+    live_root = os.path.join(output_directory, manifest["root"])
+    os.mkdir(backup)
+    journal = _Journal(backup)
+    stale_directories = []
+    try:
+        for root, prefix, directories, files in _walk(live_root):
+            # Excluded paths were never archived, so they are kept.
+            directories[:] = [
+                name
+                for name in directories
+                if source_filter.includes(f"{prefix}{name}", True)
+            ]
+            files = [
+                name
+                for name in files
+                if source_filter.includes(f"{prefix}{name}")
+            ]
+            prefix = f"{root_prefix}{prefix}"
+            stale_directories.extend(
+                os.path.join(root, name)
+                for name in directories
+                if f"{prefix}{name}" not in names
+            )
+            for name in files:
+                if f"{prefix}{name}" not in names:
+                    journal.set_aside(
+                        os.path.join(root, name), f"{prefix}{name}"
+                    )
+
+        for root, prefix, directories, files in _walk(staging):
+            for name in directories:
+                journal.make_directories(
+                    _get_path(output_directory, f"{prefix}{name}")
+                )
+            for name in sorted(files):
+                path = _get_path(output_directory, f"{prefix}{name}")
+                if os.path.lexists(path):
+                    journal.set_aside(path, f"{prefix}{name}")
+                journal.put(os.path.join(root, name), path)
+        for name, entry in manifest["files"].items():
+            journal.set_mtime(
+                _get_path(output_directory, name), entry["mtime_ns"]
+            )
+    except BaseException:
+        journal.roll_back()
+        shutil.rmtree(backup, ignore_errors=True)
+        raise
+
+    # Stale directories that hold excluded paths are kept.
+    for directory in sorted(stale_directories, reverse=True):
+        with contextlib.suppress(OSError):
+            os.rmdir(directory)
+    shutil.rmtree(backup, ignore_errors=True)
@@ -0,0 +1,253 @@
+"""Delta replication of snapshot files to secondary directories."""
+
+import contextlib
+import hashlib
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from app import profiling, snapshot_manifest
+from core_utilities.errors import UtilityOperationError
+
+BLOCK_SIZE = 4096
+# Scan this many bytes at a time to bound the memory of the checksum arrays.
+SEGMENT_SIZE = 1024 * 1024
+# File systems such as FAT store modification times in 2-second steps.
+MODIFY_WINDOW_NS = 2 * 10**9
+# Encrypted files differ throughout after any change, so their replicas are
+# replaced without being searched for matching blocks.
+ENCRYPTED_SUFFIX = ".gpg"
+
+
+def _get_weak_checksums(data):
+    """Return the rolling checksum of every block-sized window of the data.
+
+    The checksum is the rsync pair of the byte sum and the position-weighted
+    byte sum, each modulo 2**16, so that both follow from cumulative sums.
+    """
+    values = np.frombuffer(data, dtype=np.uint8).astype(np.int64)
+    sums = np.concatenate(([0], np.cumsum(values)))
+    weighted_sums = np.concatenate(
+        ([0], np.cumsum(values * np.arange(len(values), dtype=np.int64)))
+    )
+    starts = np.arange(len(values) - BLOCK_SIZE + 1, dtype=np.int64)
+    ends = starts + BLOCK_SIZE
+    byte_sums = sums[ends] - sums[starts]
+    # Each byte weighs its distance from the end of the window.
+    weighted = ends * byte_sums - (weighted_sums[ends] - weighted_sums[starts])
+    return (byte_sums & 0xFFFF) | ((weighted & 0xFFFF) << 16)
+
+
+def _get_strong_checksum(block):
+    """Return the strong checksum that confirms a weak match."""
+    return hashlib.blake2b(block, digest_size=16).digest()
+
+
+def _get_signature(path, statistics):
+    """Return the checksums of the full blocks of a file by weak checksum."""
+    signature = {}
+    with open(path, "rb") as f:
+        index = 0
+        while block := f.read(BLOCK_SIZE):
+            statistics["read"] += len(block)
+            if len(block) < BLOCK_SIZE:
+                break
+            weak = int(_get_weak_checksums(block)[0])
+            signature.setdefault(weak, {}).setdefault(
+                _get_strong_checksum(block), index
+            )
+            index += 1
+    return signature
+
+
+def _get_delta(path, signature):
+    """Yield the block indexes and literal bytes that rebuild a file.
+
+    Windows whose weak checksum occurs in the signature are found in bulk,
+    and only those are confirmed with the strong checksum.
+    """
+    weak_keys = np.fromiter(signature, dtype=np.int64, count=len(signature))
+    buffer = b""
+    with open(path, "rb") as f:
+        while True:
+            block = f.read(SEGMENT_SIZE)
+            buffer += block
+            position = 0
+            if len(buffer) >= BLOCK_SIZE and len(weak_keys):
+                weak_checksums = _get_weak_checksums(buffer)
+                for candidate in np.flatnonzero(
+                    np.isin(weak_checksums, weak_keys)
+                ):
+                    candidate = int(candidate)
+                    if candidate < position:
+                        continue
+                    end = candidate + BLOCK_SIZE
+                    index = signature[int(weak_checksums[candidate])].get(
+                        _get_strong_checksum(buffer[candidate:end])
+                    )
+                    if index is None:
+                        continue
+                    if position < candidate:
+                        yield buffer[position:candidate]
+                    yield index
+                    position = end
+            if not block:
+                if position < len(buffer):
+                    yield buffer[position:]
+                return
+            # Keep the tail that can still start a window with more data.
+            tail_start = max(position, len(buffer) - BLOCK_SIZE + 1)
+            if position < tail_start:
+                yield buffer[position:tail_start]
+            buffer = buffer[tail_start:]
+
+
+def _hash_file(path, statistics=None):
+    """Return the BLAKE2b digest of a file, counting the bytes read."""
+    with open(path, "rb") as f:
+        digest = snapshot_manifest.hash_stream(f)
+        if statistics is not None:
+            statistics["read"] += f.tell()
+    return digest
+
+
+def _write_delta(source, target, f, statistics):
+    """Write the source to the file with the blocks the target has."""
+    signature = _get_signature(target, statistics)
+    with open(target, "rb") as previous:
+        for instruction in _get_delta(source, signature):
+            if isinstance(instruction, int):
+                previous.seek(instruction * BLOCK_SIZE)
+                block = previous.read(BLOCK_SIZE)
+                statistics["read"] += len(block)
+                statistics["reused"] += len(block)
+                f.write(block)
+            else:
+                statistics["sent"] += len(instruction)
+                f.write(instruction)
+
+
+def _transfer(source, target, statistics):
+    """Replace the target with a verified copy of the source.
+
+    A changed file that is not encrypted is rebuilt from the blocks its
+    replica already has, found with rolling checksums, and the rest is sent
+    from the source. The new replica is written to a temporary file, read
+    back, and compared with the source by hash before it replaces the
+    previous one, so an interrupted or corrupt transfer keeps the previous
+    replica.
+    """
+    directory = os.path.dirname(target)
+    os.makedirs(directory, exist_ok=True)
+    file_descriptor, temporary_path = tempfile.mkstemp(
+        prefix=f".{os.path.basename(target)}.", suffix=".tmp", dir=directory
+    )
+    try:
+        with os.fdopen(file_descriptor, "wb") as f:
+            if not target.endswith(ENCRYPTED_SUFFIX) and os.path.isfile(
+                target
+            ):
+                _write_delta(source, target, f, statistics)
+            else:
+                with open(source, "rb") as new:
+                    shutil.copyfileobj(new, f)
+                statistics["sent"] += f.tell()
+            statistics["written"] += f.tell()
+        shutil.copystat(source, temporary_path)
+        if _hash_file(temporary_path, statistics) != _hash_file(source):
+            raise UtilityOperationError(
+                f"The replica of {source} does not match it."
+            )
+        os.replace(temporary_path, target)
+    finally:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(temporary_path)
+
+
+def _list_files(directory, prefix):
+    """Return the relative paths of the files of the prefixed entries."""
+    paths = []
+    if not os.path.isdir(directory):
+        return paths
+    for entry in sorted(os.listdir(directory)):
+        path = os.path.join(directory, entry)
+        if not entry.startswith(prefix):
+            continue
+        if os.path.isfile(path):
+            paths.append(entry)
+            continue
+        for root, directories, files in os.walk(path):
+            directories.sort()
+            paths.extend(
+                os.path.relpath(os.path.join(root, name), directory)
+                for name in sorted(files)
+            )
+    # Skip the temporary files of writes in progress.
+    return [
+        path
+        for path in paths
+        if not (
+            os.path.basename(path).startswith(".") and path.endswith(".tmp")
+        )
+    ]
+
+
+def replicate(snapshot_directory, source, target_directory):
+    """Mirror the snapshot files of the source to the target directory.
+
+    Unchanged files are skipped by size and modification time, changed
+    files are transferred and verified, and the replicas of removed files
+    are deleted. A missing target directory is created when there is a
+    file to copy. Return a one-line report of the bytes sent from the
+    source and the bytes written to and read from the target directory.
+    """
+    prefix = f"{os.path.basename(source)}."
+    statistics = {
+        "files": 0,
+        "sent": 0,
+        "reused": 0,
+        "written": 0,
+        "read": 0,
+        "deleted": 0,
+    }
+    source_files = _list_files(snapshot_directory, prefix)
+    with profiling.span("replicate", "file", target=target_directory):
+        for relative_path in source_files:
+            source_path = os.path.join(snapshot_directory, relative_path)
+            target_path = os.path.join(target_directory, relative_path)
+            source_status = os.stat(source_path)
+            with contextlib.suppress(FileNotFoundError):
+                target_status = os.stat(target_path)
+                if (
+                    target_status.st_size == source_status.st_size
+                    and abs(
+                        target_status.st_mtime_ns - source_status.st_mtime_ns
+                    )
+                    < MODIFY_WINDOW_NS
+                ):
+                    continue
+            _transfer(source_path, target_path, statistics)
+            statistics["files"] += 1
+
+        kept = set(source_files)
+        for relative_path in _list_files(target_directory, prefix):
+            if relative_path not in kept:
+                os.remove(os.path.join(target_directory, relative_path))
+                statistics["deleted"] += 1
+        if os.path.isdir(target_directory):
+            for entry in os.listdir(target_directory):
+                path = os.path.join(target_directory, entry)
+                if entry.startswith(prefix) and os.path.isdir(path):
+                    for root, _, _ in os.walk(path, topdown=False):
+                        with contextlib.suppress(OSError):
+                            os.rmdir(root)
+    return (
+        f"Replicated {statistics['files']} file(s) to {target_directory}:"
+        f" {statistics['sent']} byte(s) sent,"
+        f" {statistics['reused']} byte(s) reused,"
+        f" {statistics['written']} byte(s) written,"
+        f" {statistics['read']} byte(s) read,"
+        f" {statistics['deleted']} file(s) deleted."
+    )
@@ -0,0 +1,125 @@
+"""Include and exclude rules and a parallel size scan of snapshot sources."""
+
+import collections
+import concurrent.futures
+import fnmatch
+import os
+
+
+class SourceFilter:
+    """Select the paths of a snapshot source by glob patterns.
+
+    Paths are relative to the source with '/' separators. A pattern without
+    '/' also matches the last component of a path. Excluded directories are
+    not walked, and while include patterns exist, only the files they match
+    are selected.
+    """
+
+    def __init__(self, include_patterns=(), exclude_patterns=()):
+        """Initialize the filter with its patterns."""
+        self.include_patterns = list(include_patterns)
+        self.exclude_patterns = list(exclude_patterns)
+
+    @classmethod
+    def from_section(cls, section):
+        """Return the filter of the space-separated options of a section."""
+        return cls(
+            section.get("snapshot_include_patterns", "").split(),
+            section.get("snapshot_exclude_patterns", "").split(),
+        )
+
+    @staticmethod
+    def _matches(relative_path, patterns):
+        """Return whether the path matches any of the patterns."""
+        name = relative_path.rsplit("/", 1)[-1]
+        return any(
+            fnmatch.fnmatch(relative_path, pattern)
+            or ("/" not in pattern and fnmatch.fnmatch(name, pattern))
+            for pattern in patterns
+        )
+
+    def includes(self, relative_path, is_directory=False):
+        """Return whether the path is part of snapshots."""
+        if self._matches(relative_path, self.exclude_patterns):
+            return False
+        if is_directory or not self.include_patterns:
+            return True
+        return self._matches(relative_path, self.include_patterns)
+
+
+def _scan_directory(source, relative_root, is_excluded, source_filter):
+    """Return the included and excluded file bytes and the subdirectories."""
+    included = excluded = 0
+    subdirectories = []
+    with os.scandir(os.path.join(source, relative_root)) as entries:
+        for entry in entries:
+            relative_path = (
+                f"{relative_root}/{entry.name}"
+                if relative_root
+                else entry.name
+            )
+            if entry.is_dir(follow_symlinks=False):
+                subdirectories.append(
+                    (
+                        relative_path,
+                        is_excluded
+                        or not source_filter.includes(relative_path, True),
+                    )
+                )
+            elif entry.is_file(follow_symlinks=False):
+                size = entry.stat(follow_symlinks=False).st_size
+                if is_excluded or not source_filter.includes(relative_path):
+                    excluded += size
+                else:
+                    included += size
+    return relative_root, included, excluded, subdirectories
+
+
+def scan(source, source_filter, threads=4):
+    """Return the included and excluded bytes under each directory.
+
+    Directories are listed with os.scandir in a thread pool, so slow
+    storage is read in parallel. The source itself has the empty key.
+    """
+    totals = collections.defaultdict(lambda: [0, 0])
+    with concurrent.futures.ThreadPoolExecutor(max(1, threads)) as executor:
+        pending = {
+            executor.submit(_scan_directory, source, "", False, source_filter)
+        }
+        while pending:
+            done, pending = concurrent.futures.wait(
+                pending, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            for future in done:
+                relative_root, included, excluded, subdirectories = (
+                    future.result()
+                )
+                parts = relative_root.split("/") if relative_root else []
+                for index in range(len(parts) + 1):
+                    total = totals["/".join(parts[:index])]
+                    total[0] += included
+                    total[1] += excluded
+                for relative_path, is_excluded in subdirectories:
+                    pending.add(
+                        executor.submit(
+                            _scan_directory,
+                            source,
+                            relative_path,
+                            is_excluded,
+                            source_filter,
+                        )
+                    )
+    return totals
+
+
+def format_report(totals, limit=20):
+    """Return a table of the largest subtrees of a scan."""
+    lines = [f"{'MiB':>9} {'excluded':>9}  subtree"]
+    for relative_path, (included, excluded) in sorted(
+        totals.items(), key=lambda item: sum(item[1]), reverse=True
+    )[:limit]:
+        lines.append(
+            f"{included / 1024 / 1024:9.1f} {excluded / 1024 / 1024:9.1f}"
+            f"  {relative_path or '.'}"
+        )
+    return "\n".join(lines)
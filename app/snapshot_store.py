@@ -0,0 +1,625 @@
+"""Deduplicating snapshot store of content-defined, encrypted chunks."""
+
+import collections
+import concurrent.futures
+import contextlib
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+import uuid
+
+import numpy as np
+
+from app import (
+    gpg_streams,
+    profiling,
+    snapshot_catalog,
+    snapshot_codecs,
+    snapshot_manifest,
+    snapshot_sources,
+)
+from core_utilities.errors import UtilityOperationError
+
+MINIMUM_CHUNK_SIZE = 16 * 1024
+MAXIMUM_CHUNK_SIZE = 256 * 1024
+# A boundary follows a window whose hash has 16 low zero bits, which makes
+# chunks average about 64 KiB beyond the minimum size.
+BOUNDARY_MASK = (1 << 16) - 1
+WINDOW_SIZE = 64
+# Read files this many bytes at a time.
+SEGMENT_SIZE = 8 * 1024 * 1024
+# Hash this many bytes at a time, which bounds the hash arrays to about
+# 10 MiB.
+HASH_SEGMENT_SIZE = 1024 * 1024
+# Fixed pseudorandom values per byte; changing them changes every boundary.
+GEAR = np.array(
+    [
+        int.from_bytes(hashlib.sha256(bytes([value])).digest()[:4], "big")
+        for value in range(256)
+    ],
+    dtype=np.uint32,
+)
+INDEX_NAME = "index.json.gpg"
+CATALOG_NAME = "snapshots.json"
+
+
+def get_store_path(application_data_directory, snapshot_directory):
+    """Return the store directory for the application data."""
+    return os.path.join(
+        snapshot_directory,
+        os.path.basename(application_data_directory) + ".store",
+    )
+
+
+def _get_candidates(data):
+    """Return the offsets after every window whose hash marks a boundary."""
+    # The hash of a window is the sum of the gear values of its bytes, so
+    # the hashes of all windows follow from one cumulative sum. Sums wrap
+    # modulo 2**32, which keeps their low bits and so every boundary exact.
+    # Segments overlap by a window less one byte to keep the hashes exact.
+    candidates = []
+    view = np.frombuffer(data, dtype=np.uint8)
+    first_window_end = WINDOW_SIZE - 1
+    for start in range(0, len(data) - first_window_end, HASH_SEGMENT_SIZE):
+        end = start + HASH_SEGMENT_SIZE + first_window_end
+        sums = np.cumsum(GEAR[view[start:end]], dtype=np.uint32)
+        hashes = sums[first_window_end:].copy()
+        last_window_start = len(sums) - WINDOW_SIZE
+        hashes[1:] -= sums[:last_window_start]
+        del sums
+        hashes &= BOUNDARY_MASK
+        candidates.append(np.flatnonzero(hashes == 0) + start + WINDOW_SIZE)
+    return np.concatenate(candidates)
+
+
+def _get_boundaries(data, is_final=True):
+    """Return the end offsets of the content-defined chunks of the data.
+
+    Unless the data is final, only the boundaries that more data cannot
+    move are returned.
+    """
+    if len(data) <= MINIMUM_CHUNK_SIZE:
+        return [len(data)] if is_final and data else []
+
+    candidates = _get_candidates(data)
+
+    boundaries = []
+    start = 0
+    while len(data) - start > MINIMUM_CHUNK_SIZE and (
+        is_final or start + MAXIMUM_CHUNK_SIZE <= len(data)
+    ):
+        position = np.searchsorted(candidates, start + MINIMUM_CHUNK_SIZE)
+        end = start + MAXIMUM_CHUNK_SIZE
+        if position < len(candidates):
+            end = min(end, int(candidates[position]))
+        end = min(end, len(data))
+        boundaries.append(end)
+        start = end
+    if is_final and start < len(data):
+        boundaries.append(len(data))
+    return boundaries
+
+
+class _Packer:
+    """Compress new chunks in threads into one encrypted pack in order."""
+
+    def __init__(
+        self, stack, directory, fingerprint, chunks, codec, threads=1
+    ):
+        """Initialize the packer, opening the pack on the first chunk."""
+        self.stack = stack
+        self.directory = directory
+        self.fingerprint = fingerprint
+        self.chunks = chunks
+        self.codec = codec
+        self.name = uuid.uuid4().hex
+        self.stream = None
+        self.offset = 0
+        self.executor = stack.enter_context(
+            concurrent.futures.ThreadPoolExecutor(max(1, threads))
+        )
+        self.maximum_pending = max(1, threads) * 2
+        self.pending = collections.deque()
+        self.pending_digests = set()
+
+    def _write(self):
+        """Append the oldest compressed chunk to the pack."""
+        digest, future = self.pending.popleft()
+        compressed = future.result()
+        if self.stream is None:
+            self.stream = self.stack.enter_context(
+                gpg_streams.encrypted_writer(
+                    os.path.join(self.directory, f"{self.name}.gpg"),
+                    self.fingerprint,
+                )
+            )
+        self.stream.write(compressed)
+        self.pending_digests.discard(digest)
+        self.chunks[digest] = [
+            self.name,
+            self.offset,
+            len(compressed),
+            self.codec,
+        ]
+        self.offset += len(compressed)
+
+    def add(self, digest, chunk):
+        """Compress a chunk that is not stored yet in the pool."""
+        if digest in self.chunks or digest in self.pending_digests:
+            return
+
+        self.pending_digests.add(digest)
+        self.pending.append(
+            (
+                digest,
+                self.executor.submit(
+                    snapshot_codecs.compress, chunk, self.codec
+                ),
+            )
+        )
+        while len(self.pending) > self.maximum_pending:
+            self._write()
+
+    def finish(self):
+        """Write every pending chunk to the pack."""
+        while self.pending:
+            self._write()
+
+
+class SnapshotStore:
+    """Store snapshots of a directory as manifests of shared chunks.
+
+    New chunks of each snapshot are compressed in threads into one
+    encrypted pack.
+    An encrypted index maps chunk hashes to their pack locations, caches the
+    chunks of files by size and modification time, and records the packs
+    each snapshot uses so that packs no kept snapshot uses are deleted. A
+    plaintext catalog records the size and manifest hash of each snapshot.
+    """
+
+    def __init__(
+        self, path, fingerprint="", daily=7, weekly=4, codec="xz", threads=1
+    ):
+        """Initialize the store with its directory, retention, and codec."""
+        self.path = path
+        self.fingerprint = fingerprint
+        self.daily = daily
+        self.weekly = weekly
+        self.codec = codec
+        self.threads = threads
+        self.index_path = os.path.join(path, INDEX_NAME)
+        self.catalog_path = os.path.join(path, CATALOG_NAME)
+
+    def exists(self):
+        """Return whether the store holds a snapshot index."""
+        return os.path.isfile(self.index_path)
+
+    def _load_catalog(self):
+        """Return the catalog entries by snapshot name."""
+        if not os.path.isfile(self.catalog_path):
+            return {}
+        with open(self.catalog_path, encoding="utf-8") as f:
+            return {entry["name"]: entry for entry in json.load(f)}
+
+    def _save_catalog(self, catalog):
+        """Replace the catalog with the entries."""
+        file_descriptor, temporary_path = tempfile.mkstemp(
+            prefix=f".{CATALOG_NAME}.", suffix=".tmp", dir=self.path
+        )
+        try:
+            with os.fdopen(file_descriptor, "w", encoding="utf-8") as f:
+                json.dump(
+                    [catalog[name] for name in sorted(catalog)], f, indent=2
+                )
+            os.replace(temporary_path, self.catalog_path)
+        except BaseException:
+            os.remove(temporary_path)
+            raise
+
+    def format_listing(self):
+        """Return a table of the snapshots from the latest.
+
+        Snapshots taken before the catalog existed show only their names.
+        """
+        directory = os.path.join(self.path, "snapshots")
+        catalog = self._load_catalog()
+        lines = [f"{'generation':<16} {'files':>7} {'MiB':>9}  blake2b"]
+        for name in sorted(
+            (
+                entry.removesuffix(".json.gpg")
+                for entry in os.listdir(directory)
+                if entry.endswith(".json.gpg")
+            ),
+            reverse=True,
+        ):
+            entry = catalog.get(name)
+            lines.append(
+                f"{name:<16} {entry['files']:>7}"
+                f" {entry['size'] / 1024 / 1024:9.1f}"
+                f"  {entry['blake2b'][:16]}"
+                if entry
+                else f"{name:<16} {'-':>7} {'-':>9}  -"
+            )
+        return "\n".join(lines)
+
+    def _load_index(self):
+        """Return the index, or an empty one for a new store."""
+        if not os.path.isfile(self.index_path):
+            return {"chunks": {}, "files": {}, "snapshots": {}}
+        return json.loads(gpg_streams.read_encrypted(self.index_path))
+
+    def _get_chunks(self, index, path, relative_path, packer):
+        """Return the cached entry of a file, packing its new chunks.
+
+        The entry holds the chunk hashes and the BLAKE2b digest of the file.
+        """
+        status = os.stat(path)
+        signature = [status.st_size, status.st_mtime_ns]
+        cached = index["files"].get(relative_path)
+        if cached and cached["signature"] == signature:
+            return cached
+
+        hashes = []
+        file_hash = hashlib.blake2b()
+        buffer = b""
+        with open(path, "rb") as f:
+            while True:
+                block = f.read(SEGMENT_SIZE)
+                file_hash.update(block)
+                buffer += block
+                start = 0
+                for end in _get_boundaries(buffer, is_final=not block):
+                    chunk = buffer[start:end]
+                    start = end
+                    digest = hashlib.sha256(chunk).hexdigest()
+                    hashes.append(digest)
+                    packer.add(digest, chunk)
+                buffer = buffer[start:]
+                if not block:
+                    break
+        index["files"][relative_path] = {
+            "signature": signature,
+            "chunks": hashes,
+            "blake2b": file_hash.hexdigest(),
+        }
+        return index["files"][relative_path]
+
+    def create(self, source, source_filter=None):
+        """Store a snapshot of the source directory and return its name.
+
+        Only the paths the source filter selects are stored.
+        """
+        source_filter = source_filter or snapshot_sources.SourceFilter()
+        index = self._load_index()
+        os.makedirs(os.path.join(self.path, "packs"), exist_ok=True)
+        os.makedirs(os.path.join(self.path, "snapshots"), exist_ok=True)
+        manifest = {
+            "include": source_filter.include_patterns,
+            "exclude": source_filter.exclude_patterns,
+            "directories": [],
+            "files": [],
+        }
+        seen_files = set()
+        size = 0
+        with contextlib.ExitStack() as stack, profiling.span(
+            "chunk files", "file"
+        ):
+            packer = _Packer(
+                stack,
+                os.path.join(self.path, "packs"),
+                self.fingerprint,
+                index["chunks"],
+                self.codec,
+                self.threads,
+            )
+            for root, directories, files in os.walk(source):
+                relative_root = os.path.relpath(root, source)
+                relative_root = relative_root.replace(os.sep, "/")
+                prefix = "" if relative_root == "." else f"{relative_root}/"
+                directories[:] = sorted(
+                    name
+                    for name in directories
+                    if source_filter.includes(f"{prefix}{name}", True)
+                )
+                if relative_root != ".":
+                    manifest["directories"].append(relative_root)
+                for name in sorted(files):
+                    path = os.path.join(root, name)
+                    relative_path = f"{prefix}{name}"
+                    if not source_filter.includes(relative_path):
+                        continue
+                    seen_files.add(relative_path)
+                    status = os.stat(path)
+                    size += status.st_size
+                    cached = self._get_chunks(
+                        index, path, relative_path, packer
+                    )
+                    entry = {
+                        "path": relative_path,
+                        "size": status.st_size,
+                        "mtime_ns": status.st_mtime_ns,
+                        "chunks": cached["chunks"],
+                    }
+                    # Files cached before digests were recorded have none.
+                    if "blake2b" in cached:
+                        entry["blake2b"] = cached["blake2b"]
+                    manifest["files"].append(entry)
+            packer.finish()
+        index["files"] = {
+            path: value
+            for path, value in index["files"].items()
+            if path in seen_files
+        }
+
+        name = time.strftime(snapshot_catalog.GENERATION_FORMAT)
+        manifest_path = os.path.join(
+            self.path, "snapshots", f"{name}.json.gpg"
+        )
+        gpg_streams.write_encrypted(
+            manifest_path, json.dumps(manifest).encode(), self.fingerprint
+        )
+        catalog = self._load_catalog()
+        with open(manifest_path, "rb") as f:
+            catalog[name] = {
+                "name": name,
+                "files": len(manifest["files"]),
+                "size": size,
+                "packed": packer.offset,
+                "blake2b": snapshot_manifest.hash_stream(f),
+            }
+        index["snapshots"][name] = sorted(
+            {
+                index["chunks"][digest][0]
+                for entry in manifest["files"]
+                for digest in entry["chunks"]
+            }
+        )
+        self._prune(index, catalog)
+        gpg_streams.write_encrypted(
+            self.index_path, json.dumps(index).encode(), self.fingerprint
+        )
+        self._save_catalog(catalog)
+        return name
+
+    def _prune(self, index, catalog):
+        """Delete the snapshots beyond the retention and their packs.
+
+        The latest snapshot of each of the last daily days and weekly weeks
+        is kept, as are the packs the kept snapshots use.
+        """
+        kept = snapshot_catalog.select_generations(
+            index["snapshots"], self.daily, self.weekly
+        )
+        for name in sorted(set(index["snapshots"]) - kept):
+            del index["snapshots"][name]
+            catalog.pop(name, None)
+            manifest_path = os.path.join(
+                self.path, "snapshots", f"{name}.json.gpg"
+            )
+            if os.path.isfile(manifest_path):
+                os.remove(manifest_path)
+
+        used_packs = {
+            pack for packs in index["snapshots"].values() for pack in packs
+        }
+        index["chunks"] = {
+            digest: location
+            for digest, location in index["chunks"].items()
+            if location[0] in used_packs
+        }
+        index["files"] = {
+            path: value
+            for path, value in index["files"].items()
+            if all(digest in index["chunks"] for digest in value["chunks"])
+        }
+        for entry in os.listdir(os.path.join(self.path, "packs")):
+            if entry.removesuffix(".gpg") not in used_packs:
+                os.remove(os.path.join(self.path, "packs", entry))
+
+    def _read_chunk(self, index, digest, packs, temporary_directory, stack):
+        """Return a chunk checked against its hash from its decrypted pack.
+
+        Packs are decrypted into the temporary directory on first use.
+        """
+        if digest not in index["chunks"]:
+            raise UtilityOperationError(f"{digest}: missing from the index")
+        location = index["chunks"][digest]
+        pack_name, offset, length = location[:3]
+        # Chunks stored before codecs were recorded use xz.
+        codec = location[3] if len(location) > 3 else "xz"
+        if pack_name not in packs:
+            pack_path = os.path.join(temporary_directory, pack_name)
+            gpg_streams.decrypt_to_file(
+                os.path.join(self.path, "packs", f"{pack_name}.gpg"),
+                pack_path,
+            )
+            packs[pack_name] = stack.enter_context(open(pack_path, "rb"))
+        packs[pack_name].seek(offset)
+        try:
+            chunk = snapshot_codecs.decompress(
+                packs[pack_name].read(length), codec
+            )
+        except snapshot_codecs.get_decompression_errors(codec):
+            chunk = None
+        if chunk is None or hashlib.sha256(chunk).hexdigest() != digest:
+            raise UtilityOperationError(f"{pack_name}/{digest}: corrupt")
+        return chunk
+
+    def restore(self, output_directory, name=None):
+        """Rebuild the latest or named snapshot as the output directory.
+
+        The files that differ from the snapshot are reassembled next to the
+        output directory first, and the output directory is modified only
+        after every chunk has been checked. Files the manifest shows to be
+        unchanged are neither read from the packs nor rewritten. Paths the
+        snapshot lacks are removed unless its filter excludes them, and the
+        output directory is left as it was if any step fails.
+        """
+        index = self._load_index()
+        if not index["snapshots"]:
+            raise UtilityOperationError(f"No snapshot exists in {self.path}")
+        name = name or max(index["snapshots"])
+        if name not in index["snapshots"]:
+            raise UtilityOperationError(f"No snapshot {name} in {self.path}")
+        manifest = json.loads(
+            gpg_streams.read_encrypted(
+                os.path.join(self.path, "snapshots", f"{name}.json.gpg")
+            )
+        )
+
+        output_directory = os.path.normpath(output_directory)
+        parent_directory = os.path.dirname(output_directory)
+        root = os.path.basename(output_directory)
+        backup = f"{output_directory}.bak"
+        if os.path.lexists(backup):
+            raise FileExistsError(f"The {backup} path exists.")
+        os.makedirs(parent_directory, exist_ok=True)
+        staging = tempfile.mkdtemp(
+            prefix=".restore.", suffix=".tmp", dir=parent_directory
+        )
+        # Decrypted packs go to files next to the application data, not to
+        # the store, which may be synced or replicated, so that memory holds
+        # only one chunk.
+        temporary_directory = tempfile.mkdtemp(
+            prefix=".packs.", suffix=".tmp", dir=parent_directory
+        )
+        names = {root}
+        files = {}
+        try:
+            for directory in manifest["directories"]:
+                names.add(f"{root}/{directory}")
+                os.makedirs(
+                    os.path.join(staging, root, *directory.split("/")),
+                    exist_ok=True,
+                )
+            with contextlib.ExitStack() as stack:
+                packs = {}
+                for entry in manifest["files"]:
+                    member_name = f"{root}/{entry['path']}"
+                    names.add(member_name)
+                    files[member_name] = {
+                        key: entry[key]
+                        for key in ("size", "mtime_ns", "blake2b")
+                        if key in entry
+                    }
+                    # Manifests written before sizes were recorded cannot
+                    # show a file to be unchanged.
+                    if "size" in entry and snapshot_manifest.is_unchanged(
+                        os.path.join(
+                            output_directory, *entry["path"].split("/")
+                        ),
+                        entry,
+                    ):
+                        continue
+
+                    path = os.path.join(staging, *member_name.split("/"))
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    with open(path, "wb") as f:
+                        for digest in entry["chunks"]:
+                            f.write(
+                                self._read_chunk(
+                                    index,
+                                    digest,
+                                    packs,
+                                    temporary_directory,
+                                    stack,
+                                )
+                            )
+                    os.utime(path, ns=(entry["mtime_ns"], entry["mtime_ns"]))
+
+            if os.path.isdir(output_directory):
+                snapshot_manifest.apply(
+                    {
+                        "root": root,
+                        "include": manifest.get("include", []),
+                        "exclude": manifest.get("exclude", []),
+                        "files": files,
+                    },
+                    staging,
+                    parent_directory,
+                    names,
+                    backup,
+                )
+            else:
+                os.replace(os.path.join(staging, root), output_directory)
+        finally:
+            shutil.rmtree(temporary_directory, ignore_errors=True)
+            shutil.rmtree(staging, ignore_errors=True)
+        return name
+
+    def verify(self, name=None):
+        """Check every chunk of the latest or named snapshot.
+
+        Each pack is decrypted as a stream and read once in offset order
+        without writing to disk. Raise UtilityOperationError with the report
+        when a chunk is corrupt or missing.
+        """
+        start = time.perf_counter()
+        index = self._load_index()
+        if not index["snapshots"]:
+            raise UtilityOperationError(f"No snapshot exists in {self.path}")
+        name = name or max(index["snapshots"])
+        if name not in index["snapshots"]:
+            raise UtilityOperationError(f"No snapshot {name} in {self.path}")
+        manifest = json.loads(
+            gpg_streams.read_encrypted(
+                os.path.join(self.path, "snapshots", f"{name}.json.gpg")
+            )
+        )
+
+        problems = []
+        packs = collections.defaultdict(list)
+        digests = {
+            digest for entry in manifest["files"] for digest in entry["chunks"]
+        }
+        for digest in sorted(digests):
+            if digest not in index["chunks"]:
+                problems.append(f"{digest}: missing from the index")
+                continue
+            location = index["chunks"][digest]
+            pack_name, offset, length = location[:3]
+            codec = location[3] if len(location) > 3 else "xz"
+            packs[pack_name].append((offset, length, codec, digest))
+        for pack_name, chunks in sorted(packs.items()):
+            path = os.path.join(self.path, "packs", f"{pack_name}.gpg")
+            try:
+                with gpg_streams.decrypted_reader(path) as stream:
+                    position = 0
+                    for offset, length, codec, digest in sorted(chunks):
+                        while position < offset:
+                            skipped = stream.read(
+                                min(offset - position, SEGMENT_SIZE)
+                            )
+                            if not skipped:
+                                break
+                            position += len(skipped)
+                        data = stream.read(length)
+                        position += len(data)
+                        try:
+                            is_intact = (
+                                hashlib.sha256(
+                                    snapshot_codecs.decompress(data, codec)
+                                ).hexdigest()
+                                == digest
+                            )
+                        except snapshot_codecs.get_decompression_errors(codec):
+                            is_intact = False
+                        if not is_intact:
+                            problems.append(f"{pack_name}/{digest}: corrupt")
+            except (UtilityOperationError, OSError) as e:
+                problems.append(f"{pack_name}: unreadable: {e}")
+
+        report = "\n".join(
+            problems
+            + [
+                f"Verified {len(digests)} chunk(s) of snapshot {name} in"
+                f" {time.perf_counter() - start:.1f} s with"
+                f" {len(problems)} problem(s)."
+            ]
+        )
+        if problems:
+            raise UtilityOperationError(report)
+        return report
@@ -0,0 +1,289 @@
+"""Version history of a watchlist file as full copies and JSON deltas."""
+
+import base64
+import contextlib
+import difflib
+import hashlib
+import json
+import os
+import re
+import tempfile
+import time
+import zlib
+
+from core_utilities.errors import UtilityOperationError
+
+TIME_FORMAT = "%Y-%m-%dT%H:%M:%S"
+# A full copy starts each run of this many versions, which bounds the deltas
+# applied to rebuild one.
+FULL_INTERVAL = 32
+# JSON tokens, whitespace runs, and any other character, so that joining the
+# tokens gives back the exact text.
+TOKEN_PATTERN = re.compile(
+    r'"(?:\\.|[^"\\])*"|-?[0-9][0-9.eE+-]*|true|false|null|\s+|.', re.S
+)
+
+
+def _tokenize(text):
+    """Return the tokens of a JSON text."""
+    return TOKEN_PATTERN.findall(text)
+
+
+def _get_delta(old_tokens, new_tokens):
+    """Return the token replacements that turn the old tokens into new."""
+    return [
+        [first, last, new_tokens[new_first:new_last]]
+        for tag, first, last, new_first, new_last in difflib.SequenceMatcher(
+            None, old_tokens, new_tokens
+        ).get_opcodes()
+        if tag != "equal"
+    ]
+
+
+def _apply_delta(tokens, delta):
+    """Apply the token replacements to the tokens in place."""
+    for first, last, replacement in reversed(delta):
+        tokens[first:last] = replacement
+
+
+def _decode(data):
+    """Return the text of the bytes, keeping undecodable bytes."""
+    return data.decode("utf-8", errors="surrogateescape")
+
+
+def _encode(text):
+    """Return the bytes of a text from _decode."""
+    return text.encode("utf-8", errors="surrogateescape")
+
+
+def _compress(data):
+    """Return the bytes of a full copy as compressed Base64 text."""
+    return base64.b64encode(zlib.compress(data, 9)).decode("ascii")
+
+
+def _decompress(value):
+    """Return the bytes of a full copy from _compress."""
+    return zlib.decompress(base64.b64decode(value))
+
+
+def _write(path, text):
+    """Replace the file with the text through a temporary file."""
+    file_descriptor, temporary_path = tempfile.mkstemp(
+        prefix=f".{os.path.basename(path)}.",
+        suffix=".tmp",
+        dir=os.path.dirname(path) or ".",
+    )
+    try:
+        with os.fdopen(file_descriptor, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(temporary_path, path)
+    except BaseException:
+        os.remove(temporary_path)
+        raise
+
+
+class WatchlistHistory:
+    """Keep the versions of a file in a JSON Lines history.
+
+    Each line holds a version with its time and BLAKE2b digest, and either
+    the compressed full copy or the token replacements from the previous
+    version. Tokens follow JSON syntax, so the deltas of a reformatted or
+    minified watchlist stay small and versions are rebuilt byte for byte.
+    An index beside the history holds the digest of the latest version, so
+    an unchanged source is detected without reading the history.
+    """
+
+    def __init__(self, source, backup_directory=None, number_of_versions=500):
+        """Initialize the history of the source file."""
+        self.source = source
+        self.backup_directory = backup_directory or os.path.join(
+            os.path.dirname(source), "backups"
+        )
+        self.number_of_versions = number_of_versions
+        self.path = os.path.join(
+            self.backup_directory, f"{os.path.basename(source)}.history.jsonl"
+        )
+        self.index_path = f"{self.path}.index.json"
+
+    def _load(self):
+        """Return the records from the oldest to the latest.
+
+        A last line cut short by an interrupted write is ignored.
+        """
+        if not os.path.isfile(self.path):
+            return []
+        with open(self.path, encoding="utf-8") as f:
+            lines = [line for line in f if line.strip()]
+        records = [json.loads(line) for line in lines[:-1]]
+        if lines:
+            with contextlib.suppress(json.JSONDecodeError):
+                records.append(json.loads(lines[-1]))
+        return records
+
+    def _is_intact(self):
+        """Return whether the history is missing or ends with a full line."""
+        if not os.path.isfile(self.path) or not os.path.getsize(self.path):
+            return True
+        with open(self.path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read() == b"\n"
+
+    def _save(self, records):
+        """Replace the history with the records."""
+        _write(
+            self.path,
+            "".join(
+                json.dumps(record, separators=(",", ":")) + "\n"
+                for record in records
+            ),
+        )
+
+    def _load_index(self):
+        """Return the index, or None if it does not match the history.
+
+        The index records the size of the history it was written with, so
+        a history changed or cut short since then invalidates it.
+        """
+        try:
+            with open(self.index_path, encoding="utf-8") as f:
+                index = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        if not os.path.isfile(self.path) or os.path.getsize(
+            self.path
+        ) != index.get("size"):
+            return None
+        return index
+
+    def _save_index(self, record):
+        """Point the index at the latest record of the history."""
+        _write(
+            self.index_path,
+            json.dumps(
+                {
+                    "version": record["version"],
+                    "blake2b": record["blake2b"],
+                    "size": os.path.getsize(self.path),
+                }
+            ),
+        )
+
+    @staticmethod
+    def _rebuild(records, position):
+        """Return the tokens of the record at the position."""
+        start = position
+        while "full" not in records[start]:
+            start -= 1
+        tokens = _tokenize(_decode(_decompress(records[start]["full"])))
+        for index in range(start + 1, position + 1):
+            _apply_delta(tokens, records[index]["delta"])
+        return tokens
+
+    def _append(self, records, data, timestamp):
+        """Append the data as a version unless it matches the latest one.
+
+        Return the number of the version, or None if nothing was appended.
+        """
+        digest = hashlib.blake2b(data).hexdigest()
+        if records and records[-1]["blake2b"] == digest:
+            return None
+
+        version = records[-1]["version"] + 1 if records else 1
+        record = {"version": version, "time": timestamp, "blake2b": digest}
+        if version % FULL_INTERVAL == 1 or not records:
+            record["full"] = _compress(data)
+        else:
+            record["delta"] = _get_delta(
+                self._rebuild(records, len(records) - 1),
+                _tokenize(_decode(data)),
+            )
+        records.append(record)
+        return version
+
+    def record(self):
+        """Add the current source as a version and return its number.
+
+        Return None if the source matches the latest version.
+        """
+        with open(self.source, "rb") as f:
+            data = f.read()
+        index = self._load_index()
+        if (
+            index is not None
+            and index["blake2b"] == hashlib.blake2b(data).hexdigest()
+        ):
+            return None
+
+        records = self._load()
+        number_of_records = len(records)
+        version = self._append(records, data, time.strftime(TIME_FORMAT))
+        if version is None:
+            if records and index is None:
+                self._save_index(records[-1])
+            return None
+
+        os.makedirs(self.backup_directory, exist_ok=True)
+        number_to_delete = max(0, len(records) - self.number_of_versions)
+        if number_to_delete and "full" not in records[number_to_delete]:
+            tokens = self._rebuild(records, number_to_delete)
+            records[number_to_delete] = {
+                key: value
+                for key, value in records[number_to_delete].items()
+                if key != "delta"
+            } | {"full": _compress(_encode("".join(tokens)))}
+        if number_to_delete or not self._is_intact():
+            self._save(records[number_to_delete:])
+        else:
+            # One write of a line that _load ignores if it is cut short.
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(
+                    json.dumps(
+                        records[number_of_records], separators=(",", ":")
+                    )
+                    + "\n"
+                )
+        self._save_index(records[-1])
+        return version
+
+    def get(self, version):
+        """Return the bytes of a version."""
+        records = self._load()
+        for position, record in enumerate(records):
+            if record["version"] == version:
+                data = _encode("".join(self._rebuild(records, position)))
+                if hashlib.blake2b(data).hexdigest() != record["blake2b"]:
+                    raise UtilityOperationError(
+                        f"Version {version} of {self.source} is corrupt."
+                    )
+                return data
+        raise UtilityOperationError(
+            f"No version {version} of {self.source} in {self.path}"
+        )
+
+    def restore(self, version):
+        """Replace the source with a version after recording the source."""
+        data = self.get(version)
+        if os.path.isfile(self.source):
+            self.record()
+        file_descriptor, temporary_path = tempfile.mkstemp(
+            prefix=f".{os.path.basename(self.source)}.",
+            suffix=".tmp",
+            dir=os.path.dirname(self.source) or ".",
+        )
+        try:
+            with os.fdopen(file_descriptor, "wb") as f:
+                f.write(data)
+            os.replace(temporary_path, self.source)
+        except BaseException:
+            os.remove(temporary_path)
+            raise
+
+    def format_listing(self):
+        """Return a table of the versions from the latest."""
+        lines = [f"{'version':>7}  {'time':<19}  kind"]
+        for record in reversed(self._load()):
+            lines.append(
+                f"{record['version']:>7}  {record['time']:<19}"
+                f"  {'full' if 'full' in record else 'delta'}"
+            )
+        return "\n".join(lines)
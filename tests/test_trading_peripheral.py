@@ -1,13 +1,44 @@
 from configparser import ConfigParser
+from pathlib import Path
+import hashlib
+import json
+import os
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import threading
 from types import SimpleNamespace
 
+from app import action_programs as app_action_programs
+from app import action_simulator as app_action_simulator
+from app import browser_actions as app_browser_actions
+from app import browser_batches as app_browser_batches
+from app import browser_session as app_browser_session
+from app import browser_waits as app_browser_waits
+from app import checkpoints as app_checkpoints
 from app import cli as app_cli
 from app import config as app_config
+from app import firefox_profile as app_firefox_profile
+from app import gpg_streams as app_gpg_streams
+from app import http_replay as app_http_replay
+from app import latency_history as app_latency_history
 from app import maintenance as app_maintenance
 from app import monitoring as app_monitoring
 from app import order_status as app_order_status
+from app import profiling as app_profiling
+from app import session_cache as app_session_cache
+from app import snapshot_catalog as app_snapshot_catalog
+from app import snapshot_codecs as app_snapshot_codecs
+from app import snapshot_manifest as app_snapshot_manifest
+from app import snapshot_replication as app_snapshot_replication
+from app import snapshot_sources as app_snapshot_sources
+from app import snapshot_store as app_snapshot_store
+from app import watchlist_history as app_watchlist_history
 from core_utilities.config_common import ConfigError
 from core_utilities.errors import (
+    BrowserAutomationError,
     ConfigBuildError,
     ExternalServiceError,
     MarketDataError,
@@ -16,18 +47,54 @@ from core_utilities.errors import (
     UtilityOperationError,
 )
 import trading_peripheral
+from web_utilities import browser_driver
+
+ROOT = Path(__file__).resolve().parents[1]
+# Quick commands must not pay for pandas, lxml, requests, Google clients,
+# Selenium, or the prompt_toolkit of the config editors, which are imported
+# only for the actions that need them.
+HEAVY_MODULES = {
+    "charset_normalizer",
+    "googleapiclient",
+    "lxml",
+    "pandas",
+    "prompt_toolkit",
+    "requests",
+    "selenium",
+}
 
 
 class _FakeTrade:
     vendor = "SBI Securities"
     process = "HYPERSBI2"
     actions_section = "HYPERSBI2 Actions"
+    instruction_items = {
+        "all_keys": [
+            "get",
+            "sleep",
+            "click",
+            "wait_absent",
+            "exist",
+            "for",
+            "send_keys",
+            "text",
+            "refresh",
+            "await_present",
+            "await_absent",
+            "await_stable",
+            "submit",
+        ],
+        "control_flow_keys": {"exist", "for"},
+        "additional_value_keys": {"send_keys"},
+        "no_value_keys": {"refresh"},
+    }
 
 
 class _FakeDriver:
     def __init__(self):
         self.quit_calls = 0
         self.page_source = "<html></html>"
+        self.current_url = "https://site.example.com/home"
 
     def quit(self):
         self.quit_calls += 1
@@ -87,7 +154,9 @@ def test_get_arguments_rejects_snapshot_backup_and_restore(monkeypatch):
 
 
 def test_run_returns_after_launcher_generation(monkeypatch):
-    args = SimpleNamespace(P=("SBI Securities", "HYPERSBI2"), BS=True)
+    args = SimpleNamespace(
+        P=("SBI Securities", "HYPERSBI2"), BS=True, profile=None
+    )
     calls = []
 
     class FakeTrade:
@@ -120,24 +189,193 @@ def test_run_returns_after_launcher_generation(monkeypatch):
     assert calls[1][2] == trading_peripheral.__file__
 
 
+_IMPORT_ENTRY_POINT = """
+import json
+import sys
+
+import trading_peripheral
+
+sys.argv = ["trading_peripheral.py", sys.argv[1]]
+trading_peripheral.get_arguments()
+print(json.dumps(sorted({name.split(".")[0] for name in sys.modules})))
+"""
+
+
+def test_entry_point_imports_no_heavy_modules():
+    for argument in ("-w", "-C"):
+        result = subprocess.run(
+            [sys.executable, "-c", _IMPORT_ENTRY_POINT, argument],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+        )
+
+        assert result.returncode == 0, result.stderr
+        assert not HEAVY_MODULES & set(
+            json.loads(result.stdout.splitlines()[-1])
+        ), argument
+
+
+_RUN_QUICK_COMMAND = """
+import configparser
+import json
+import sys
+
+from app import config as app_config
+import trading_peripheral
+
+directory, argument = sys.argv[1:]
+config = configparser.ConfigParser(interpolation=None)
+config["HYPERSBI2"] = {
+    "watchlists": f"{directory}/portfolio.json",
+    "backup_directory": f"{directory}/backups",
+    "number_of_watchlist_versions": "500",
+}
+with open(config["HYPERSBI2"]["watchlists"], "w", encoding="utf-8") as f:
+    f.write("[1301]")
+app_config.configure = trading_peripheral.configure = (
+    lambda trade, **kwargs: config
+)
+app_config.check_config_changes = lambda *args, **kwargs: None
+sys.argv = ["trading_peripheral.py", argument]
+try:
+    trading_peripheral.run()
+except SystemExit:
+    pass
+print(json.dumps(sorted({name.split(".")[0] for name in sys.modules})))
+"""
+
+
+def test_quick_commands_run_without_heavy_modules(tmp_path):
+    for argument in ("-w", "-C", "-O"):
+        result = subprocess.run(
+            [
+                sys.executable,
+                "-c",
+                _RUN_QUICK_COMMAND,
+                tmp_path.as_posix(),
+                argument,
+            ],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+        )
+
+        assert result.returncode == 0, result.stderr
+        assert not HEAVY_MODULES & set(
+            json.loads(result.stdout.splitlines()[-1])
+        ), argument
+    assert (tmp_path / "backups" / "portfolio.json.history.jsonl").is_file()
+
+
+def test_profiling_spans_are_shared_null_contexts_when_disabled():
+    assert not app_profiling.is_enabled()
+    assert app_profiling.span("configure") is app_profiling.span("other")
+
+
+def test_profiling_writes_nested_spans_and_restores_hooks(tmp_path):
+    trace_path = tmp_path / "trace.json"
+    run = subprocess.run
+
+    app_profiling.enable(trace_path.as_posix(), is_profiling_tasks=True)
+    try:
+        with app_profiling.task("watchlist backup"):
+            with app_profiling.span("configure", "config", option="value"):
+                subprocess.run([sys.executable, "-c", "pass"], check=True)
+                subprocess.run(args=[sys.executable, "-c", "pass"], check=True)
+    finally:
+        app_profiling.disable()
+
+    events = json.loads(trace_path.read_text(encoding="utf-8"))["traceEvents"]
+    task = next(event for event in events if event["cat"] == "task")
+    span = next(event for event in events if event["cat"] == "config")
+    assert task["name"] == "watchlist backup"
+    assert span["args"] == {"option": "value"}
+    assert task["ts"] <= span["ts"]
+    assert span["ts"] + span["dur"] <= task["ts"] + task["dur"]
+    assert not [event for event in events if event["cat"] == "gpg"]
+    assert (tmp_path / "trace.watchlist_backup.prof").is_file()
+    assert subprocess.run is run
+    assert not app_profiling.is_enabled()
+
+
+def test_profiling_describes_subprocess_arguments_by_keyword():
+    assert app_profiling._describe_subprocess(
+        args=["gpg", "--decrypt", "pack.gpg"], check=True
+    ) == ("gpg", "gpg", {"arguments": "--decrypt pack.gpg"})
+    assert app_profiling._describe_subprocess("gpg") == (
+        "gpg",
+        "gpg",
+        {"arguments": ""},
+    )
+
+
+def test_profiling_hooks_libraries_when_they_are_imported(
+    monkeypatch, tmp_path
+):
+    (tmp_path / "profiled_library.py").write_text(
+        "def parse(source):\n    return source\n", encoding="utf-8"
+    )
+    monkeypatch.syspath_prepend(tmp_path.as_posix())
+    monkeypatch.setattr(
+        app_profiling,
+        "_LIBRARY_HOOKS",
+        {
+            "profiled_library": (
+                None,
+                "parse",
+                app_profiling._describe_parse,
+            )
+        },
+    )
+    trace_path = tmp_path / "trace.json"
+    meta_path = list(sys.meta_path)
+
+    app_profiling.enable(trace_path.as_posix())
+    try:
+        assert "profiled_library" not in sys.modules
+        import profiled_library
+
+        assert profiled_library.parse("<html></html>") == "<html></html>"
+    finally:
+        app_profiling.disable()
+        sys.modules.pop("profiled_library", None)
+
+    events = json.loads(trace_path.read_text(encoding="utf-8"))["traceEvents"]
+    assert [event["name"] for event in events if event["cat"] == "parse"] == [
+        "parse"
+    ]
+    assert not hasattr(profiled_library.parse, "__wrapped__")
+    assert sys.meta_path == meta_path
+
+
 def test_trade_action_command_completions_match_browser_dispatch():
     trade = trading_peripheral.Trade("SBI Securities", "HYPERSBI2")
 
     assert trade.instruction_items["all_keys"] == list(
-        trading_peripheral.browser_driver._COMMAND_DISPATCH
-    )
+        browser_driver._COMMAND_DISPATCH
+    ) + list(app_browser_waits.COMMANDS) + ["submit"]
 
 
-def test_run_browser_actions_retries_after_initialize_failure(monkeypatch):
+def test_run_browser_actions_retries_after_initialize_failure(
+    monkeypatch, tmp_path
+):
     args = SimpleNamespace(s=True, S=False, o=False)
     trade = _FakeTrade()
+    trade.config_directory = tmp_path.as_posix()
     config = ConfigParser(interpolation=None)
     config["General"] = {
         "firefox_profile_directory": "",
         "wait_timeout": "4",
+        "max_browser_sessions": "2",
+        "batch_browser_instructions": "True",
+        "lean_browser": "False",
+        "headless_browser": "False",
+        "session_cache_lifetime": "30",
+        "fingerprint": "",
     }
     config[trade.actions_section] = {
-        "replace_SBI Securities_watchlists": "[]",
+        "replace_SBI Securities_watchlists": "[('click', '//button')]",
     }
 
     init_calls = []
@@ -153,29 +391,1167 @@ def test_run_browser_actions_retries_after_initialize_failure(monkeypatch):
     sleep_calls = []
 
     monkeypatch.setattr(
-        trading_peripheral.browser_driver,
+        browser_driver,
         "initialize",
         fake_initialize,
     )
     monkeypatch.setattr(
-        trading_peripheral.browser_driver,
+        browser_driver,
         "execute_action",
         lambda current_driver, action, wait_timeout: actions.append(
             (current_driver, action, wait_timeout)
         ),
     )
     monkeypatch.setattr(
-        trading_peripheral.time,
+        app_browser_actions.random, "uniform", lambda low, high: high
+    )
+    monkeypatch.setattr(
+        app_browser_actions.time,
+        "sleep",
+        lambda seconds: sleep_calls.append(seconds),
+    )
+
+    trading_peripheral._run_browser_actions(args, trade, config)
+
+    assert len(init_calls) == 2
+    assert sleep_calls == [1]
+    assert actions == [(driver, [("click", "//button")], 4.0)]
+    assert driver.quit_calls == 1
+
+
+def test_run_actions_resumes_from_failed_instruction(monkeypatch):
+    driver = _FakeDriver()
+    driver.execute_script = lambda script: "complete"
+    executed = []
+    finished = []
+    sleep_calls = []
+
+    def execute_action(current_driver, action, wait_timeout):
+        if action == [("click", "//next")] and not sleep_calls:
+            raise RuntimeError("timed out")
+        executed.append(action[0])
+
+    monkeypatch.setattr(browser_driver, "execute_action", execute_action)
+    monkeypatch.setattr(
+        app_browser_actions.random, "uniform", lambda low, high: low
+    )
+    monkeypatch.setattr(
+        app_browser_actions.time,
         "sleep",
         lambda seconds: sleep_calls.append(seconds),
     )
 
-    trading_peripheral._run_browser_actions(args, trade, config)
+    app_browser_actions.run_actions(
+        lambda: driver,
+        [
+            ("watchlists", "[('click', '//portfolio')]", None),
+            (
+                "order status",
+                [("click", "//account"), ("click", "//next")],
+                finished.append,
+            ),
+        ],
+        wait_timeout=4.0,
+    )
+
+    assert executed == [
+        ("click", "//portfolio"),
+        ("click", "//account"),
+        ("click", "//next"),
+    ]
+    assert finished == [driver]
+    assert sleep_calls == [0.5]
+    assert driver.quit_calls == 1
+
+
+def test_run_actions_restarts_only_failed_action_in_new_session(monkeypatch):
+    drivers = []
+    executed = []
+
+    def initialize():
+        drivers.append(_FakeDriver())
+        return drivers[-1]
+
+    def execute_action(current_driver, action, wait_timeout):
+        if action == [("click", "//next")] and len(drivers) == 1:
+            raise RuntimeError("session deleted")
+        executed.append((drivers.index(current_driver), action[0]))
+
+    monkeypatch.setattr(browser_driver, "execute_action", execute_action)
+    monkeypatch.setattr(
+        app_browser_actions.time, "sleep", lambda seconds: None
+    )
+
+    app_browser_actions.run_actions(
+        initialize,
+        [
+            ("watchlists", [("click", "//portfolio")], None),
+            (
+                "order status",
+                [("click", "//account"), ("click", "//next")],
+                None,
+            ),
+        ],
+        wait_timeout=4.0,
+    )
+
+    assert executed == [
+        (0, ("click", "//portfolio")),
+        (0, ("click", "//account")),
+        (1, ("click", "//account")),
+        (1, ("click", "//next")),
+    ]
+    assert [driver.quit_calls for driver in drivers] == [1, 1]
+
+
+def test_run_actions_never_replays_a_submit(monkeypatch):
+    drivers = []
+    executed = []
+
+    def initialize():
+        drivers.append(_FakeDriver())
+        return drivers[-1]
+
+    def execute_action(current_driver, action, wait_timeout):
+        executed.append((drivers.index(current_driver), action[0]))
+        if action[0] == ("click", "//order") or (
+            action[0] == ("click", "//done") and len(drivers) == 1
+        ):
+            raise RuntimeError("timed out")
+
+    monkeypatch.setattr(browser_driver, "execute_action", execute_action)
+    monkeypatch.setattr(
+        app_browser_actions.time, "sleep", lambda seconds: None
+    )
+    monkeypatch.setattr(
+        app_browser_session, "is_responsive", lambda driver: False
+    )
+
+    for program, expected in (
+        (
+            [("click", "//confirm"), ("submit", "//order")],
+            [(0, ("click", "//confirm")), (0, ("click", "//order"))],
+        ),
+        (
+            [("submit", "//save"), ("click", "//done")],
+            [(0, ("click", "//save")), (0, ("click", "//done"))],
+        ),
+    ):
+        drivers.clear()
+        executed.clear()
+        try:
+            app_browser_actions.run_actions(
+                initialize, [("watchlists", program, None)], wait_timeout=4.0
+            )
+        except RuntimeError as e:
+            message = str(e)
+        else:
+            raise AssertionError("the submit was retried")
+
+        assert message == "timed out"
+        assert executed == expected
+        assert [driver.quit_calls for driver in drivers] == [1]
+
+
+def test_run_actions_records_latency_history(monkeypatch, tmp_path):
+    drivers = []
+
+    def initialize():
+        drivers.append(_FakeDriver())
+        return drivers[-1]
+
+    def execute_action(current_driver, action, wait_timeout):
+        if action == [("click", "//next")] and len(drivers) == 1:
+            raise RuntimeError("session deleted")
+
+    monkeypatch.setattr(browser_driver, "execute_action", execute_action)
+    monkeypatch.setattr(
+        app_browser_actions.time, "sleep", lambda seconds: None
+    )
+    path = tmp_path / "action_latency.sqlite3"
+    history = app_latency_history.LatencyHistory(str(path))
+
+    app_browser_actions.run_actions(
+        initialize,
+        [
+            (
+                "order status",
+                [("click", "//account"), ("click", "//next")],
+                None,
+            )
+        ],
+        wait_timeout=4.0,
+        history=history,
+    )
+
+    assert history.rows == []
+    lines = app_latency_history.format_report(str(path)).splitlines()
+    assert lines[0].split() == ["p50", "p95", "count", "fail", "step"]
+    assert [line.split()[2:] for line in lines[1:]] == [
+        ["1", "0", "order", "status[1]", "click", "//account"],
+        ["1", "1", "order", "status[2]", "click", "//next"],
+    ]
+    with sqlite3.connect(path) as connection:
+        assert connection.execute(
+            "SELECT step, outcome, attempt FROM steps ORDER BY rowid"
+        ).fetchall() == [
+            (1, "ok", 1),
+            (2, "error", 1),
+            (1, "ok", 2),
+            (2, "ok", 2),
+        ]
+    connection.close()
+
+
+def test_latency_report_keeps_only_recent_runs(monkeypatch, tmp_path):
+    path = str(tmp_path / "action_latency.sqlite3")
+    monkeypatch.setattr(app_latency_history, "MAXIMUM_NUMBER_OF_RUNS", 2)
+    assert app_latency_history.format_report(path) == (
+        "No browser action latency has been recorded."
+    )
+
+    for seconds in (9.0, 1.0, 3.0):
+        history = app_latency_history.LatencyHistory(path)
+        history.record("watchlists", 1, ("sleep", "1"), seconds, "ok")
+        history.flush()
+
+    line = app_latency_history.format_report(path).splitlines()[1]
+    assert line.split() == [
+        "1.000",
+        "3.000",
+        "2",
+        "0",
+        "watchlists[1]",
+        "sleep",
+        "1",
+    ]
+
+
+def test_latency_report_upgrades_history_without_attempts(tmp_path):
+    path = str(tmp_path / "action_latency.sqlite3")
+    with sqlite3.connect(path) as connection:
+        connection.execute(
+            "CREATE TABLE steps (run_id TEXT, started_at REAL, action TEXT,"
+            " step INTEGER, command TEXT, target TEXT, seconds REAL,"
+            " outcome TEXT)"
+        )
+        connection.executemany(
+            "INSERT INTO steps VALUES (?, 0, 'watchlists', 1, 'sleep', '1',"
+            " ?, ?)",
+            [("a", 2.0, "ok"), ("b", 5.0, "error")],
+        )
+    connection.close()
+
+    history = app_latency_history.LatencyHistory(path)
+    history.record("watchlists", 1, ("sleep", "1"), 1.0, "ok")
+    history.flush()
+
+    assert app_latency_history.format_report(path).splitlines()[1].split() == [
+        "1.000",
+        "2.000",
+        "2",
+        "1",
+        "watchlists[1]",
+        "sleep",
+        "1",
+    ]
+
+
+def test_run_actions_concurrently_shares_login_captured_by_first_session(
+    monkeypatch,
+):
+    cache = _FakeSessionCache(is_valid=False)
+    cache.load = lambda: None
+    events = []
+    is_order_status_started = threading.Event()
+
+    def initialize(index):
+        driver = _FakeDriver()
+        driver.index = index
+        return driver
+
+    def execute_action(current_driver, action, wait_timeout):
+        events.append((current_driver.index, action[0][0]))
+        if action[0][0] == "refresh":
+            # The order status session must run while the watchlist session
+            # is still busy after its login.
+            assert is_order_status_started.wait(5)
+        if current_driver.index == 1:
+            is_order_status_started.set()
+
+    def restore(driver, login_steps):
+        if not cache.saved:
+            return False
+        events.append((driver.index, "restore"))
+        return True
+
+    cache.restore = restore
+    monkeypatch.setattr(browser_driver, "execute_action", execute_action)
+
+    app_browser_actions.run_actions_concurrently(
+        initialize,
+        [
+            [("watchlists", _LOGIN_STEPS + [("refresh",)], None)],
+            [("order status", _LOGIN_STEPS + [("click", "//next")], None)],
+        ],
+        wait_timeout=4.0,
+        cache=cache,
+    )
+
+    first_session = [event for index, event in events if index == 0]
+    second_session = [event for index, event in events if index == 1]
+    assert first_session == [
+        "get",
+        "sleep",
+        "click",
+        "wait_absent",
+        "refresh",
+    ]
+    assert second_session == ["restore", "click"]
+    assert len(cache.saved) == 1
+
+
+def test_run_actions_batches_same_page_instructions(monkeypatch):
+    driver = _FakeDriver()
+    batches = []
+    completed_counts = iter([1, 2])
+    executed = []
+
+    def execute_script(script, steps):
+        batches.append(steps)
+        return [next(completed_counts), None]
+
+    driver.execute_script = execute_script
+    monkeypatch.setattr(
+        browser_driver,
+        "execute_action",
+        lambda current_driver, action, wait_timeout: executed.append(
+            action[0]
+        ),
+    )
+
+    app_browser_actions.run_actions(
+        lambda: driver,
+        [
+            (
+                "watchlists",
+                [
+                    ("get", "https://site.example.com/"),
+                    ("click", "//a"),
+                    ("click", "//b"),
+                    ("click", "//c"),
+                    ("send_keys", "//d", "1301"),
+                    ("wait_absent", "//e"),
+                ],
+                None,
+            )
+        ],
+        wait_timeout=4.0,
+        is_batching=True,
+    )
+
+    assert batches == [
+        [
+            ["click", "//a", ""],
+            ["click", "//b", ""],
+            ["click", "//c", ""],
+            ["send_keys", "//d", "1301"],
+        ],
+        [["click", "//c", ""], ["send_keys", "//d", "1301"]],
+    ]
+    assert executed == [
+        ("get", "https://site.example.com/"),
+        ("click", "//b"),
+        ("wait_absent", "//e"),
+    ]
+
+
+def test_run_actions_checkpoints_and_records_failed_batch(
+    monkeypatch, tmp_path
+):
+    driver = _FakeDriver()
+    batches = []
+    results = iter([[1, "TypeError: value is undefined"], [2, None]])
+    executed = []
+
+    def execute_script(script, *arguments):
+        if not arguments:
+            return "complete"
+        batches.append([step[1] for step in arguments[0]])
+        return next(results)
+
+    driver.execute_script = execute_script
+    monkeypatch.setattr(
+        browser_driver,
+        "execute_action",
+        lambda current_driver, action, wait_timeout: executed.append(
+            action[0]
+        ),
+    )
+    monkeypatch.setattr(
+        app_browser_actions.time, "sleep", lambda seconds: None
+    )
+    history = app_latency_history.LatencyHistory(
+        str(tmp_path / "latency.sqlite3")
+    )
+
+    app_browser_actions.run_actions(
+        lambda: driver,
+        [
+            (
+                "watchlists",
+                [
+                    ("click", "//a"),
+                    ("click", "//b"),
+                    ("click", "//c"),
+                    ("refresh",),
+                ],
+                None,
+            )
+        ],
+        wait_timeout=4.0,
+        history=history,
+        is_batching=True,
+    )
+
+    assert batches == [["//a", "//b", "//c"], ["//b", "//c"]]
+    assert executed == [("refresh",)]
+    with sqlite3.connect(history.path) as connection:
+        rows = connection.execute(
+            "SELECT step, command, target, outcome, attempt FROM steps"
+        ).fetchall()
+    connection.close()
+    assert rows == [
+        (1, "batch", "steps 1-3", "error", 1),
+        (2, "batch", "steps 2-3", "ok", 1),
+        (4, "refresh", "", "ok", 1),
+    ]
+
+
+def test_browser_batches_never_batch_special_keys(monkeypatch):
+    program = [
+        ("click", "//a"),
+        ("send_keys", "//b", "enter"),
+        ("click", "//c"),
+        ("send_keys", "//d", "element"),
+        ("send_keys", "//e", "1301"),
+        ("send_keys", "//f", "Enter"),
+        ("click", "//g"),
+        ("send_keys", "//h", "7203"),
+    ]
+
+    assert [
+        app_browser_batches.get_batch_length(program, index, len(program))
+        for index in range(len(program))
+    ] == [0, 0, 0, 0, 0, 0, 2, 0]
+    assert not app_browser_batches.is_batchable(("send_keys", "//b", "enter"))
+    assert app_browser_batches.is_batchable(("send_keys", "//b", "1301"))
+
+    driver = _FakeDriver()
+    executed = []
+    driver.execute_script = lambda script, steps: (_ for _ in ()).throw(
+        AssertionError(f"{steps} should not be batched")
+    )
+    monkeypatch.setattr(
+        browser_driver,
+        "execute_action",
+        lambda current_driver, action, wait_timeout: executed.append(
+            action[0]
+        ),
+    )
+
+    app_browser_actions.run_actions(
+        lambda: driver,
+        [("watchlists", program[:4], None)],
+        wait_timeout=4.0,
+        is_batching=True,
+    )
+
+    assert executed == program[:4]
+
+
+def _write_order_status_snapshots(directory, account_html):
+    pages = {
+        "login.html": '<button id="pk-btn">Log in</button>',
+        "home.html": '<a href="/account"><span>口座管理</span></a>',
+        "account.html": account_html,
+    }
+    for name, body in pages.items():
+        (directory / name).write_text(
+            f"<html><body>{body}</body></html>", encoding="utf-8"
+        )
+    (directory / "snapshots.json").write_text(
+        json.dumps(
+            {
+                "pages": {
+                    "https://login.sbisec.co.jp/login/entry": "login.html",
+                    "https://login.sbisec.co.jp/account": "account.html",
+                },
+                "transitions": {
+                    "login.html": {'//button[@id="pk-btn"]': "home.html"}
+                },
+            }
+        ),
+        encoding="utf-8",
+    )
+
+
+def test_simulator_runs_order_status_program_on_snapshots(
+    monkeypatch, tmp_path
+):
+    _write_order_status_snapshots(
+        tmp_path, '<p><a href="/orders">注文照会</a></p>'
+    )
+    trade, config = _build_order_status_trade_config(monkeypatch)
+    program = app_action_programs.compile_program(
+        "get_order_status",
+        config[trade.actions_section]["get_order_status"],
+        _FakeTrade.instruction_items,
+    )
+
+    report = app_action_simulator.simulate(
+        program, "get_order_status", str(tmp_path)
+    )
+
+    assert report.startswith(
+        "Simulated 6 instruction(s) of get_order_status in"
+    )
+    assert report.endswith("with 0 problem(s).")
+
+
+def test_simulator_reports_unmatched_and_ambiguous_xpaths(tmp_path):
+    _write_order_status_snapshots(
+        tmp_path,
+        '<p><a href="/orders">注文照会</a></p><p><a href="/x">注文照会</a></p>',
+    )
+    program = [
+        ("get", "https://login.sbisec.co.jp/login/entry"),
+        ("wait_absent", '//button[@id="pk-btn"]'),
+        ("click", '//button[@id="pk-btn"]'),
+        ("click", '//a[.//text()="口座管理"]'),
+        ("exist", '//div[@id="notice"]', [("click", "//missing")]),
+        ("click", '//p/a[text()="注文照会"]'),
+        ("send_keys", '//input[@name="password"]', "secret"),
+    ]
+
+    try:
+        app_action_simulator.simulate(program, "orders", str(tmp_path))
+    except BrowserAutomationError as e:
+        lines = str(e).splitlines()
+    else:
+        raise AssertionError("Expected BrowserAutomationError")
+
+    assert [line.split(": ", 1)[1] for line in lines[:-1]] == [
+        "XPath still matches on login.html and would time out",
+        "XPath is ambiguous with 2 matches on account.html;"
+        " the first one is used",
+        "XPath matches no element on account.html",
+    ]
+    assert lines[0].startswith("orders[2] ")
+    assert lines[-1].endswith("with 3 problem(s).")
+
+
+_LOGIN_STEPS = [
+    ("get", "https://login.example.com/entry"),
+    ("sleep", "0.8"),
+    ("click", '//button[@id="login"]'),
+    ("wait_absent", '//button[@id="login"]', "60"),
+]
+
+
+class _FakeSessionCache:
+    def __init__(self, is_valid):
+        self.is_valid = is_valid
+        self.restored = []
+        self.saved = []
+
+    def restore(self, driver, login_steps):
+        self.restored.append(login_steps)
+        if self.is_valid:
+            driver.current_url = "https://site.example.com/home"
+        return self.is_valid
+
+    def save(self, driver):
+        self.saved.append(driver)
+
+
+def test_run_actions_skips_login_with_valid_session_cache(monkeypatch):
+    driver = _FakeDriver()
+    driver.visited = []
+    driver.get = driver.visited.append
+    executed = []
+    cache = _FakeSessionCache(is_valid=True)
+
+    monkeypatch.setattr(
+        browser_driver,
+        "execute_action",
+        lambda current_driver, action, wait_timeout: executed.append(
+            action[0]
+        ),
+    )
+
+    app_browser_actions.run_actions(
+        lambda: driver,
+        [
+            ("watchlists", _LOGIN_STEPS + [("click", "//portfolio")], None),
+            ("order status", _LOGIN_STEPS + [("click", "//account")], None),
+        ],
+        wait_timeout=4.0,
+        cache=cache,
+    )
+
+    assert executed == [("click", "//portfolio"), ("click", "//account")]
+    assert cache.restored == [_LOGIN_STEPS]
+    assert cache.saved == []
+    assert driver.visited == ["https://site.example.com/home"]
+
+
+def test_run_actions_saves_session_after_full_login(monkeypatch):
+    driver = _FakeDriver()
+    executed = []
+    cache = _FakeSessionCache(is_valid=False)
+
+    cache.save = lambda current_driver: cache.saved.append(
+        (current_driver, len(executed))
+    )
+
+    monkeypatch.setattr(
+        browser_driver,
+        "execute_action",
+        lambda current_driver, action, wait_timeout: executed.append(
+            action[0]
+        ),
+    )
+
+    app_browser_actions.run_actions(
+        lambda: driver,
+        [("order status", _LOGIN_STEPS + [("click", "//account")], None)],
+        wait_timeout=4.0,
+        cache=cache,
+    )
+
+    assert executed == _LOGIN_STEPS + [("click", "//account")]
+    assert cache.saved == [(driver, len(_LOGIN_STEPS))]
+
+
+def test_session_cache_rejects_stale_or_expired_state(monkeypatch, tmp_path):
+    path = tmp_path / "session.json.gpg"
+    path.write_bytes(b"encrypted")
+    now = 1_700_000_000
+    states = {
+        "fresh": {"saved_at": now - 60, "cookies": [{"expiry": now + 60}]},
+        "stale": {"saved_at": now - 3600, "cookies": []},
+        "expired": {"saved_at": now - 60, "cookies": [{"expiry": now - 1}]},
+    }
+    current = {}
+
+    monkeypatch.setattr(app_session_cache.time, "time", lambda: now)
+    monkeypatch.setattr(
+        app_session_cache.file_utilities,
+        "read_encrypted_file",
+        lambda current_path: json.dumps(states[current["state"]]).encode(),
+    )
+    cache = app_session_cache.SessionCache(path.as_posix(), lifetime=30)
+
+    for state, is_loaded in (
+        ("fresh", True),
+        ("stale", False),
+        ("expired", False),
+    ):
+        current["state"] = state
+        assert (cache.load() is not None) is is_loaded, state
+    assert app_session_cache.get_login_length(_LOGIN_STEPS) == 4
+    assert app_session_cache.get_login_length([("click", "//a")]) == 0
+
+
+def test_session_cache_restores_cookies_per_domain(monkeypatch, tmp_path):
+    path = tmp_path / "session.json.gpg"
+    path.write_bytes(b"encrypted")
+    state = {
+        "saved_at": 1_700_000_000,
+        "landing_url": "https://site.example.com/home",
+        "cookies": [
+            {"name": "shared", "value": "1", "domain": ".example.com"},
+            {"name": "login", "value": "2", "domain": "login.example.net"},
+        ],
+        "local_storage": [["key", "value"]],
+        "session_storage": [],
+    }
+    calls = []
+
+    class Driver:
+        current_url = ""
+
+        def get(self, url):
+            calls.append(("get", url))
+            self.current_url = url
+
+        def add_cookie(self, cookie):
+            calls.append(("add_cookie", cookie["name"]))
+
+        def execute_script(self, script, *args):
+            calls.append(("execute_script", args))
+
+        def find_elements(self, by, xpath):
+            return []
+
+    monkeypatch.setattr(app_session_cache.time, "time", lambda: 1_700_000_060)
+    monkeypatch.setattr(
+        app_session_cache.file_utilities,
+        "read_encrypted_file",
+        lambda current_path: json.dumps(state).encode(),
+    )
+
+    assert app_session_cache.SessionCache(path.as_posix()).restore(
+        Driver(), _LOGIN_STEPS
+    )
+    assert calls == [
+        ("get", "https://site.example.com/robots.txt"),
+        ("add_cookie", "shared"),
+        ("get", "https://login.example.net/robots.txt"),
+        ("add_cookie", "login"),
+        ("get", "https://site.example.com/robots.txt"),
+        ("execute_script", ([["key", "value"]], [])),
+        ("get", "https://site.example.com/home"),
+    ]
+
+
+class _FakeReplayResponse:
+    def __init__(self, text, url, status_code=200):
+        self.content = text.encode()
+        self.text = text
+        self.url = url
+        self.status_code = status_code
+        self.encoding = None
+
+
+class _FakeReplaySession:
+    def __init__(self, response):
+        self.response = response
+        self.cookies = SimpleNamespace(
+            clear=lambda: None,
+            set=lambda name, value, **kwargs: None,
+        )
+
+    def get(self, url, timeout):
+        return self.response
+
+
+def test_http_replay_returns_page_or_none_when_session_rejected(monkeypatch):
+    state = {
+        "order_status_url": "https://site.example.com/orders",
+        "cookies": [{"name": "session", "value": "1"}],
+    }
+    table = (
+        "<html><body><table><tr><td>注文種別</td></tr></table></body></html>"
+    )
+    login = '<html><body><button id="login"></button></body></html>'
+
+    for response, expected in (
+        (
+            _FakeReplayResponse(table, "https://site.example.com/orders"),
+            table,
+        ),
+        (_FakeReplayResponse(login, "https://site.example.com/orders"), None),
+        (_FakeReplayResponse(table, "https://login.example.com/entry"), None),
+        (
+            _FakeReplayResponse(
+                table, "https://site.example.com/orders", status_code=403
+            ),
+            None,
+        ),
+    ):
+        monkeypatch.setattr(
+            app_http_replay,
+            "_get_session",
+            lambda: _FakeReplaySession(response),
+        )
+
+        assert (
+            app_http_replay.fetch_page(
+                state,
+                "order_status_url",
+                '//button[@id="login"]',
+                required_text="注文種別",
+            )
+            == expected
+        )
+    assert (
+        app_http_replay.fetch_page({}, "order_status_url", "//button") is None
+    )
+
+
+def test_run_browser_actions_skips_browser_when_order_status_replays(
+    monkeypatch, tmp_path
+):
+    args = SimpleNamespace(s=False, S=False, o=True)
+    trade = _FakeTrade()
+    trade.config_directory = tmp_path.as_posix()
+    trade.order_status_section = "SBI Securities Order Status"
+    config = ConfigParser(interpolation=None)
+    config["General"] = {
+        "wait_timeout": "4",
+        "session_cache_lifetime": "30",
+        "fetch_order_status_over_http": "True",
+        "fingerprint": "",
+    }
+    config[trade.actions_section] = {"get_order_status": str(_LOGIN_STEPS)}
+    config[trade.order_status_section] = {"table_identifier": "注文種別"}
+    extracted = []
+
+    monkeypatch.setattr(
+        app_http_replay,
+        "fetch_page",
+        lambda state, url_key, login_marker, required_text: (
+            f"{url_key} {login_marker} {required_text}"
+        ),
+    )
+    monkeypatch.setattr(
+        app_order_status,
+        "BROKERAGE_ORDER_STATUS_FUNCTIONS",
+        {
+            "SBI Securities": lambda trade, config, page_source: (
+                extracted.append(page_source)
+            )
+        },
+    )
+    monkeypatch.setattr(
+        app_browser_actions,
+        "run_actions",
+        lambda *args, **kwargs: (_ for _ in ()).throw(
+            AssertionError("browser should not start")
+        ),
+    )
+
+    trading_peripheral._run_browser_actions(args, trade, config)
+
+    assert extracted == ['order_status_url //button[@id="login"] 注文種別']
+
+
+def test_compile_program_reports_every_invalid_instruction():
+    try:
+        app_action_programs.compile_program(
+            "watchlists",
+            "[('click', '//a['), ('sleep', 'soon'), ('refresh', 'now'),"
+            " ('exist', '//div', [('clik', '//b')]), ('wait_absent', '//c')]",
+            _FakeTrade.instruction_items,
+        )
+    except ConfigBuildError as e:
+        message = str(e)
+    else:
+        raise AssertionError("Expected ConfigBuildError")
+
+    assert message.splitlines()[1:] == [
+        "watchlists[1] ('click', '//a['): invalid XPath '//a[':"
+        " Invalid expression",
+        "watchlists[2] ('sleep', 'soon'): 'sleep' duration 'soon'"
+        " is not a number",
+        "watchlists[3] ('refresh', 'now'): 'refresh' takes 0 argument(s),"
+        " got 1",
+        "watchlists[4][1] ('clik', '//b'): unknown command 'clik'",
+    ]
+
+
+def test_default_action_programs_compile(monkeypatch):
+    trade, config = _build_order_status_trade_config(monkeypatch)
+    section = config[trade.actions_section]
+
+    for option in section:
+        program = app_action_programs.compile_program(
+            option, section[option], _FakeTrade.instruction_items
+        )
+
+        assert app_session_cache.get_login_length(program) == 4
+
+
+def test_load_programs_reuses_cache_until_section_changes(
+    monkeypatch, tmp_path
+):
+    cache_path = tmp_path / "action_programs.json"
+    config = ConfigParser(interpolation=None)
+    config["Actions"] = {
+        "get_order_status": str(
+            _LOGIN_STEPS + [("exist", "//a", [("click", "//a")])]
+        )
+    }
+    compiled = []
+    compile_program = app_action_programs.compile_program
+
+    monkeypatch.setattr(
+        app_action_programs,
+        "compile_program",
+        lambda *args: compiled.append(args[0]) or compile_program(*args),
+    )
+
+    for _ in range(2):
+        programs = app_action_programs.load_programs(
+            config["Actions"],
+            _FakeTrade.instruction_items,
+            cache_path.as_posix(),
+        )
+    config["Actions"]["get_order_status"] = "[('refresh',)]"
+    changed = app_action_programs.load_programs(
+        config["Actions"], _FakeTrade.instruction_items, cache_path.as_posix()
+    )
+
+    assert compiled == ["get_order_status", "get_order_status"]
+    assert programs["get_order_status"] == _LOGIN_STEPS + [
+        ("exist", "//a", [("click", "//a")])
+    ]
+    assert changed == {"get_order_status": [("refresh",)]}
+
+
+class _FakeAsyncScriptDriver:
+    current_url = "https://site.example.com/home"
+
+    def __init__(self, errors):
+        self.errors = list(errors)
+        self.scripts = []
+        self.script_timeouts = []
+
+    def set_script_timeout(self, timeout):
+        self.script_timeouts.append(timeout)
+
+    def execute_async_script(self, script, *args):
+        self.scripts.append(args)
+        if self.errors:
+            raise self.errors.pop(0)
+
+
+def test_await_absent_observes_document_after_navigation():
+    driver = _FakeAsyncScriptDriver(
+        [
+            app_browser_waits.WebDriverException(
+                "Document was unloaded during execution"
+            )
+        ]
+    )
+
+    app_browser_waits.await_absent(
+        driver, ("await_absent", "//button", "60"), 4.0
+    )
+
+    assert driver.scripts == [("//button", False), ("//button", False)]
+    assert 0 < driver.script_timeouts[-1] <= 60
+
+
+def test_await_present_raises_browser_error_on_timeout():
+    driver = _FakeAsyncScriptDriver(
+        [app_browser_waits.TimeoutException("script timeout")]
+    )
+
+    try:
+        app_browser_waits.await_present(
+            driver, ("await_present", "//button"), 0.5
+        )
+    except BrowserAutomationError as e:
+        message = str(e)
+    else:
+        raise AssertionError("Expected BrowserAutomationError")
+
+    assert message == (
+        "Timed out after 0.5s waiting for XPath '//button' to be present at"
+        " url='https://site.example.com/home'"
+    )
+
+
+def test_run_actions_runs_event_driven_waits_in_page(monkeypatch):
+    driver = _FakeAsyncScriptDriver([])
+    driver.quit = lambda: None
+    executed = []
+
+    monkeypatch.setattr(
+        browser_driver,
+        "execute_action",
+        lambda current_driver, action, wait_timeout: executed.append(
+            action[0]
+        ),
+    )
+
+    app_browser_actions.run_actions(
+        lambda: driver,
+        [
+            (
+                "watchlists",
+                [
+                    ("await_stable", "0.2"),
+                    ("click", "//a"),
+                    ("await_present", "//b"),
+                ],
+                None,
+            )
+        ],
+        wait_timeout=4.0,
+    )
+
+    assert executed == [("click", "//a")]
+    assert driver.scripts == [(200.0,), ("//b", True)]
+
+
+def test_browser_session_attaches_to_responsive_warm_session(
+    monkeypatch, tmp_path
+):
+    state_path = tmp_path / "browser_session.json"
+    state_path.write_text(
+        json.dumps(
+            {
+                "command_executor": "http://127.0.0.1:4444",
+                "session_id": "session",
+            }
+        ),
+        encoding="utf-8",
+    )
+    attached = _FakeDriver()
+    attached.execute_script = lambda script: "complete"
+
+    monkeypatch.setattr(
+        app_browser_session,
+        "_AttachedDriver",
+        lambda command_executor, session_id: attached,
+    )
+    monkeypatch.setattr(
+        app_browser_session,
+        "initialize",
+        lambda config: (_ for _ in ()).throw(
+            AssertionError("cold start should be skipped")
+        ),
+    )
+
+    assert app_browser_session.start({}, state_path.as_posix()) is attached
+
+
+def test_lean_browser_options_block_resources_and_third_party_hosts():
+    config = ConfigParser(interpolation=None)
+    config["General"] = {
+        "lean_browser": "True",
+        "lean_browser_allowed_domains": "sbisec.co.jp",
+        "headless_browser": "True",
+    }
+
+    options = app_browser_session.get_lean_options(
+        config["General"], "C:/profile"
+    )
+
+    assert options.arguments == ["-profile", "C:/profile", "-headless"]
+    assert options.page_load_strategy == "eager"
+    preferences = options.preferences
+    assert preferences["permissions.default.image"] == 2
+    assert preferences["gfx.downloadable_fonts.enabled"] is False
+    assert preferences["network.proxy.type"] == 2
+    assert "%22sbisec.co.jp%22" in (
+        preferences["network.proxy.autoconfig_url"]
+    )
+
+
+def test_browser_session_uses_default_driver_without_lean_mode(monkeypatch):
+    config = ConfigParser(interpolation=None)
+    config["General"] = {
+        "firefox_profile_directory": "C:/profile",
+        "lean_browser": "False",
+        "headless_browser": "False",
+    }
+    driver = _FakeDriver()
+    monkeypatch.setattr(
+        browser_driver,
+        "initialize",
+        lambda firefox_profile_directory: (
+            driver if firefox_profile_directory == "C:/profile" else None
+        ),
+    )
+
+    assert app_browser_session.initialize(config) is driver
+
+
+def test_slim_firefox_profile_copies_only_changed_files(tmp_path):
+    source = tmp_path / "main"
+    source.mkdir()
+    (source / "prefs.js").write_text('user_pref("a", 1);', encoding="utf-8")
+    (source / "places.sqlite").write_bytes(b"history")
+    with sqlite3.connect(source / "cookies.sqlite") as connection:
+        connection.execute("CREATE TABLE moz_cookies (name TEXT)")
+        connection.execute("INSERT INTO moz_cookies VALUES ('session')")
+    connection.close()
+    profile = tmp_path / "slim"
+
+    assert app_firefox_profile.update(str(source), str(profile)) == str(
+        profile
+    )
+    assert sorted(path.name for path in profile.iterdir()) == [
+        "cookies.sqlite",
+        "prefs.js",
+        "slim_profile.json",
+    ]
+    with sqlite3.connect(profile / "cookies.sqlite") as connection:
+        assert connection.execute(
+            "SELECT name FROM moz_cookies"
+        ).fetchall() == [("session",)]
+    connection.close()
+
+    (profile / "prefs.js").write_text("changed by Firefox", encoding="utf-8")
+    app_firefox_profile.update(str(source), str(profile))
+    assert (profile / "prefs.js").read_text(encoding="utf-8") == (
+        "changed by Firefox"
+    )
+
+    (source / "prefs.js").write_text('user_pref("a", 22);', encoding="utf-8")
+    (source / "cookies.sqlite").unlink()
+    app_firefox_profile.update(str(source), str(profile))
+    assert (profile / "prefs.js").read_text(encoding="utf-8") == (
+        'user_pref("a", 22);'
+    )
+    assert not (profile / "cookies.sqlite").exists()
+
+
+def test_browser_session_cold_starts_when_warm_session_is_dead(
+    monkeypatch, tmp_path
+):
+    state_path = tmp_path / "browser_session.json"
+    state_path.write_text(
+        json.dumps(
+            {
+                "command_executor": "http://127.0.0.1:4444",
+                "session_id": "session",
+            }
+        ),
+        encoding="utf-8",
+    )
+    attached = _FakeDriver()
+    cold = _FakeDriver()
+
+    monkeypatch.setattr(
+        app_browser_session,
+        "_AttachedDriver",
+        lambda command_executor, session_id: attached,
+    )
+    monkeypatch.setattr(
+        app_browser_session,
+        "initialize",
+        lambda config, slim_profile_directory: cold,
+    )
+
+    assert app_browser_session.start({}, state_path.as_posix()) is cold
+    assert attached.quit_calls == 1
+    assert (
+        app_browser_session.start({}, (tmp_path / "missing").as_posix())
+        is cold
+    )
+
+
+def test_attached_driver_quit_keeps_warm_session_running(monkeypatch):
+    driver = app_browser_session._AttachedDriver(
+        "http://127.0.0.1:4444", "session"
+    )
+    monkeypatch.setattr(
+        driver,
+        "execute",
+        lambda *args, **kwargs: (_ for _ in ()).throw(
+            AssertionError("quit should not end the shared session")
+        ),
+    )
+
+    driver.quit()
 
-    assert len(init_calls) == 2
-    assert sleep_calls == [10]
-    assert actions == [(driver, "[]", 4.0)]
-    assert driver.quit_calls == 1
+    assert driver.session_id == "session"
 
 
 def test_configure_skips_watchlist_discovery_when_directory_missing(
@@ -348,6 +1724,899 @@ def test_configure_matches_all_service_label_with_descendant_text(
     assert len(matches) == 1
 
 
+_FAKE_GPG = """
+import shutil
+import sys
+
+arguments = sys.argv[1:]
+if "--encrypt" in arguments:
+    if "missing" in arguments:
+        sys.stderr.write("no public key")
+        sys.exit(2)
+    with open(arguments[arguments.index("--output") + 1], "wb") as f:
+        shutil.copyfileobj(sys.stdin.buffer, f)
+else:
+    with open(arguments[-1], "rb") as f:
+        shutil.copyfileobj(f, sys.stdout.buffer)
+"""
+
+
+def _get_fake_gpg_arguments(tmp_path):
+    script = tmp_path / "fake_gpg.py"
+    script.write_text(_FAKE_GPG, encoding="utf-8")
+    return (sys.executable, str(script))
+
+
+def test_gpg_streams_archive_round_trip_replaces_root(monkeypatch, tmp_path):
+    monkeypatch.setattr(
+        app_gpg_streams, "GPG_ARGUMENTS", _get_fake_gpg_arguments(tmp_path)
+    )
+    source = tmp_path / "data" / "HYPERSBI2"
+    (source / "layout").mkdir(parents=True)
+    (source / "layout" / "chart.json").write_text("new", encoding="utf-8")
+    snapshots = tmp_path / "snapshots"
+    snapshots.mkdir()
+    output = tmp_path / "restore"
+    (output / "HYPERSBI2").mkdir(parents=True)
+    (output / "HYPERSBI2" / "stale.json").write_text("old", encoding="utf-8")
+
+    app_gpg_streams.archive_encrypt_directory(str(source), str(snapshots))
+    app_gpg_streams.decrypt_extract_file(
+        str(snapshots / "HYPERSBI2.tar.xz.gpg"), str(output)
+    )
+
+    assert [path.name for path in snapshots.iterdir()] == [
+        "HYPERSBI2.tar.xz.gpg"
+    ]
+    assert sorted(path.name for path in output.iterdir()) == ["HYPERSBI2"]
+    assert (output / "HYPERSBI2" / "layout" / "chart.json").read_text(
+        encoding="utf-8"
+    ) == "new"
+    assert not (output / "HYPERSBI2" / "stale.json").exists()
+
+
+def _build_restore_fixture(monkeypatch, tmp_path):
+    monkeypatch.setattr(
+        app_gpg_streams, "GPG_ARGUMENTS", _get_fake_gpg_arguments(tmp_path)
+    )
+    source = tmp_path / "data" / "HYPERSBI2"
+    (source / "layout").mkdir(parents=True)
+    (source / "layout" / "chart.json").write_text("chart", encoding="utf-8")
+    (source / "portfolio.json").write_text("[1301, 7203]", encoding="utf-8")
+    (source / "added").mkdir()
+    (source / "added" / "news.json").write_text("[]", encoding="utf-8")
+    snapshots = tmp_path / "snapshots"
+    snapshots.mkdir()
+    app_gpg_streams.archive_encrypt_directory(str(source), str(snapshots))
+    output = tmp_path / "restore"
+    shutil.copytree(source, output / "HYPERSBI2")
+    shutil.rmtree(output / "HYPERSBI2" / "added")
+    (output / "HYPERSBI2" / "portfolio.json").write_text(
+        "[1301]", encoding="utf-8"
+    )
+    (output / "HYPERSBI2" / "stale").mkdir()
+    (output / "HYPERSBI2" / "stale" / "old.json").write_text(
+        "old", encoding="utf-8"
+    )
+    return snapshots / "HYPERSBI2.tar.xz.gpg", output / "HYPERSBI2"
+
+
+def test_gpg_streams_restore_rewrites_only_changed_files(
+    monkeypatch, tmp_path
+):
+    archive, root = _build_restore_fixture(monkeypatch, tmp_path)
+    chart_inode = (root / "layout" / "chart.json").stat().st_ino
+    extracted = []
+    extract = app_gpg_streams.tarfile.TarFile.extract
+
+    def record_extract(tar, member, *args, **kwargs):
+        extracted.append(member.name)
+        return extract(tar, member, *args, **kwargs)
+
+    monkeypatch.setattr(
+        app_gpg_streams.tarfile.TarFile, "extract", record_extract
+    )
+
+    app_gpg_streams.decrypt_extract_file(str(archive), str(root.parent))
+
+    assert "HYPERSBI2/layout/chart.json" not in extracted
+    assert "HYPERSBI2/portfolio.json" in extracted
+    assert (root / "layout" / "chart.json").stat().st_ino == chart_inode
+    assert (root / "portfolio.json").read_text(encoding="utf-8") == (
+        "[1301, 7203]"
+    )
+    assert (root / "added" / "news.json").read_text(encoding="utf-8") == "[]"
+    assert not (root / "stale").exists()
+    assert sorted(path.name for path in root.parent.iterdir()) == ["HYPERSBI2"]
+
+
+def test_gpg_streams_restore_rolls_back_on_move_failure(monkeypatch, tmp_path):
+    archive, root = _build_restore_fixture(monkeypatch, tmp_path)
+    replace = os.replace
+
+    def fail_news_move(source, destination):
+        if str(destination).endswith("news.json"):
+            raise OSError("move failed")
+        replace(source, destination)
+
+    monkeypatch.setattr(app_snapshot_manifest.os, "replace", fail_news_move)
+
+    try:
+        app_gpg_streams.decrypt_extract_file(str(archive), str(root.parent))
+    except OSError as e:
+        message = str(e)
+    else:
+        raise AssertionError("Expected OSError")
+
+    assert message == "move failed"
+    assert (root / "portfolio.json").read_text(encoding="utf-8") == "[1301]"
+    assert (root / "stale" / "old.json").read_text(encoding="utf-8") == "old"
+    assert not (root / "added").exists()
+    assert sorted(path.name for path in root.parent.iterdir()) == ["HYPERSBI2"]
+
+
+def test_gpg_streams_hash_while_archiving_and_roll_back_times(
+    monkeypatch, tmp_path
+):
+    def fail_hash_file(path):
+        raise AssertionError(f"{path} was read before archiving")
+
+    monkeypatch.setattr(app_snapshot_manifest, "_hash_file", fail_hash_file)
+    archive, root = _build_restore_fixture(monkeypatch, tmp_path)
+
+    assert app_gpg_streams.verify_archive(str(archive)).startswith(
+        "Verified 3 file(s)"
+    )
+
+    utime = os.utime
+    failures = []
+
+    def fail_news_time(path, *args, **kwargs):
+        if str(path) == str(root / "added" / "news.json") and not failures:
+            failures.append(path)
+            raise OSError("utime failed")
+        utime(path, *args, **kwargs)
+
+    monkeypatch.setattr(app_snapshot_manifest.os, "utime", fail_news_time)
+    try:
+        app_gpg_streams.decrypt_extract_file(str(archive), str(root.parent))
+    except OSError as e:
+        message = str(e)
+    else:
+        raise AssertionError("Expected OSError")
+
+    assert message == "utime failed"
+    assert (root / "portfolio.json").read_text(encoding="utf-8") == "[1301]"
+    assert (root / "stale" / "old.json").read_text(encoding="utf-8") == "old"
+    assert not (root / "added").exists()
+    assert sorted(path.name for path in root.parent.iterdir()) == ["HYPERSBI2"]
+
+
+def test_gpg_streams_verify_archive_reports_corrupt_and_missing_files(
+    monkeypatch, tmp_path
+):
+    archive, root = _build_restore_fixture(monkeypatch, tmp_path)
+    live_root = root.parent.parent / "data" / "HYPERSBI2"
+
+    assert app_gpg_streams.verify_archive(str(archive)).startswith(
+        "Verified 3 file(s)"
+    )
+
+    build = app_snapshot_manifest.build
+
+    def build_tampered(source, source_filter=None):
+        manifest = build(source, source_filter)
+        manifest["files"]["HYPERSBI2/portfolio.json"]["size"] = 0
+        manifest["files"]["HYPERSBI2/deleted.json"] = {
+            "size": 0,
+            "mtime_ns": 0,
+        }
+        return manifest
+
+    monkeypatch.setattr(app_snapshot_manifest, "build", build_tampered)
+    app_gpg_streams.archive_encrypt_directory(
+        str(live_root), str(archive.parent)
+    )
+    try:
+        app_gpg_streams.verify_archive(str(archive))
+    except UtilityOperationError as e:
+        lines = str(e).splitlines()
+    else:
+        raise AssertionError("Expected UtilityOperationError")
+
+    assert lines[:2] == [
+        "HYPERSBI2/portfolio.json: corrupt",
+        "HYPERSBI2/deleted.json: missing",
+    ]
+    archive.write_bytes(archive.read_bytes()[:-64])
+    try:
+        app_gpg_streams.verify_archive(str(archive))
+    except UtilityOperationError as e:
+        message = str(e)
+    else:
+        raise AssertionError("Expected UtilityOperationError")
+
+    assert "unreadable" in message
+    assert (root / "portfolio.json").read_text(encoding="utf-8") == "[1301]"
+
+
+def test_snapshot_sources_filter_archive_restore_and_report(
+    monkeypatch, tmp_path
+):
+    monkeypatch.setattr(
+        app_gpg_streams, "GPG_ARGUMENTS", _get_fake_gpg_arguments(tmp_path)
+    )
+    source = tmp_path / "data" / "HYPERSBI2"
+    (source / "cache" / "chart").mkdir(parents=True)
+    (source / "cache" / "chart" / "1301.bin").write_bytes(b"0" * 4096)
+    (source / "layout").mkdir()
+    (source / "layout" / "chart.json").write_text("chart", encoding="utf-8")
+    (source / "layout" / "debug.log").write_text("log", encoding="utf-8")
+    source_filter = app_snapshot_sources.SourceFilter(
+        exclude_patterns=["cache", "*.log"]
+    )
+    snapshots = tmp_path / "snapshots"
+    snapshots.mkdir()
+
+    archive = app_gpg_streams.archive_encrypt_directory(
+        str(source), str(snapshots), source_filter=source_filter
+    )
+    (source / "layout" / "chart.json").write_text("edited", encoding="utf-8")
+    app_gpg_streams.decrypt_extract_file(archive, str(source.parent))
+
+    assert app_gpg_streams.verify_archive(archive).startswith(
+        "Verified 1 file(s)"
+    )
+    assert (source / "layout" / "chart.json").read_text(
+        encoding="utf-8"
+    ) == "chart"
+    assert (source / "cache" / "chart" / "1301.bin").exists()
+    assert (source / "layout" / "debug.log").exists()
+
+    totals = app_snapshot_sources.scan(str(source), source_filter, 2)
+
+    assert totals[""] == [5, 4099]
+    assert totals["cache/chart"] == [0, 4096]
+    assert app_snapshot_sources.format_report(totals).splitlines()[1] == (
+        "      0.0       0.0  ."
+    )
+
+
+def test_gpg_streams_keeps_previous_file_on_encryption_failure(
+    monkeypatch, tmp_path
+):
+    monkeypatch.setattr(
+        app_gpg_streams, "GPG_ARGUMENTS", _get_fake_gpg_arguments(tmp_path)
+    )
+    target = tmp_path / "index.json.gpg"
+    target.write_bytes(b"previous")
+
+    try:
+        app_gpg_streams.write_encrypted(str(target), b"plain", "missing")
+    except UtilityOperationError as e:
+        message = str(e)
+    else:
+        raise AssertionError("Expected UtilityOperationError")
+
+    assert message == "GPG encryption failed: no public key"
+    assert target.read_bytes() == b"previous"
+    assert not list(tmp_path.glob(".index.json.gpg.*.tmp"))
+
+
+def test_snapshot_store_finds_boundaries_across_hash_segments(monkeypatch):
+    data = random.Random(0).randbytes(200_000)
+    gear = [int(value) for value in app_snapshot_store.GEAR]
+    window_size = app_snapshot_store.WINDOW_SIZE
+    expected = []
+    window_hash = 0
+    for position, value in enumerate(data):
+        window_hash += gear[value]
+        if position >= window_size:
+            window_hash -= gear[data[position - window_size]]
+        if (
+            position >= window_size - 1
+            and window_hash & app_snapshot_store.BOUNDARY_MASK == 0
+        ):
+            expected.append(position + 1)
+
+    monkeypatch.setattr(app_snapshot_store, "HASH_SEGMENT_SIZE", 4096)
+
+    assert app_snapshot_store._get_candidates(data).tolist() == expected
+
+
+def test_snapshot_store_packs_only_new_chunks_and_restores(
+    monkeypatch, tmp_path
+):
+    monkeypatch.setattr(
+        app_gpg_streams, "GPG_ARGUMENTS", _get_fake_gpg_arguments(tmp_path)
+    )
+    times = iter(["20261019T090000", "20261020T090000", "20261021T090000"])
+    strftime = app_snapshot_store.time.strftime
+    monkeypatch.setattr(
+        app_snapshot_store.time,
+        "strftime",
+        lambda format, *args: (
+            strftime(format, *args) if args else next(times)
+        ),
+    )
+    source = tmp_path / "HYPERSBI2"
+    (source / "layout").mkdir(parents=True)
+    (source / "empty").mkdir()
+    large = random.Random(0).randbytes(1024 * 1024)
+    (source / "layout" / "chart.bin").write_bytes(large)
+    (source / "portfolio.json").write_text("[1301]", encoding="utf-8")
+    store = app_snapshot_store.SnapshotStore(
+        str(tmp_path / "HYPERSBI2.store"), daily=2, weekly=0, threads=4
+    )
+    compress = app_snapshot_codecs.compress
+    compressing_threads = set()
+
+    def record_compress(data, codec):
+        compressing_threads.add(threading.current_thread().name)
+        return compress(data, codec)
+
+    monkeypatch.setattr(app_snapshot_codecs, "compress", record_compress)
+
+    store.create(str(source))
+    assert compressing_threads
+    assert threading.current_thread().name not in compressing_threads
+    (source / "layout" / "chart.bin").write_bytes(b"inserted" + large)
+    (source / "portfolio.json").write_text("[1301, 7203]", encoding="utf-8")
+    store.create(str(source))
+    store.create(str(source))
+
+    pack_sizes = sorted(
+        path.stat().st_size
+        for path in (tmp_path / "HYPERSBI2.store" / "packs").iterdir()
+    )
+    assert len(pack_sizes) == 2
+    assert pack_sizes[0] < pack_sizes[1] / 4
+    assert sorted(
+        path.name
+        for path in (tmp_path / "HYPERSBI2.store" / "snapshots").iterdir()
+    ) == ["20261020T090000.json.gpg", "20261021T090000.json.gpg"]
+    catalog = json.loads(
+        (tmp_path / "HYPERSBI2.store" / "snapshots.json").read_text(
+            encoding="utf-8"
+        )
+    )
+    assert [entry["name"] for entry in catalog] == [
+        "20261020T090000",
+        "20261021T090000",
+    ]
+    assert catalog[-1]["files"] == 2
+    assert catalog[-1]["size"] == len(large) + len("inserted[1301, 7203]")
+    listing = store.format_listing().splitlines()
+    assert listing[1].split()[:2] == ["20261021T090000", "2"]
+    assert listing[1].endswith(catalog[-1]["blake2b"][:16])
+
+    output = tmp_path / "restored"
+    assert store.restore(str(output)) == "20261021T090000"
+    assert (
+        output / "layout" / "chart.bin"
+    ).read_bytes() == b"inserted" + large
+    assert (output / "portfolio.json").read_text(encoding="utf-8") == (
+        "[1301, 7203]"
+    )
+    assert (output / "empty").is_dir()
+    assert store.verify().startswith("Verified ")
+
+    pack = max(
+        (tmp_path / "HYPERSBI2.store" / "packs").iterdir(),
+        key=lambda path: path.stat().st_size,
+    )
+    pack.write_bytes(pack.read_bytes()[:-1024])
+    try:
+        store.verify()
+    except UtilityOperationError as e:
+        message = str(e)
+    else:
+        raise AssertionError("Expected UtilityOperationError")
+
+    assert ": corrupt" in message
+
+
+def test_snapshot_store_restore_removes_stale_files_and_is_atomic(
+    monkeypatch, tmp_path
+):
+    monkeypatch.setattr(
+        app_gpg_streams, "GPG_ARGUMENTS", _get_fake_gpg_arguments(tmp_path)
+    )
+    source = tmp_path / "data" / "HYPERSBI2"
+    (source / "layout").mkdir(parents=True)
+    (source / "layout" / "chart.bin").write_bytes(
+        random.Random(0).randbytes(256 * 1024)
+    )
+    (source / "portfolio.json").write_text("[1301]", encoding="utf-8")
+    (source / "cache.tmp").write_text("cache", encoding="utf-8")
+    store = app_snapshot_store.SnapshotStore(str(tmp_path / "store"))
+    store.create(
+        str(source),
+        app_snapshot_sources.SourceFilter(exclude_patterns=["*.tmp"]),
+    )
+
+    output = tmp_path / "restore" / "HYPERSBI2"
+    shutil.copytree(source, output)
+    (output / "portfolio.json").write_text("[7203]", encoding="utf-8")
+    (output / "stale.json").write_text("stale", encoding="utf-8")
+    (output / "stale").mkdir()
+    (output / "stale" / "old.json").write_text("old", encoding="utf-8")
+    chart_inode = (output / "layout" / "chart.bin").stat().st_ino
+    decrypt_to_file = app_gpg_streams.decrypt_to_file
+    decrypted_paths = []
+
+    def record_decrypt_to_file(path, output_path):
+        decrypted_paths.append(Path(output_path))
+        decrypt_to_file(path, output_path)
+
+    monkeypatch.setattr(
+        app_gpg_streams, "decrypt_to_file", record_decrypt_to_file
+    )
+
+    store.restore(str(output))
+
+    assert (output / "layout" / "chart.bin").stat().st_ino == chart_inode
+    assert (output / "portfolio.json").read_text(encoding="utf-8") == "[1301]"
+    assert (output / "layout" / "chart.bin").read_bytes() == (
+        source / "layout" / "chart.bin"
+    ).read_bytes()
+    assert (output / "cache.tmp").read_text(encoding="utf-8") == "cache"
+    assert not (output / "stale.json").exists()
+    assert not (output / "stale").exists()
+    assert decrypted_paths
+    assert all(path.parent.parent == output.parent for path in decrypted_paths)
+
+    (output / "portfolio.json").write_text("[7203]", encoding="utf-8")
+    (output / "layout" / "chart.bin").write_bytes(b"edited")
+    (output / "stale.json").write_text("stale", encoding="utf-8")
+    pack = max(
+        (tmp_path / "store" / "packs").iterdir(),
+        key=lambda path: path.stat().st_size,
+    )
+    pack.write_bytes(pack.read_bytes()[:-1024])
+    try:
+        store.restore(str(output))
+    except UtilityOperationError as e:
+        message = str(e)
+    else:
+        raise AssertionError("Expected UtilityOperationError")
+
+    assert ": corrupt" in message
+    assert (output / "portfolio.json").read_text(encoding="utf-8") == "[7203]"
+    assert (output / "stale.json").exists()
+    assert sorted(path.name for path in output.parent.iterdir()) == [
+        "HYPERSBI2"
+    ]
+
+
+def test_snapshot_codecs_round_trip_parallel_xz_and_gzip(
+    monkeypatch, tmp_path
+):
+    monkeypatch.setattr(
+        app_gpg_streams, "GPG_ARGUMENTS", _get_fake_gpg_arguments(tmp_path)
+    )
+    monkeypatch.setattr(app_snapshot_codecs, "XZ_BLOCK_SIZE", 4096)
+    source = tmp_path / "data" / "HYPERSBI2"
+    source.mkdir(parents=True)
+    content = random.Random(0).randbytes(64 * 1024)
+    (source / "cache.bin").write_bytes(content)
+
+    for codec in ["xz", "gzip"]:
+        snapshots = tmp_path / f"snapshots_{codec}"
+        snapshots.mkdir()
+        output = tmp_path / f"restore_{codec}"
+        output.mkdir()
+        app_gpg_streams.archive_encrypt_directory(
+            str(source), str(snapshots), codec=codec, threads=4
+        )
+        (archive,) = snapshots.iterdir()
+        assert app_snapshot_codecs.get_codec(str(archive)) == codec
+        app_gpg_streams.decrypt_extract_file(str(archive), str(output))
+
+        assert (output / "HYPERSBI2" / "cache.bin").read_bytes() == content
+    assert (
+        tmp_path / "snapshots_xz" / "HYPERSBI2.tar.xz.gpg"
+    ).read_bytes().count(b"\xfd7zXZ\x00") > 1
+
+
+def test_snapshot_codecs_check_codec_reports_missing_zstandard(
+    monkeypatch,
+):
+    monkeypatch.setitem(sys.modules, "zstandard", None)
+
+    app_snapshot_codecs.check_codec("gzip")
+    for codec, expected in [
+        ("zstd", "pip install zstandard"),
+        ("bz2", "Unknown snapshot codec: bz2"),
+    ]:
+        try:
+            app_snapshot_codecs.check_codec(codec)
+        except UtilityOperationError as e:
+            message = str(e)
+        else:
+            raise AssertionError("Expected UtilityOperationError")
+
+        assert expected in message
+
+
+def test_snapshot_codecs_find_latest_archive(tmp_path):
+    source = "/data/HYPERSBI2"
+
+    assert app_snapshot_codecs.find_latest_archive(source, str(tmp_path)) == (
+        str(tmp_path / "HYPERSBI2.tar.xz.gpg")
+    )
+
+    older = tmp_path / "HYPERSBI2.tar.xz.gpg"
+    newer = tmp_path / "HYPERSBI2.tar.zst.gpg"
+    older.write_bytes(b"old")
+    newer.write_bytes(b"new")
+    os.utime(older, (1, 1))
+
+    assert app_snapshot_codecs.find_latest_archive(source, str(tmp_path)) == (
+        str(newer)
+    )
+    try:
+        app_snapshot_codecs.get_codec("HYPERSBI2.tar.bz2.gpg")
+    except UtilityOperationError:
+        pass
+    else:
+        raise AssertionError("Expected UtilityOperationError")
+
+
+def test_snapshot_catalog_keeps_daily_and_weekly_generations(tmp_path):
+    names = [
+        "20261001T090000",
+        "20261008T090000",
+        "20261014T090000",
+        "20261015T090000",
+        "20261016T080000",
+        "20261016T090000",
+    ]
+
+    assert app_snapshot_catalog.select_generations(names, 2, 2) == {
+        "20261015T090000",
+        "20261016T090000",
+        "20261008T090000",
+    }
+
+    catalog = app_snapshot_catalog.SnapshotCatalog(
+        "/data/HYPERSBI2", str(tmp_path), daily=2, weekly=2
+    )
+    for name in names:
+        archive = tmp_path / f"HYPERSBI2.{name}.tar.xz.gpg"
+        archive.write_bytes(name.encode())
+        catalog.add(name, str(archive), "xz")
+
+    assert [entry["name"] for entry in catalog.load()] == [
+        "20261008T090000",
+        "20261015T090000",
+        "20261016T090000",
+    ]
+    assert sorted(path.name for path in tmp_path.glob("*.gpg")) == [
+        "HYPERSBI2.20261008T090000.tar.xz.gpg",
+        "HYPERSBI2.20261015T090000.tar.xz.gpg",
+        "HYPERSBI2.20261016T090000.tar.xz.gpg",
+    ]
+    assert catalog.get_path() == str(
+        tmp_path / "HYPERSBI2.20261016T090000.tar.xz.gpg"
+    )
+    assert catalog.get_path("20261008T090000") == str(
+        tmp_path / "HYPERSBI2.20261008T090000.tar.xz.gpg"
+    )
+    assert (
+        catalog.format_listing()
+        .splitlines()[1]
+        .startswith("20261016T090000  xz")
+    )
+    try:
+        catalog.get_path("20261001T090000")
+    except UtilityOperationError:
+        pass
+    else:
+        raise AssertionError("Expected UtilityOperationError")
+
+
+def test_snapshot_catalog_keeps_archives_when_index_save_fails(
+    monkeypatch, tmp_path
+):
+    catalog = app_snapshot_catalog.SnapshotCatalog(
+        "/data/HYPERSBI2", str(tmp_path), daily=1, weekly=0
+    )
+    for name in ("20261015T090000", "20261016T090000"):
+        archive = tmp_path / f"HYPERSBI2.{name}.tar.xz.gpg"
+        archive.write_bytes(name.encode())
+    catalog.add(
+        "20261015T090000",
+        str(tmp_path / "HYPERSBI2.20261015T090000.tar.xz.gpg"),
+        "xz",
+    )
+
+    def fail_replace(source, destination):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(app_snapshot_catalog.os, "replace", fail_replace)
+    try:
+        catalog.add(
+            "20261016T090000",
+            str(tmp_path / "HYPERSBI2.20261016T090000.tar.xz.gpg"),
+            "xz",
+        )
+    except OSError as e:
+        message = str(e)
+    else:
+        raise AssertionError("Expected OSError")
+
+    assert message == "disk full"
+    assert [entry["name"] for entry in catalog.load()] == ["20261015T090000"]
+    assert (tmp_path / "HYPERSBI2.20261015T090000.tar.xz.gpg").is_file()
+    assert not list(tmp_path.glob(".*.tmp"))
+
+
+def test_checkpoint_store_rolls_back_changed_files_and_prunes(
+    monkeypatch, tmp_path
+):
+    def fail_reflink(source, destination):
+        raise OSError("unsupported")
+
+    monkeypatch.setattr(app_checkpoints, "_reflink", fail_reflink)
+    source = tmp_path / "data" / "HYPERSBI2"
+    (source / "layout").mkdir(parents=True)
+    (source / "layout" / "chart.json").write_text("chart", encoding="utf-8")
+    (source / "portfolio.json").write_text("[1301]", encoding="utf-8")
+    store = app_checkpoints.CheckpointStore(
+        str(source), str(tmp_path / "checkpoints"), number_of_checkpoints=2
+    )
+
+    name = store.create()
+    replacement = source / "portfolio.json.new"
+    replacement.write_text("[7203]", encoding="utf-8")
+    replacement.replace(source / "portfolio.json")
+    (source / "layout" / "chart.json").unlink()
+    (source / "added.json").write_text("{}", encoding="utf-8")
+
+    assert store.roll_back() == name
+    assert (source / "portfolio.json").read_text(encoding="utf-8") == (
+        "[1301]"
+    )
+    assert (source / "layout" / "chart.json").read_text(
+        encoding="utf-8"
+    ) == "chart"
+    assert not (source / "added.json").exists()
+    assert not (tmp_path / "data" / "HYPERSBI2.bak").exists()
+
+    store.create()
+    store.create()
+    assert len(store.get_names()) == 2
+    assert name not in store.get_names()
+    assert store.format_listing().splitlines()[1].split()[1] == "2"
+
+    assert store.format_listing().splitlines()[1].endswith("copy 2")
+
+    with open(source / "portfolio.json", "a", encoding="utf-8") as f:
+        f.write(" ")
+    name = store.get_names()[-1]
+    assert store.roll_back() == name
+    assert (source / "portfolio.json").read_text(encoding="utf-8") == (
+        "[1301]"
+    )
+
+    checkpoint_root = tmp_path / "checkpoints" / name / "HYPERSBI2"
+    with open(checkpoint_root / "portfolio.json", "a", encoding="utf-8") as f:
+        f.write(" ")
+    try:
+        store.roll_back()
+    except UtilityOperationError as e:
+        message = str(e)
+    else:
+        raise AssertionError("Expected UtilityOperationError")
+
+    assert message.endswith("HYPERSBI2/portfolio.json")
+
+
+def test_checkpoint_store_rolls_back_after_snapshot_restore(
+    monkeypatch, tmp_path
+):
+    def fail_reflink(source, destination):
+        raise OSError("unsupported")
+
+    monkeypatch.setattr(app_checkpoints, "_reflink", fail_reflink)
+    monkeypatch.setattr(
+        app_gpg_streams, "GPG_ARGUMENTS", _get_fake_gpg_arguments(tmp_path)
+    )
+    source = tmp_path / "data" / "HYPERSBI2"
+    source.mkdir(parents=True)
+    (source / "portfolio.json").write_text("[7203]", encoding="utf-8")
+    snapshot_store = app_snapshot_store.SnapshotStore(str(tmp_path / "store"))
+    snapshot_store.create(str(source))
+    (source / "portfolio.json").write_text("[1301]", encoding="utf-8")
+    store = app_checkpoints.CheckpointStore(
+        str(source), str(tmp_path / "checkpoints")
+    )
+
+    name = store.create()
+    snapshot_store.restore(str(source))
+
+    assert (source / "portfolio.json").read_text(encoding="utf-8") == "[7203]"
+    assert store.roll_back() == name
+    assert (source / "portfolio.json").read_text(encoding="utf-8") == "[1301]"
+
+    name = store.create()
+    with open(source / "portfolio.json", "a", encoding="utf-8") as f:
+        f.write(" ")
+
+    assert store.format_listing().splitlines()[1].endswith("copy 1")
+    assert store.roll_back() == name
+    assert (source / "portfolio.json").read_text(encoding="utf-8") == "[1301]"
+
+
+def test_snapshot_replication_sends_only_changed_blocks(monkeypatch, tmp_path):
+    snapshots = tmp_path / "snapshots"
+    replica = tmp_path / "replica"
+
+    assert app_snapshot_replication.replicate(
+        str(snapshots), "/data/HYPERSBI2", str(replica)
+    ).startswith("Replicated 0 file(s)")
+    assert not replica.exists()
+
+    (snapshots / "HYPERSBI2.store" / "packs").mkdir(parents=True)
+    (snapshots / "unrelated.zip").write_bytes(b"zip")
+    catalog = snapshots / "HYPERSBI2.store" / "snapshots.json"
+    block_size = app_snapshot_replication.BLOCK_SIZE
+    content = random.Random(0).randbytes(4 * block_size)
+    catalog.write_bytes(content)
+    index = snapshots / "HYPERSBI2.store" / "index.json.gpg"
+    index.write_bytes(b"index")
+    pack = snapshots / "HYPERSBI2.store" / "packs" / "old.gpg"
+    pack.write_bytes(b"old pack")
+
+    assert app_snapshot_replication.replicate(
+        str(snapshots), "/data/HYPERSBI2", str(replica)
+    ) == (
+        f"Replicated 3 file(s) to {replica}:"
+        f" {len(content) + 13} byte(s) sent, 0 byte(s) reused,"
+        f" {len(content) + 13} byte(s) written,"
+        f" {len(content) + 13} byte(s) read, 0 file(s) deleted."
+    )
+
+    updated = content[:1000] + b"inserted" + content[1000:] + b"+"
+    catalog.write_bytes(updated)
+    index.write_bytes(b"new index")
+    pack.unlink()
+    (snapshots / "HYPERSBI2.store" / "packs" / "new.gpg").write_bytes(b"new")
+    report = app_snapshot_replication.replicate(
+        str(snapshots), "/data/HYPERSBI2", str(replica)
+    )
+
+    # The blocks after the insertion are found at their shifted offsets.
+    assert report == (
+        f"Replicated 3 file(s) to {replica}:"
+        f" {block_size + 8 + 1 + 9 + 3} byte(s) sent,"
+        f" {3 * block_size} byte(s) reused,"
+        f" {len(updated) + 9 + 3} byte(s) written,"
+        f" {len(content) + 3 * block_size + len(updated) + 9 + 3} byte(s)"
+        " read, 1 file(s) deleted."
+    )
+    for name in ["snapshots.json", "index.json.gpg"]:
+        assert (replica / "HYPERSBI2.store" / name).read_bytes() == (
+            snapshots / "HYPERSBI2.store" / name
+        ).read_bytes()
+    assert sorted(
+        path.name for path in (replica / "HYPERSBI2.store" / "packs").iterdir()
+    ) == ["new.gpg"]
+    assert not (replica / "unrelated.zip").exists()
+    assert app_snapshot_replication.replicate(
+        str(snapshots), "/data/HYPERSBI2", str(replica)
+    ).startswith("Replicated 0 file(s)")
+
+    catalog.write_bytes(content)
+    hash_file = app_snapshot_replication._hash_file
+    monkeypatch.setattr(
+        app_snapshot_replication,
+        "_hash_file",
+        lambda path, statistics=None: (
+            "0" if path.endswith(".tmp") else hash_file(path)
+        ),
+    )
+    try:
+        app_snapshot_replication.replicate(
+            str(snapshots), "/data/HYPERSBI2", str(replica)
+        )
+    except UtilityOperationError as e:
+        message = str(e)
+    else:
+        raise AssertionError("Expected UtilityOperationError")
+
+    assert message.endswith("does not match it.")
+    assert (replica / "HYPERSBI2.store" / "snapshots.json").read_bytes() == (
+        updated
+    )
+    assert not [
+        path
+        for path in (replica / "HYPERSBI2.store").iterdir()
+        if path.name.endswith(".tmp")
+    ]
+
+
+def test_watchlist_history_rebuilds_versions_from_deltas(tmp_path):
+    source = tmp_path / "portfolio.json"
+    history = app_watchlist_history.WatchlistHistory(
+        str(source), str(tmp_path / "backups"), number_of_versions=40
+    )
+    versions = []
+    for index in range(45):
+        data = json.dumps(
+            {"list": [{"code": str(code)} for code in range(index + 30)]},
+            indent=index % 3,
+        ).encode("utf-8") + (b"\xff" if index % 5 == 0 else b"")
+        source.write_bytes(data)
+        versions.append(data)
+        assert history.record() == index + 1
+    assert history.record() is None
+
+    records = [
+        json.loads(line)
+        for line in Path(history.path).read_text(encoding="utf-8").splitlines()
+    ]
+    assert [record["version"] for record in records] == list(range(6, 46))
+    assert "full" in records[0] and "delta" in records[1]
+    for version in (6, 33, 45):
+        assert history.get(version) == versions[version - 1]
+
+    with open(history.path, "a", encoding="utf-8") as f:
+        f.write('{"version": 46, "ti')
+    assert history.get(45) == versions[44]
+
+    history.restore(10)
+    assert source.read_bytes() == versions[9]
+    assert history.get(45) == versions[44]
+    assert history.record() == 46
+    try:
+        history.get(5)
+    except UtilityOperationError:
+        pass
+    else:
+        raise AssertionError("Expected UtilityOperationError")
+
+
+def test_watchlist_history_checks_index_before_reading_history(
+    monkeypatch, tmp_path
+):
+    source = tmp_path / "portfolio.json"
+    history = app_watchlist_history.WatchlistHistory(
+        str(source), str(tmp_path / "backups"), number_of_versions=2
+    )
+    for index in range(3):
+        source.write_text(f"[{index}]", encoding="utf-8")
+        assert history.record() == index + 1
+    index = json.loads(Path(history.index_path).read_text(encoding="utf-8"))
+    assert index == {
+        "version": 3,
+        "blake2b": hashlib.blake2b(b"[2]").hexdigest(),
+        "size": os.path.getsize(history.path),
+    }
+
+    load = app_watchlist_history.WatchlistHistory._load
+    monkeypatch.setattr(
+        app_watchlist_history.WatchlistHistory,
+        "_load",
+        lambda self: (_ for _ in ()).throw(
+            AssertionError("the history should not be read")
+        ),
+    )
+    assert history.record() is None
+
+    monkeypatch.setattr(app_watchlist_history.WatchlistHistory, "_load", load)
+    with open(history.path, "a", encoding="utf-8") as f:
+        f.write('{"version": 4, "ti')
+    assert history.record() is None
+    source.write_text("[3]", encoding="utf-8")
+    assert history.record() == 4
+    assert [
+        json.loads(line)["version"]
+        for line in Path(history.path).read_text(encoding="utf-8").splitlines()
+    ] == [3, 4]
+
+
 def test_manage_snapshots_raises_process_state_error(monkeypatch):
     args = SimpleNamespace(d=True, D=False)
     trade = SimpleNamespace(process="HYPERSBI2")
@@ -379,6 +2648,7 @@ def test_run_watchlist_backup_raises_when_watchlist_file_missing(
 ):
     args = SimpleNamespace(
         P=("SBI Securities", "HYPERSBI2"),
+        profile=None,
         BS=False,
         G=False,
         O=False,
@@ -390,6 +2660,20 @@ def test_run_watchlist_backup_raises_when_watchlist_file_missing(
         S=False,
         o=False,
         w=True,
+        list_watchlist_versions=False,
+        restore_watchlists=None,
+        browser_service=False,
+        simulate=None,
+        verify_snapshot=False,
+        replicate=False,
+        list_snapshots=False,
+        checkpoint=False,
+        list_checkpoints=False,
+        rollback=None,
+        snapshot_report=False,
+        snapshot=None,
+        benchmark_codecs=False,
+        latency_report=False,
         d=False,
         D=False,
     )
@@ -398,6 +2682,7 @@ def test_run_watchlist_backup_raises_when_watchlist_file_missing(
     config[trade.process] = {
         "watchlists": "",
         "backup_directory": tmp_path.as_posix(),
+        "number_of_watchlist_versions": "500",
     }
     missing_watchlists = tmp_path / "application" / "portfolio.json"
 
@@ -422,10 +2707,10 @@ def test_run_watchlist_backup_raises_when_watchlist_file_missing(
         ].update({"watchlists": missing_watchlists.as_posix()}),
     )
     monkeypatch.setattr(
-        trading_peripheral.file_utilities,
-        "backup_file",
-        lambda *args, **kwargs: (_ for _ in ()).throw(
-            AssertionError("backup_file should not be called")
+        app_watchlist_history.WatchlistHistory,
+        "record",
+        lambda self: (_ for _ in ()).throw(
+            AssertionError("record should not be called")
         ),
     )
 
@@ -458,7 +2743,7 @@ def test_order_status_raises_market_data_error_on_parse_failure(monkeypatch):
 
     try:
         app_order_status.extract_sbi_securities_order_status(
-            trade, config, driver
+            trade, config, driver.page_source
         )
     except MarketDataError as e:
         message = str(e)
@@ -501,7 +2786,7 @@ def _assert_order_status_market_data_error(monkeypatch, trade, config, df):
 
     try:
         app_order_status.extract_sbi_securities_order_status(
-            trade, config, driver
+            trade, config, driver.page_source
         )
     except MarketDataError as e:
         message = str(e)
@@ -559,7 +2844,9 @@ def test_order_status_extracts_default_columns_and_weighted_prices(
         fake_to_clipboard,
     )
 
-    app_order_status.extract_sbi_securities_order_status(trade, config, driver)
+    app_order_status.extract_sbi_securities_order_status(
+        trade, config, driver.page_source
+    )
 
     assert captured["rows"] == [
         [
@@ -923,7 +3210,7 @@ def test_insert_maintenance_schedules_falls_back_without_last_modified(
         lambda *args, **kwargs: write_calls.append((args, kwargs)),
     )
 
-    trading_peripheral.insert_maintenance_schedules(trade, config)
+    app_maintenance.insert_maintenance_schedules(trade, config)
 
     assert response.encoding == "utf-8"
     assert calendar_calls
@@ -977,7 +3264,7 @@ def test_insert_maintenance_schedules_recovers_from_head_failure(
         lambda *args, **kwargs: None,
     )
 
-    trading_peripheral.insert_maintenance_schedules(trade, config)
+    app_maintenance.insert_maintenance_schedules(trade, config)
 
     assert response.encoding == "utf-8"
 
@@ -1067,7 +3354,7 @@ def test_insert_maintenance_schedules_persists_progress_on_insert_failure(
     )
 
     try:
-        trading_peripheral.insert_maintenance_schedules(trade, config)
+        app_maintenance.insert_maintenance_schedules(trade, config)
     except ExternalServiceError as e:
         message = str(e)
     else:
@@ -1170,7 +3457,7 @@ def test_insert_maintenance_schedules_retries_without_duplicate_events(
             ),
         )
         try:
-            trading_peripheral.insert_maintenance_schedules(trade, config)
+            app_maintenance.insert_maintenance_schedules(trade, config)
         except ExternalServiceError as e:
             assert str(e) == "config write failed"
         else:
@@ -1249,7 +3536,7 @@ def test_insert_maintenance_schedules_raises_for_missing_function_node(
     )
 
     try:
-        trading_peripheral.insert_maintenance_schedules(trade, config)
+        app_maintenance.insert_maintenance_schedules(trade, config)
     except ScraperError as e:
         message = str(e)
     else:
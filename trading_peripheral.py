@@ -2,16 +2,10 @@
 
 import os
 import sys
-import time
 
+from app import profiling
 from app.cli import get_arguments
 from app.config import configure, configure_exit, ensure_watchlists_path
-from app.maintenance import insert_maintenance_schedules
-from app.monitoring import check_web_page_send_email_message
-from app.order_status import (
-    BROKERAGE_ORDER_STATUS_FUNCTIONS,
-    extract_unsupported_brokerage_order_status,
-)
 from core_utilities import (
     file_utilities,
     initializer,
@@ -20,14 +14,15 @@ from core_utilities import (
 from core_utilities.config_common import ConfigError
 from core_utilities.config_validation import ensure_section_exists
 from core_utilities.errors import (
+    ConfigBuildError,
     CoreUtilitiesError,
     ProcessStateError,
     UtilityOperationError,
 )
-from web_utilities import browser_driver
 
-BROWSER_ACTION_MAX_ATTEMPTS = 3
-BROWSER_ACTION_RETRY_INTERVAL = 10
+# Modules that pull in pandas, lxml, requests, Google clients, or Selenium are
+# imported inside the functions that need them so that quick commands such as
+# '-w', '-C', and '-h' start without loading them.
 
 
 class Trade(initializer.Initializer):
@@ -42,124 +37,405 @@ class Trade(initializer.Initializer):
         self.order_status_section = f"{self.vendor} Order Status"
         self.brokerage_variables_section = f"{self.vendor} Variables"
         self.release_notes_section = f"{self.process} Release Notes"
-        self.instruction_items = {
-            "all_keys": list(browser_driver._COMMAND_DISPATCH),
+
+    @property
+    def instruction_items(self):
+        """Return the browser instruction completions for action prompts."""
+        from app import browser_actions, browser_waits
+        from web_utilities import browser_driver
+
+        return {
+            "all_keys": list(browser_driver._COMMAND_DISPATCH)
+            + list(browser_waits.COMMANDS)
+            + [browser_actions.SUBMIT_COMMAND],
             "control_flow_keys": {"exist", "for"},
             "additional_value_keys": {"send_keys"},
             "no_value_keys": {"refresh"},
         }
 
 
+def _get_order_status_over_http(trade, config, cache, program):
+    """Fetch the order status page with the cached session cookies."""
+    from app import http_replay, session_cache
+
+    if not config["General"].getboolean("fetch_order_status_over_http"):
+        return None
+
+    login_length = session_cache.get_login_length(program)
+    if not login_length:
+        return None
+
+    return http_replay.fetch_page(
+        cache.load(),
+        "order_status_url",
+        program[login_length - 1][1],
+        required_text=config[trade.order_status_section]["table_identifier"],
+    )
+
+
 def _run_browser_actions(args, trade, config):
     """Execute browser-based actions using a Selenium WebDriver."""
+    from app import (
+        action_programs,
+        browser_actions,
+        browser_session,
+        firefox_profile,
+        latency_history,
+        session_cache,
+    )
+    from app.order_status import (
+        BROKERAGE_ORDER_STATUS_FUNCTIONS,
+        extract_unsupported_brokerage_order_status,
+    )
+
     ensure_section_exists(config, trade.actions_section)
-    # The browser driver may crash on an unsettled system after hibernation
-    # resume, leaving the driver in a broken state, so wrap both initialize()
-    # and execute_action() in the retry loop.
-    for attempt in range(1, BROWSER_ACTION_MAX_ATTEMPTS + 1):
-        driver = None
-        try:
-            driver = browser_driver.initialize(
-                firefox_profile_directory=config["General"][
-                    "firefox_profile_directory"
-                ],
-            )
-            if args.s:
-                browser_driver.execute_action(
-                    driver,
-                    config[trade.actions_section][
-                        f"replace_{trade.vendor}_watchlists"
-                    ],
-                    wait_timeout=float(config["General"]["wait_timeout"]),
-                )
-            if args.S:
-                browser_driver.execute_action(
-                    driver,
-                    config[trade.actions_section][
-                        f"replace_{trade.process}_watchlists"
-                    ],
-                    wait_timeout=float(config["General"]["wait_timeout"]),
-                )
-            if args.o:
-                browser_driver.execute_action(
-                    driver,
-                    config[trade.actions_section]["get_order_status"],
-                    wait_timeout=float(config["General"]["wait_timeout"]),
-                )
+    # Validate every program before any browser starts.
+    programs = action_programs.load_programs(
+        config[trade.actions_section],
+        trade.instruction_items,
+        action_programs.get_cache_path(trade),
+    )
+    cache = session_cache.SessionCache(
+        session_cache.get_cache_path(trade),
+        fingerprint=config["General"]["fingerprint"],
+        lifetime=float(config["General"]["session_cache_lifetime"]),
+    )
+    # Both watchlist replacements touch the same watchlists, so they share
+    # one session, while the order status can run in another.
+    watchlist_actions = [
+        (option, programs[config.optionxform(option)], None)
+        for is_selected, option in (
+            (args.s, f"replace_{trade.vendor}_watchlists"),
+            (args.S, f"replace_{trade.process}_watchlists"),
+        )
+        if is_selected
+    ]
+    groups = [watchlist_actions] if watchlist_actions else []
+    if args.o:
+
+        def extract_order_status(page_source):
+            with profiling.span("extract order status", "parse"):
                 if trade.vendor in BROKERAGE_ORDER_STATUS_FUNCTIONS:
                     BROKERAGE_ORDER_STATUS_FUNCTIONS[trade.vendor](
-                        trade, config, driver
+                        trade, config, page_source
                     )
                 else:
                     extract_unsupported_brokerage_order_status(trade.vendor)
-            break
-        except Exception as e:
-            if attempt == BROWSER_ACTION_MAX_ATTEMPTS:
-                raise
-            print(
-                f"Attempt {attempt} failed: {e}\n"
-                f"Retrying in {BROWSER_ACTION_RETRY_INTERVAL}s..."
+
+        def finish_order_status(driver):
+            extract_order_status(driver.page_source)
+            cache.remember(driver, order_status_url=driver.current_url)
+
+        program = programs["get_order_status"]
+        page_source = _get_order_status_over_http(
+            trade, config, cache, program
+        )
+        if page_source is None:
+            groups.append([("get_order_status", program, finish_order_status)])
+        else:
+            extract_order_status(page_source)
+
+    if not groups:
+        return
+
+    state_path = browser_session.get_state_path(trade)
+    profile_directory = firefox_profile.get_profile_path(trade)
+
+    def initialize(index):
+        # Only the first session may attach to the warm session, and each
+        # Firefox instance needs a profile directory of its own.
+        if index == 0:
+            return browser_session.start(config, state_path, profile_directory)
+        return browser_session.initialize(
+            config, f"{profile_directory}_{index}"
+        )
+
+    browser_actions.run_actions_concurrently(
+        initialize,
+        groups,
+        wait_timeout=float(config["General"]["wait_timeout"]),
+        cache=cache,
+        history=latency_history.LatencyHistory(
+            latency_history.get_history_path(trade)
+        ),
+        max_sessions=int(config["General"]["max_browser_sessions"]),
+        is_batching=config["General"].getboolean("batch_browser_instructions"),
+    )
+
+
+def _simulate_action(trade, config, name, snapshot_directory):
+    """Simulate an action program on recorded HTML snapshots."""
+    from app import action_programs, action_simulator
+
+    ensure_section_exists(config, trade.actions_section)
+    programs = action_programs.load_programs(
+        config[trade.actions_section],
+        trade.instruction_items,
+        action_programs.get_cache_path(trade),
+    )
+    if config.optionxform(name) not in programs:
+        raise ConfigBuildError(f"Action does not exist: {name}")
+    print(
+        action_simulator.simulate(
+            programs[config.optionxform(name)], name, snapshot_directory
+        )
+    )
+
+
+def _get_checkpoint_store(trade, config):
+    """Return the local checkpoint store of the process application data."""
+    from app import checkpoints
+
+    return checkpoints.CheckpointStore(
+        config[trade.process]["application_data_directory"],
+        config[trade.process]["checkpoint_directory"],
+        number_of_checkpoints=int(
+            config[trade.process]["number_of_checkpoints"]
+        ),
+    )
+
+
+def _manage_checkpoints(args, trade, config):
+    """Create, list, or roll back local checkpoints."""
+    ensure_section_exists(config, trade.process)
+    store = _get_checkpoint_store(trade, config)
+    if args.list_checkpoints:
+        print(store.format_listing())
+    if args.checkpoint or args.rollback is not None:
+        if process_utilities.is_running(trade.process):
+            raise ProcessStateError(f"'{trade.process}' is running.")
+        if args.checkpoint:
+            with profiling.span("create checkpoint", "file"):
+                store.create()
+        if args.rollback is not None:
+            with profiling.span("roll back checkpoint", "file"):
+                store.roll_back(args.rollback or None)
+
+
+def _manage_watchlist_history(args, trade, config):
+    """Back up, list, or restore the versions of the process watchlists."""
+    from app import watchlist_history
+
+    ensure_watchlists_path(config, trade)
+    watchlists = config[trade.process]["watchlists"]
+    history = watchlist_history.WatchlistHistory(
+        watchlists,
+        backup_directory=config[trade.process]["backup_directory"],
+        number_of_versions=int(
+            config[trade.process]["number_of_watchlist_versions"]
+        ),
+    )
+    if args.w:
+        if not os.path.isfile(watchlists):
+            raise UtilityOperationError(
+                f"Watchlist file does not exist: {watchlists}"
             )
-            time.sleep(BROWSER_ACTION_RETRY_INTERVAL)
-        finally:
-            if driver is not None:
-                driver.quit()
+        history.record()
+    if args.list_watchlist_versions:
+        print(history.format_listing())
+    if args.restore_watchlists:
+        if process_utilities.is_running(trade.process):
+            raise ProcessStateError(f"'{trade.process}' is running.")
+        history.restore(args.restore_watchlists)
 
 
 def _manage_snapshots(args, trade, config):
-    """Archive or restore the process application data."""
+    """Archive, list, verify, or restore the process application data."""
+    from app import (
+        gpg_streams,
+        snapshot_catalog,
+        snapshot_codecs,
+        snapshot_sources,
+    )
+
     ensure_section_exists(config, trade.process)
-    if process_utilities.is_running(trade.process):
+    if (args.d or args.D) and process_utilities.is_running(trade.process):
         raise ProcessStateError(f"'{trade.process}' is running.")
     application_data_directory = config[trade.process][
         "application_data_directory"
     ]
     snapshot_directory = config[trade.process]["snapshot_directory"]
     fingerprint = config["General"]["fingerprint"]
+    codec = config[trade.process]["snapshot_codec"]
     if args.d:
-        file_utilities.archive_encrypt_directory(
-            application_data_directory,
-            snapshot_directory,
+        snapshot_codecs.check_codec(codec)
+    threads = int(config[trade.process]["snapshot_threads"])
+    source_filter = snapshot_sources.SourceFilter.from_section(
+        config[trade.process]
+    )
+    if args.snapshot_report:
+        print(
+            snapshot_sources.format_report(
+                snapshot_sources.scan(
+                    application_data_directory, source_filter, threads
+                )
+            )
+        )
+    catalog = snapshot_catalog.SnapshotCatalog(
+        application_data_directory,
+        snapshot_directory,
+        daily=int(config[trade.process]["daily_snapshots"]),
+        weekly=int(config[trade.process]["weekly_snapshots"]),
+    )
+    store = None
+    if config[trade.process].getboolean("deduplicate_snapshots"):
+        from app import snapshot_store
+
+        store = snapshot_store.SnapshotStore(
+            snapshot_store.get_store_path(
+                application_data_directory, snapshot_directory
+            ),
             fingerprint=fingerprint,
+            daily=int(config[trade.process]["daily_snapshots"]),
+            weekly=int(config[trade.process]["weekly_snapshots"]),
+            codec=codec,
+            threads=threads,
         )
+        if args.d:
+            with profiling.span("create snapshot", "file"):
+                store.create(application_data_directory, source_filter)
+        # Snapshots taken before deduplication are still verified and
+        # restored from their archive.
+        if not store.exists():
+            store = None
+    elif args.d:
+        generation = snapshot_catalog.get_generation_name()
+        with profiling.span("create snapshot", "file"):
+            catalog.add(
+                generation,
+                gpg_streams.archive_encrypt_directory(
+                    application_data_directory,
+                    snapshot_directory,
+                    fingerprint=fingerprint,
+                    codec=codec,
+                    threads=threads,
+                    generation=generation,
+                    source_filter=source_filter,
+                ),
+                codec,
+            )
+    if args.d or args.replicate:
+        from app import snapshot_replication
+
+        for target_directory in config[trade.process][
+            "replication_directories"
+        ].splitlines():
+            if target_directory.strip():
+                print(
+                    snapshot_replication.replicate(
+                        snapshot_directory,
+                        application_data_directory,
+                        target_directory.strip(),
+                    )
+                )
+    if args.list_snapshots:
+        print(store.format_listing() if store else catalog.format_listing())
+    if args.verify_snapshot:
+        with profiling.span("verify snapshot", "file"):
+            print(
+                store.verify(args.snapshot)
+                if store
+                else gpg_streams.verify_archive(
+                    catalog.get_path(args.snapshot)
+                )
+            )
     if args.D:
-        snapshot = os.path.join(
-            snapshot_directory,
-            os.path.basename(application_data_directory) + ".tar.xz.gpg",
-        )
-        output_directory = os.path.dirname(application_data_directory)
-        file_utilities.decrypt_extract_file(snapshot, output_directory)
+        if config[trade.process].getboolean(
+            "checkpoint_before_restore"
+        ) and os.path.isdir(application_data_directory):
+            with profiling.span("create checkpoint", "file"):
+                _get_checkpoint_store(trade, config).create()
+        with profiling.span("restore snapshot", "file"):
+            if store:
+                store.restore(application_data_directory, args.snapshot)
+            else:
+                gpg_streams.decrypt_extract_file(
+                    catalog.get_path(args.snapshot),
+                    os.path.dirname(application_data_directory),
+                )
 
 
-def run():
-    """Execute the main program based on command-line arguments."""
-    args = get_arguments()
+def _run_tasks(args):
+    """Execute the tasks selected by the command-line arguments."""
     trade = Trade(*args.P)
     if file_utilities.create_launchers_exit(args, __file__):
         return
     configure_exit(args, trade)
-    config = configure(trade)
-    if args.r:
-        check_web_page_send_email_message(
-            trade, config, trade.release_notes_section
+    with profiling.span("configure", "config"):
+        config = configure(trade)
+    if args.simulate:
+        _simulate_action(trade, config, *args.simulate)
+        return
+    if args.benchmark_codecs:
+        from app import snapshot_codecs
+
+        ensure_section_exists(config, trade.process)
+        print(
+            snapshot_codecs.benchmark(
+                int(config[trade.process]["snapshot_threads"])
+            )
         )
-    if args.m:
-        insert_maintenance_schedules(trade, config)
-    if any((args.s, args.S, args.o)):
-        _run_browser_actions(args, trade, config)
-    if args.w:
-        ensure_watchlists_path(config, trade)
-        watchlists = config[trade.process]["watchlists"]
-        if not os.path.isfile(watchlists):
-            raise UtilityOperationError(
-                f"Watchlist file does not exist: {watchlists}"
+        return
+    if args.latency_report:
+        from app import latency_history
+
+        print(
+            latency_history.format_report(
+                latency_history.get_history_path(trade)
             )
-        file_utilities.backup_file(
-            watchlists,
-            backup_directory=config[trade.process]["backup_directory"],
         )
-    if args.d or args.D:
-        _manage_snapshots(args, trade, config)
+        return
+    if args.browser_service:
+        from app import browser_session, firefox_profile
+
+        browser_session.serve(
+            config,
+            browser_session.get_state_path(trade),
+            firefox_profile.get_profile_path(trade),
+        )
+        return
+    if args.r:
+        with profiling.task("release notes"):
+            from app.monitoring import check_web_page_send_email_message
+
+            check_web_page_send_email_message(
+                trade, config, trade.release_notes_section
+            )
+    if args.m:
+        with profiling.task("maintenance schedules"):
+            from app.maintenance import insert_maintenance_schedules
+
+            insert_maintenance_schedules(trade, config)
+    if any((args.s, args.S, args.o)):
+        with profiling.task("browser actions"):
+            _run_browser_actions(args, trade, config)
+    if args.w or args.list_watchlist_versions or args.restore_watchlists:
+        with profiling.task("watchlist backup"):
+            _manage_watchlist_history(args, trade, config)
+    if (
+        args.d
+        or args.D
+        or args.verify_snapshot
+        or args.replicate
+        or args.list_snapshots
+        or args.snapshot_report
+    ):
+        with profiling.task("snapshots"):
+            _manage_snapshots(args, trade, config)
+    if args.checkpoint or args.list_checkpoints or args.rollback is not None:
+        with profiling.task("checkpoints"):
+            _manage_checkpoints(args, trade, config)
+
+
+def run():
+    """Execute the main program based on command-line arguments."""
+    args = get_arguments()
+    if args.profile:
+        profiling.enable(args.profile, is_profiling_tasks=args.cprofile)
+    try:
+        _run_tasks(args)
+    finally:
+        profiling.disable()
 
 
 def main():